@@ -0,0 +1,84 @@
+import sys
+import os
+import time
+import logging
+
+# All because vscode debugger or whatever
+thisdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(thisdir)
+sys.path.append(parentdir)  # Add the parent directory to the Python path
+
+import arduboy.serial
+import arduboy.simulator
+
+# Time the serial operations against a simulated bootloader. The defaults are roughly what I see on a 
+# real arduboy over USB: about a millisecond per round trip and well under 1MB/s of actual throughput
+LATENCY = float(sys.argv[1]) if len(sys.argv) > 1 else 0.001
+BANDWIDTH = int(sys.argv[2]) if len(sys.argv) > 2 else 500_000
+
+logging.basicConfig(level=logging.WARNING)
+
+def make_device():
+    # 1MiB chip so the full backup doesn't take forever
+    return arduboy.simulator.SimulatedBootloader(bytes([0xEF, 0x40, 0x14]), latency = LATENCY, bandwidth = BANDWIDTH)
+
+def bench(name, func):
+    device = make_device()
+    start = time.perf_counter()
+    func(device)
+    print(f"{name:<30} {time.perf_counter() - start:8.3f}s")
+
+sketch = bytearray(os.urandom(28 * 1024))
+fxdata = bytearray(os.urandom(512 * 1024))
+
+print(f"Latency {LATENCY * 1000}ms, bandwidth {BANDWIDTH} bytes/s")
+bench("Sketch flash (per page)", lambda d: arduboy.serial.flash_arduhex(sketch, d, None, window = 1))
+bench("Sketch flash (pipelined)", lambda d: arduboy.serial.flash_arduhex(sketch, d, None))
+bench("Sketch verify", lambda d: (arduboy.serial.flash_arduhex(sketch, d, None), arduboy.serial.verify_arduhex(sketch, d, None)))
+FLASH_PAGE_TIME = 0.004
+def sketch_edit(device, func):
+    # Edit-upload loop: most of the sketch stays put between uploads
+    device.program[:len(sketch)] = sketch
+    device.flash_page_time = FLASH_PAGE_TIME
+    edited = sketch.copy()
+    edited[20000:20100] = os.urandom(100)
+    func(edited, device)
+bench("Sketch reflash (all pages)", lambda d: sketch_edit(d, lambda data, d: arduboy.serial.flash_arduhex(data, d, None)))
+bench("Sketch reflash (changed only)", lambda d: sketch_edit(d, arduboy.serial.flash_arduhex_changed))
+def eeprom_save(device, func):
+    # A typical save restore: the eeprom is mostly the same, a few bytes of a save differ
+    eeprom = bytearray(os.urandom(1024))
+    device.eeprom[:] = eeprom
+    eeprom[100:116] = os.urandom(16)
+    func(eeprom, device)
+EEPROM_BYTE_TIME = 0.0033
+bench("EEPROM save restore (full)", lambda d: (setattr(d, "eeprom_byte_time", EEPROM_BYTE_TIME), eeprom_save(d, arduboy.serial.write_eeprom)))
+bench("EEPROM save restore (diff)", lambda d: (setattr(d, "eeprom_byte_time", EEPROM_BYTE_TIME), eeprom_save(d, arduboy.serial.write_eeprom_diff)))
+bench("FX flash 512KiB", lambda d: arduboy.serial.flash_fx(fxdata, 0, d))
+bench("FX backup 1MiB", lambda d: arduboy.serial.backup_fx(d))
+
+import arduboy.fxcart
+def makeslot(title, datalen):
+    return arduboy.fxcart.FxParsedSlot(0, bytearray(1024), bytearray(os.urandom(20000)), bytearray(os.urandom(datalen)), bytearray(), 
+                                       arduboy.fxcart.FxSlotMeta(title, "1.0", "bench", ""))
+logging.getLogger().setLevel(logging.ERROR) # Random programs can't be menu patched, don't care
+slots = [ makeslot("Bootloader", 0), makeslot("Games", 0) ] + [ makeslot(f"Game {i}", 50000) for i in range(12) ]
+for s in slots[:2]:
+    s.program_raw = bytearray()
+cart = arduboy.fxcart.compile(slots)
+slots[4].data_raw[0] ^= 0xFF
+slots[9].data_raw[0] ^= 0xFF
+updated = arduboy.fxcart.compile(slots)
+def cart_update(device, func):
+    device.fx[:len(cart)] = cart
+    func(device)
+bench("FX cart update (full)", lambda d: cart_update(d, lambda d: arduboy.serial.flash_fx(updated, 0, d)))
+bench("FX cart update (sync)", lambda d: cart_update(d, lambda d: arduboy.serial.sync_fx(updated, d)))
+for s in slots[2:]:
+    s.save_raw = bytearray(4096)
+savecart = arduboy.fxcart.compile(slots)
+def saves_backup(device, func):
+    device.fx[:len(savecart)] = savecart
+    func(device)
+bench("FX saves (full backup)", lambda d: saves_backup(d, arduboy.serial.backup_fx))
+bench("FX saves (harvest)", lambda d: saves_backup(d, arduboy.serial.harvest_fx_saves))
@@ -0,0 +1,25 @@
+import sys
+import os
+
+# All because vscode debugger or whatever
+thisdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(thisdir)
+sys.path.append(parentdir)  # Add the parent directory to the Python path
+
+import arduboy.fxcart
+
+# Print what changed between two cart binaries. Exits with 1 if there are any changes, so it can gate things
+if len(sys.argv) < 3:
+    print("Must provide the old and new cart files on the command line")
+    exit(99)
+
+with arduboy.fxcart.CartFile(sys.argv[1]) as old, arduboy.fxcart.CartFile(sys.argv[2]) as new:
+    changes = arduboy.fxcart.diff(old.data, new.data)
+    for change in changes:
+        print(change)
+
+if changes:
+    print(f"{len(changes)} slots changed")
+    exit(1)
+else:
+    print("No differences found between the carts.")
@@ -0,0 +1,37 @@
+import sys
+import os
+import logging
+
+# All because vscode debugger or whatever
+thisdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(thisdir)
+sys.path.append(parentdir)  # Add the parent directory to the Python path
+
+import arduboy.arduhex
+import arduboy.common
+import arduboy.fxcart
+import arduboy.job
+
+# Flash a sketch (and optionally FX dev data) to every connected arduboy at once, then print how each went.
+# Usage: flashstation.py sketch.hex [fxdata.bin]
+if len(sys.argv) < 2:
+    print("Must provide the sketch hex (and optionally fx data) on the command line")
+    exit(99)
+
+logging.basicConfig(level=logging.INFO)
+
+ardparsed = arduboy.arduhex.read_hex(sys.argv[1])
+bindata = arduboy.common.hex_to_bin(ardparsed.binaries[0].hex_raw)
+steps = [ arduboy.job.flash_sketch_step(bindata), arduboy.job.verify_sketch_step(bindata) ]
+if len(sys.argv) > 2:
+    steps.append(arduboy.job.flash_fx_step(arduboy.fxcart.read_data(sys.argv[2])))
+steps.append(arduboy.job.exit_step())
+
+results = arduboy.job.run_job_on_all(steps)
+for result in results:
+    jedec = result.jedec_id.hex() if result.jedec_id else "------"
+    print(f"{result.port:<20} {jedec} {result.seconds:6.2f}s {'VERIFIED' if result.verified else 'OK' if result.ok else 'FAILED: ' + result.error}")
+
+failed = sum(1 for r in results if not r.ok)
+print(f"{len(results) - failed} of {len(results)} devices flashed")
+exit(1 if failed else 0)
@@ -0,0 +1,30 @@
+import sys
+import os
+
+# All because vscode debugger or whatever
+thisdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(thisdir)
+sys.path.append(parentdir)  # Add the parent directory to the Python path
+
+import arduboy.fxsparse
+
+from arduboy.constants import *
+
+# Convert full FX backups (.bin) to sparse backups and back. Sparse backups go back to .bin one block at a time
+if len(sys.argv) < 2:
+    print("Must provide the backup files to convert on the command line (.bin -> .fxsparse, .fxsparse -> .bin)")
+    exit(99)
+
+for filename in sys.argv[1:]:
+    base, extension = os.path.splitext(filename)
+    if extension == arduboy.fxsparse.FXSPARSE_EXTENSION:
+        with arduboy.fxsparse.SparseFxFile(filename) as backup, open(base + ".bin", "wb") as f:
+            for _, data in backup.blocks():
+                f.write(data)
+        print(f"{filename} -> {base}.bin")
+    else:
+        with open(filename, "rb") as f:
+            data = f.read()
+        outfile = base + arduboy.fxsparse.FXSPARSE_EXTENSION
+        arduboy.fxsparse.write_file(outfile, data)
+        print(f"{filename} -> {outfile} ({os.path.getsize(outfile) * 100 // max(1, len(data))}% of the size)")
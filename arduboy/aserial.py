@@ -0,0 +1,309 @@
+# asyncio versions of the operations in arduboy.serial, so one event loop can drive many devices without a
+# thread per port. Every long operation returns an AsyncOperation: await it for the result, or iterate it
+# with "async for current, total in operation" to get progress as it goes (its result is then in .result).
+# Cancelling the task running an operation stops it at the next block boundary, never in the middle of a
+# bootloader command, so the device is left ready for more commands.
+import asyncio
+import logging
+import os
+import time
+import arduboy.arduhex
+import arduboy.common
+import arduboy.fxcart
+import arduboy.serial
+
+from arduboy.constants import *
+from arduboy.serial import JedecInfo, address_command, fx_address_command, fx_read_command, fx_write_command, flash_read_command, flash_write_command
+
+
+class AsyncSerial:
+    """
+    A serial port driven by the event loop, for unix-likes (the port's file descriptor is watched directly).
+    Use open_serial to get one. Reads return exactly the requested amount, unless timeout passes first.
+    """
+
+    def __init__(self, s_port, timeout = None):
+        self.s_port = s_port
+        self.port = s_port.port
+        self.timeout = timeout
+        self._fd = s_port.fileno()
+        os.set_blocking(self._fd, False)
+
+    async def _wait_fd(self, add, remove):
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        add(self._fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            remove(self._fd)
+
+    async def _read(self, size):
+        loop = asyncio.get_running_loop()
+        result = bytearray()
+        while len(result) < size:
+            try:
+                chunk = os.read(self._fd, size - len(result))
+            except BlockingIOError:
+                chunk = None
+            if chunk:
+                result += chunk
+            else:
+                await self._wait_fd(loop.add_reader, loop.remove_reader)
+        return bytes(result)
+
+    async def read(self, size = 1):
+        return await asyncio.wait_for(self._read(size), self.timeout)
+
+    async def write(self, data):
+        loop = asyncio.get_running_loop()
+        view = memoryview(bytes(data))
+        while view:
+            try:
+                view = view[os.write(self._fd, view):]
+            except BlockingIOError:
+                await self._wait_fd(loop.add_writer, loop.remove_writer)
+        return len(data)
+
+    def close(self):
+        self.s_port.close()
+
+
+class AsyncPortAdapter:
+    """Use any blocking port (a pyserial Serial on windows, a simulated bootloader, etc) as an async one"""
+
+    def __init__(self, s_port):
+        self.s_port = s_port
+        self.port = s_port.port
+
+    async def read(self, size = 1):
+        return await asyncio.to_thread(self.s_port.read, size)
+
+    async def write(self, data):
+        return await asyncio.to_thread(self.s_port.write, data)
+
+    def close(self):
+        self.s_port.close()
+
+
+def open_serial(port: str, baud = 57600, timeout = None):
+    """Open the given serial port for use with the functions here"""
+    from serial import Serial
+    s_port = Serial(port, baud, timeout = 0)
+    if os.name == "posix":
+        return AsyncSerial(s_port, timeout)
+    s_port.timeout = timeout
+    return AsyncPortAdapter(s_port)
+
+
+class AsyncOperation:
+    """A long running operation; await it for its result, or iterate it for progress (then check result)"""
+
+    def __init__(self, body, *args):
+        self.result = None
+        self._generator = body(self, *args)
+
+    def __aiter__(self):
+        return self._generator
+
+    async def _complete(self):
+        async for _ in self._generator:
+            pass
+        return self.result
+
+    def __await__(self):
+        return self._complete().__await__()
+
+async def _block(coroutine):
+    """Run one block's worth of bootloader commands; if cancelled, the block still finishes before we stop"""
+    task = asyncio.ensure_future(coroutine)
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        await task
+        raise
+
+async def _exchange(port, data, responselength):
+    await port.write(data)
+    return await port.read(responselength)
+
+async def _command(port, data, responselength = 1):
+    """Send one bootloader command and read its response; cancelling never leaves the response unread"""
+    return await _block(_exchange(port, data, responselength))
+
+async def _read_fx(port, pagenumber, length):
+    async def read():
+        await _command(port, fx_address_command(pagenumber))
+        return await _command(port, fx_read_command(length), length)
+    return await _block(read())
+
+
+async def exit_bootloader(port):
+    await _command(port, b"E")
+    port.close()
+
+async def exit_normal(port):
+    await _command(port, b"x\x46") #RGB LED GREEN + RED, buttons enabled
+    await asyncio.sleep(0.5)
+    await _command(port, b"x\x40") #RGB LED off, buttons enabled
+    port.close()
+
+async def get_version(port):
+    return int(await _command(port, b"V", 2))
+
+async def get_jedec_info(port) -> JedecInfo:
+    jedec_id = await _command(port, b"j", 3)
+    await asyncio.sleep(arduboy.serial.JEDEC_RETRY_WAIT)
+    jedec_id2 = await _command(port, b"j", 3)
+    if jedec_id2 != jedec_id or jedec_id == b'\x00\x00\x00' or jedec_id == b'\xFF\xFF\xFF':
+        raise Exception(f"No flash cart detected on port {port.port}")
+    return JedecInfo(bytearray(jedec_id), 1 << jedec_id[2], arduboy.serial.MANUFACTURERS.get(jedec_id[0], "unknown"))
+
+async def is_caterina(port):
+    if await get_version(port) == 10:
+        return ord(await _command(port, b"r")) & 0x10 != 0
+    return False
+
+async def bootloader_length(port):
+    return 2048 + (2048 if await is_caterina(port) else 1024)
+
+async def get_and_verify_jdec_bootloader(port):
+    if await get_version(port) < 13:
+        raise Exception("Bootloader has no flash cart support. Can't write FX flash!")
+    jedec_info = await get_jedec_info(port)
+    logging.info(f"JDEC info: {jedec_info}")
+    return jedec_info
+
+
+async def read_eeprom(port):
+    await _command(port, address_command(0))
+    return bytearray(await _command(port, b"g\x04\x00E", 1024))
+
+async def write_eeprom(eepromdata, port):
+    if len(eepromdata) != 1024:
+        raise Exception("Provided EEPROM data does not contain exactly 1K (1024 bytes)")
+    await _command(port, address_command(0))
+    await _command(port, b"B\x04\x00E" + bytes(eepromdata))
+
+
+def flash_arduhex(bindata: bytearray, port, window = arduboy.serial.FLASH_PIPELINE_WINDOW) -> AsyncOperation:
+    """Same as arduboy.serial.flash_arduhex; progress is in pages"""
+    return AsyncOperation(_flash_arduhex, bindata, port, window)
+
+async def _flash_arduhex(op, bindata, port, window):
+    bindata = arduboy.common.pad_data(bytearray(bindata), FLASH_SIZE)
+    analysis = arduboy.arduhex.analyze_sketch(bindata)
+    if analysis.overwrites_caterina and await is_caterina(port):
+        raise Exception("Upload will likely corrupt the bootloader.")
+    logging.info("Flashing {} pages".format(analysis.total_pages))
+    write_command = flash_write_command(FLASH_PAGESIZE)
+    for first in range(0, analysis.total_pages, window):
+        last = min(first + window, analysis.total_pages)
+        commands = bytearray()
+        for i in range(first, last):
+            commands += address_command(i) + write_command + bindata[i * FLASH_PAGESIZE: (i + 1) * FLASH_PAGESIZE]
+        await _block(_command(port, commands, 2 * (last - first)))
+        yield last, analysis.total_pages
+
+def verify_arduhex(bindata: bytearray, port) -> AsyncOperation:
+    """Same as arduboy.serial.verify_arduhex (it's one read, so there's only one bit of progress)"""
+    return AsyncOperation(_verify_arduhex, bindata, port)
+
+async def _verify_arduhex(op, bindata, port):
+    analysis = arduboy.arduhex.analyze_sketch(bindata)
+    if analysis.total_pages == 0:
+        # Nothing to compare, and a zero length read means 64K to the bootloader
+        return
+    length = analysis.total_pages * FLASH_PAGESIZE
+    async def read_all():
+        await _command(port, address_command(0))
+        return await _command(port, flash_read_command(length), length)
+    readback = await _block(read_all())
+    for i in range(analysis.total_pages):
+        if readback[i * FLASH_PAGESIZE : (i + 1) * FLASH_PAGESIZE] != bindata[i * FLASH_PAGESIZE : (i + 1) * FLASH_PAGESIZE]:
+            raise Exception("Verify failed at address {:04X}. Upload unsuccessful.".format(i * FLASH_PAGESIZE))
+    yield analysis.total_pages, analysis.total_pages
+
+def backup_sketch(port, include_bootloader = False) -> AsyncOperation:
+    """Same as arduboy.serial.backup_sketch"""
+    return AsyncOperation(_backup_sketch, port, include_bootloader)
+
+async def _backup_sketch(op, port, include_bootloader):
+    async def read_all():
+        await _command(port, address_command(0))
+        return bytearray(await _command(port, b"g\x80\x00F", 0x8000))
+    op.result = await _block(read_all())
+    if not include_bootloader:
+        op.result = op.result[:-await bootloader_length(port)]
+    yield 1, 1
+
+def flash_fx(flashdata: bytearray, pagenumber: int, port, verify = True) -> AsyncOperation:
+    """Same as arduboy.serial.flash_fx; progress is in blocks"""
+    return AsyncOperation(_flash_fx, flashdata, pagenumber, port, verify)
+
+async def _flash_fx(op, flashdata, pagenumber, port, verify):
+    if not len(flashdata):
+        raise Exception("No flash data provided!")
+    info = await get_and_verify_jdec_bootloader(port)
+    flashdata = arduboy.common.pad_data(bytearray(flashdata), FX_PAGESIZE)
+    if pagenumber < 0:
+        pagenumber = info.total_pages() - (len(flashdata) // FX_PAGESIZE)
+    # Partial blocks at either end keep what's already there, same as the blocking version
+    if pagenumber % FX_PAGES_PER_BLOCK:
+        blockaddr = pagenumber // FX_PAGES_PER_BLOCK * FX_PAGES_PER_BLOCK
+        flashdata = bytearray(await _read_fx(port, blockaddr, pagenumber % FX_PAGES_PER_BLOCK * FX_PAGESIZE)) + flashdata
+        pagenumber = blockaddr
+    if len(flashdata) % FX_BLOCKSIZE:
+        flashdata += await _read_fx(port, pagenumber + len(flashdata) // FX_PAGESIZE, FX_BLOCKSIZE - len(flashdata) % FX_BLOCKSIZE)
+
+    blocks = len(flashdata) // FX_BLOCKSIZE
+    start = time.time()
+    async def write_block(block):
+        blockaddr = pagenumber + block * FX_PAGES_PER_BLOCK
+        blockdata = flashdata[block * FX_BLOCKSIZE : (block + 1) * FX_BLOCKSIZE]
+        await port.write(b"x\xC2" + fx_address_command(blockaddr) + fx_write_command(FX_BLOCKSIZE)) #RGB LED RED, buttons disabled
+        await _command(port, blockdata, 3)
+        if verify and await _read_fx(port, blockaddr, FX_BLOCKSIZE) != blockdata:
+            raise Exception("FX verify failed at address {:04X}. Upload unsuccessful.".format(blockaddr))
+    try:
+        for block in range(blocks):
+            await _block(write_block(block))
+            yield block + 1, blocks
+    finally:
+        await _block(_command(port, b"x\x40")) #RGB LED off, buttons enabled
+    logging.info("Wrote {} blocks in {} seconds".format(blocks, round(time.time() - start,2)))
+
+def backup_fx(port) -> AsyncOperation:
+    """Same as arduboy.serial.backup_fx; progress is in blocks"""
+    return AsyncOperation(_backup_fx, port)
+
+async def _backup_fx(op, port):
+    info = await get_and_verify_jdec_bootloader(port)
+    blocks = info.capacity // FX_BLOCKSIZE
+    op.result = bytearray(info.capacity)
+    try:
+        for block in range(blocks):
+            led = b"x\xC0" if block & 1 else b"x\xC1"
+            await _block(_command(port, led))
+            op.result[block * FX_BLOCKSIZE : (block + 1) * FX_BLOCKSIZE] = await _block(_read_fx(port, block * FX_PAGES_PER_BLOCK, FX_BLOCKSIZE))
+            yield block + 1, blocks
+    finally:
+        await _block(_command(port, b"x\x40")) #RGB LED off, buttons enabled
+
+def scan_fx(port) -> AsyncOperation:
+    """Same as arduboy.serial.scan_fx (without header_work, iterate the cart yourself); result is (size, slots)"""
+    return AsyncOperation(_scan_fx, port)
+
+async def _scan_fx(op, port):
+    info = await get_and_verify_jdec_bootloader(port)
+    header_addr = 0
+    slots = 0
+    while header_addr < info.capacity:
+        header = await _block(_read_fx(port, header_addr // FX_PAGESIZE, arduboy.fxcart.HEADER_LENGTH))
+        if not arduboy.fxcart.is_slot(header, 0) or not arduboy.fxcart.get_slot_size_bytes(header, 0):
+            break
+        slots += 1
+        header_addr += arduboy.fxcart.get_slot_size_bytes(header, 0)
+        op.result = (header_addr, slots)
+        yield header_addr, info.capacity
+    op.result = (header_addr, slots)
@@ -3,7 +3,10 @@
 
 import logging
 import time
+import arduboy.metrics
+import arduboy.hotplug
 from dataclasses import dataclass, field
+from typing import List
 from serial.tools.list_ports  import comports
 from serial import Serial
 
@@ -76,7 +79,10 @@ class ArduboyDevice:
     # Connect to the device this represents and return the serial connection
     def connect_serial(self, baud = MAINBAUD):
         time.sleep(CONNECTWAIT)
-        return Serial(self.port,baud)
+        s_port = Serial(self.port,baud)
+        if arduboy.metrics.global_metrics:
+            s_port = arduboy.metrics.InstrumentedPort(s_port, arduboy.metrics.global_metrics)
+        return s_port
 
 
 # Get a list of connected Arduboy devices. Each element is an ArduboyDevice (see above)
@@ -107,14 +113,34 @@ def find_single(enter_bootloader = True, log = True) -> ArduboyDevice:
         logging.info(f"Attempting to reset device {device}")
         s_port = Serial(device.port,1200)
         s_port.close()
-        while device.is_connected():
-            time.sleep(SPINSLEEP)
-        start = time.time()
-        devices = get_connected_devices(log=False, bootloader_only=True)
-        while len(devices) == 0:
-            time.sleep(SPINSLEEP)
-            if time.time() - start > MAXRECON:
-                raise Exception("Could not find rebooted arduboy in time!")
-            devices = get_connected_devices(log=False, bootloader_only=True)
+        # These return as soon as the device shows up, we don't poll on a fixed timer
+        arduboy.hotplug.wait_until(lambda: not device.is_connected())
+        devices = arduboy.hotplug.wait_until(lambda: get_connected_devices(log=False, bootloader_only=True), MAXRECON)
+        if not devices:
+            raise Exception("Could not find rebooted arduboy in time!")
         device = devices[0]
     return device
+
+# Find every connected arduboy device and put them all in the bootloader at the same time. Returns the 
+# bootloader devices, once as many as were originally found have shown up (or MAXRECON passes, in which
+# case whatever did show up is returned). Note: MAY disconnect and reboot your arduboy devices!
+def find_all(enter_bootloader = True, log = True) -> List[ArduboyDevice]:
+    devices = get_connected_devices(log=log)
+    if len(devices) == 0:
+        raise Exception("No Arduboys found!")
+    resetting = [ d for d in devices if not d.has_bootloader ]
+    if not enter_bootloader or not resetting:
+        return devices
+    for device in resetting:
+        logging.info(f"Attempting to reset device {device}")
+        s_port = Serial(device.port,1200)
+        s_port.close()
+    # They all reboot at the same time, so we only wait as long as the slowest one
+    expected = len(devices)
+    def all_back():
+        devices = get_connected_devices(log=False, bootloader_only=True)
+        return devices if len(devices) >= expected else None
+    devices = arduboy.hotplug.wait_until(all_back, MAXRECON) or get_connected_devices(log=False, bootloader_only=True)
+    if len(devices) < expected:
+        logging.warning(f"Only {len(devices)} of {expected} arduboys came back in their bootloader")
+    return devices
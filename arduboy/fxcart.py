@@ -5,11 +5,19 @@ from arduboy.common import *
 from arduboy.constants import *
 from arduboy.patch import *
 
+import json
 import logging
+import mmap
+import os
 import struct
+import zipfile
 
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from hashlib import sha256
-from typing import List
+from typing import List, Tuple
 from dataclasses import dataclass, field
 
 
@@ -38,6 +46,10 @@ META_HEADER_INDEX = 57              # "" metadata
 
 META_HEADER_SIZE = 199              # Length of the metadata section
 
+# Every fixed field of a slot header, up to the metadata: start string, category, previous page, next page, 
+# slot size, program size, program page, data page, save page, data size, (2 unused), hash
+HEADER_STRUCT = struct.Struct(">7sBHHHBHHHH2x32s")
+
 
 @dataclass
 class FxSlotMeta:
@@ -60,7 +72,10 @@ class FxParsedSlot:
     Note: Although it says "parsed", I just mean it was parsed out of the giant binary blob.
     The individual fields are not parsed, in case you want to immediately turn around and rewrite
     it to the cart (which is likelY), plus I don't know how you might want to use all the data.
+
+    Two slots are equal if their contents are, whatever kind of buffers hold them (see FxSlotView).
     """
+    __slots__ = ("category", "image_raw", "program_raw", "data_raw", "save_raw", "meta")
     category: int
     image_raw: bytearray
     program_raw: bytearray
@@ -78,6 +93,31 @@ class FxParsedSlot:
     def fx_enabled(self):
         return (self.data_raw and len(self.data_raw) > 0) or (self.save_raw and len(self.save_raw) > 0)
 
+    def __eq__(self, other):
+        if not isinstance(other, FxParsedSlot):
+            return NotImplemented
+        return (self.category == other.category and self.image_raw == other.image_raw and self.program_raw == other.program_raw and
+                self.data_raw == other.data_raw and self.save_raw == other.save_raw and self.meta == other.meta)
+
+    def copy(self) -> "FxParsedSlot":
+        """A slot which owns (writable) copies of all the data in this one"""
+        return FxParsedSlot(self.category, bytearray(self.image_raw), bytearray(self.program_raw), bytearray(self.data_raw), 
+                            bytearray(self.save_raw), FxSlotMeta(self.meta.title, self.meta.version, self.meta.developer, self.meta.info))
+
+class FxSlotView(FxParsedSlot):
+    """
+    A parsed slot which doesn't own its data: the raw fields are read-only memoryviews into
+    the cart binary it was parsed from, so parsing a full cart copies (almost) nothing.
+
+    This is read-only, not copy-on-write: a memoryview can't turn itself into a private copy when it's
+    written to, and a stand-in buffer type can't be passed to hashlib, zlib, file writes and the like
+    (before python 3.12). So the views can't be modified in place (that raises TypeError). To change a 
+    field, assign a new buffer to it, so only the fields you actually change are ever copied; to edit 
+    fields in place, take a copy() first. Note that the views keep the original cart binary alive for 
+    as long as the slot exists.
+    """
+    __slots__ = ()
+
 def empty_slot() -> FxParsedSlot:
     """A fully empty slot, should still be usable in a cart builder or such though."""
     return FxParsedSlot(
@@ -192,7 +232,7 @@ def get_savepart_raw(fulldata, index):
         return fulldata[spage*FX_PAGESIZE:index + get_slot_size_bytes(fulldata, index)]
 
 def get_meta_parsed(fulldata, index):
-    meta = fulldata[index+META_HEADER_INDEX:index+META_HEADER_INDEX+META_HEADER_SIZE]
+    meta = bytes(fulldata[index+META_HEADER_INDEX:index+META_HEADER_INDEX+META_HEADER_SIZE])
     ppage = get_program_page(fulldata, index)
     values = meta.split(b'\x00')
     def mval(index):
@@ -224,14 +264,19 @@ def trim_file(infile, outfile = None):
         logging.debug(f"Trimming binary file {infile} (in-place)")
     else:
         logging.debug(f"Scanning binary file {infile} and storing trimmed output to {outfile}")
-    
-    with open(infile, 'rb') as ifile:
-        binaryData = ifile.read()
 
-    trimmedBinData = trim(binaryData)
+    in_place = os.path.exists(outfile) and os.path.samefile(infile, outfile)
 
-    with open(outfile, 'wb') as ofile:
-        ofile.write(trimmedBinData)
+    # Only the slot headers are read to find the end of the cart, and only the kept part is copied
+    with CartFile(infile) as cart:
+        trimmed_size = cart.size
+        logging.debug(f"Trim fx cart file from {len(cart.data)} -> {trimmed_size} bytes")
+        if not in_place:
+            with open(outfile, 'wb') as ofile:
+                ofile.write(cart.data[:trimmed_size])
+
+    if in_place:
+        os.truncate(infile, trimmed_size)
 
 def embedded_save_size(data: bytearray) -> int:
     """Detect the size of an embedded save, return size in bytes. 
@@ -244,29 +289,44 @@ def embedded_save_size(data: bytearray) -> int:
     else:
         return 0
 
-def parse(fulldata, report_progress = None) -> List[FxParsedSlot]:
-    """ Given an entire FX binary, parse absolutely everything out of it (in slot format) """
+def parse_slot(fulldata, index, slottype = FxParsedSlot) -> FxParsedSlot:
+    """ Parse the single slot which starts at the given index in the given FX binary """
+    return slottype(
+        get_category(fulldata, index), 
+        get_title_image_raw(fulldata, index),
+        # What about parsing the program bin? UGH! Most of the time we want the raw, not the parsed, someone else can do that
+        get_program_raw(fulldata, index), 
+        get_datapart_raw(fulldata, index),
+        get_savepart_raw(fulldata, index),
+        get_meta_parsed(fulldata, index)
+    )
 
-    logging.debug(f"Full parsing FX cart ({len(fulldata)} bytes)")
+def parse(fulldata, report_progress = None, zerocopy = False) -> List[FxParsedSlot]:
+    """ 
+    Given an entire FX binary, parse absolutely everything out of it (in slot format) 
+    
+    If zerocopy is set, the slots are FxSlotView objects which reference fulldata directly instead
+    of copying each section out of it. Don't resize fulldata while those slots are alive! These aren't
+    copy-on-write: the raw fields are read-only, and editing one in place (slot.save_raw += ..., 
+    slot.data_raw[0] = ...) raises TypeError. Assign a new buffer to the field instead (only that field 
+    is copied), or take slot.copy() to get a normal slot with writable fields.
+    """
+
+    logging.debug(f"Full parsing FX cart ({len(fulldata)} bytes, zerocopy={zerocopy})")
     dindex = 0
     result = []
+    slottype = FxParsedSlot
+
+    if zerocopy:
+        fulldata = memoryview(fulldata).toreadonly()
+        slottype = FxSlotView
 
     while dindex < len(fulldata)-1:
         if not is_slot(fulldata, dindex):
             break
 
         slotsize = get_slot_size_bytes(fulldata, dindex)
-
-        result.append(FxParsedSlot(
-            get_category(fulldata, dindex), 
-            get_title_image_raw(fulldata, dindex),
-            # What about parsing the program bin? UGH! Most of the time we want the raw, not the parsed, someone else can do that
-            get_program_raw(fulldata, dindex), 
-            get_datapart_raw(fulldata, dindex),
-            get_savepart_raw(fulldata, dindex),
-            get_meta_parsed(fulldata, dindex)
-        ))
-
+        result.append(parse_slot(fulldata, dindex, slottype))
         dindex += slotsize
 
         if report_progress:
@@ -277,6 +337,280 @@ def parse(fulldata, report_progress = None) -> List[FxParsedSlot]:
     return result
 
 
+class FxHeaderTable:
+    """
+    Every slot header in a cart, decoded in one pass and stored as columns (struct of arrays) rather than
+    one object per slot. Queries over thousands of slots (sizes, categories, duplicates) are then simple
+    column scans. Column values are exactly as stored in the header (sizes in pages, 0xFFFF for unset pages).
+    """
+
+    def __init__(self):
+        self.offsets = array("L")       # Byte offset of the slot in the cart
+        self.category = array("B")
+        self.previous_page = array("H")
+        self.next_page = array("H")
+        self.slot_pages = array("H")
+        self.program_size = array("B")  # In 128 byte half-pages, like the header
+        self.program_page = array("H")
+        self.data_page = array("H")
+        self.data_pages = array("H")
+        self.save_page = array("H")
+        self.ids = bytearray()          # 32 byte sha256 hashes, one after another
+
+    @classmethod
+    def from_data(cls, fulldata):
+        """Walk the slot chain of the given cart binary, decoding every header until the end of the cart"""
+        result = cls()
+        index = 0
+        while index < len(fulldata) - 1 and is_slot(fulldata, index):
+            if not result.append(fulldata, index, index):
+                logging.warning(f"Slot at {index} has no size, stopping there")
+                break
+            index += result.slot_pages[-1] * FX_PAGESIZE
+        return result
+
+    def append(self, header, offset, index = 0) -> int:
+        """Decode the header found at index in the given data as the slot at the given cart offset, return its size in pages"""
+        (_, category, previous_page, next_page, slot_pages, program_size, program_page, 
+            data_page, save_page, data_pages, id) = HEADER_STRUCT.unpack_from(header, index)
+        if not slot_pages:
+            return 0
+        self.offsets.append(offset)
+        self.category.append(category)
+        self.previous_page.append(previous_page)
+        self.next_page.append(next_page)
+        self.slot_pages.append(slot_pages)
+        self.program_size.append(program_size)
+        self.program_page.append(program_page)
+        self.data_page.append(data_page)
+        self.data_pages.append(data_pages)
+        self.save_page.append(save_page)
+        self.ids += id
+        return slot_pages
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def id(self, i) -> bytes:
+        """The sha256 of the program + data of slot i (not set for categories)"""
+        i = range(len(self))[i]
+        return bytes(self.ids[i * 32:(i + 1) * 32])
+
+    def slot_size_bytes(self, i) -> int:
+        return self.slot_pages[i] * FX_PAGESIZE
+
+    def total_size_bytes(self) -> int:
+        """Size of the whole cart (without the terminating page)"""
+        return sum(self.slot_pages) * FX_PAGESIZE
+
+    def is_category(self, i) -> bool:
+        return self.program_size[i] == 0
+
+    def games(self) -> List[int]:
+        """Indexes of all slots which are games (not categories)"""
+        return [i for i, size in enumerate(self.program_size) if size]
+
+    def in_category(self, category) -> List[int]:
+        """Indexes of all the games in the given category"""
+        return [i for i, (c, size) in enumerate(zip(self.category, self.program_size)) if c == category and size]
+
+    def duplicates(self):
+        """All games which appear more than once (same program + data), as a dictionary of id -> slot indexes"""
+        found = {}
+        for i in self.games():
+            found.setdefault(self.id(i), []).append(i)
+        return { id : slots for id, slots in found.items() if len(slots) > 1 }
+
+
+def fingerprint(fulldata) -> str:
+    """
+    A hash of every slot header in the given cart. Headers include the hash of each game and the position of 
+    every slot, so this identifies the contents of a cart without reading all of it (just like a device scan).
+    """
+    result = sha256()
+    for offset in FxHeaderTable.from_data(fulldata).offsets:
+        result.update(fulldata[offset:offset + HEADER_LENGTH])
+    return result.hexdigest()
+
+
+SLOTDIFF_ADDED = "added"
+SLOTDIFF_REMOVED = "removed"
+SLOTDIFF_MOVED = "moved"
+SLOTDIFF_MODIFIED = "modified"
+
+@dataclass
+class FxSlotDiff:
+    """
+    One slot which differs between two carts (see diff). Ranges are (start, end) byte offsets of the whole
+    slot within each cart, and indexes are the slot numbers; both are None if the slot isn't in that cart.
+    A modified slot may also have moved, check the ranges.
+    """
+    change: str
+    title: str
+    old_index: int = field(default=None)
+    new_index: int = field(default=None)
+    old_range: Tuple[int, int] = field(default=None)
+    new_range: Tuple[int, int] = field(default=None)
+
+    def __str__(self):
+        def fmtrange(r):
+            return f"0x{r[0]:06X}-0x{r[1]:06X}" if r else "-"
+        return f"{self.change:>8}: {self.title} [{fmtrange(self.old_range)} -> {fmtrange(self.new_range)}]"
+
+def _slot_identity(fulldata, table: FxHeaderTable, i):
+    """Everything in a slot which doesn't depend on its position: the hash, title image, category, metadata and save"""
+    offset = table.offsets[i]
+    end = offset + table.slot_size_bytes(i)
+    save = fulldata[table.save_page[i] * FX_PAGESIZE:end] if table.save_page[i] != 0xFFFF else b""
+    return (table.id(i), sha256(get_title_image_raw(fulldata, offset)).digest(), table.category[i], 
+            bytes(fulldata[offset + META_HEADER_INDEX:offset + HEADER_LENGTH]), sha256(save).digest())
+
+def diff(old, new) -> List[FxSlotDiff]:
+    """
+    Compare two compiled carts slot by slot, returning what was added, removed, moved or modified (slots which
+    are the same and in the same place aren't reported). Slots are matched up by the hash in their header first,
+    then by their title image, so games which were updated in place are reported as modified. Runs in linear time.
+    """
+    old = memoryview(old)
+    new = memoryview(new)
+    oldtable = FxHeaderTable.from_data(old)
+    newtable = FxHeaderTable.from_data(new)
+    oldidentity = [_slot_identity(old, oldtable, i) for i in range(len(oldtable))]
+    newidentity = [_slot_identity(new, newtable, i) for i in range(len(newtable))]
+    pairs = {}  # new index -> old index
+    matched_old = set()
+
+    # Match by each key in turn; duplicates are matched up in order. Categories have no hash, only games do
+    for keyfunc in [lambda t, i, ident: ident[0] if not t.is_category(i) else None, lambda t, i, ident: ident[1]]:
+        available = {}
+        for i in range(len(oldtable)):
+            if i not in matched_old:
+                key = keyfunc(oldtable, i, oldidentity[i])
+                if key is not None:
+                    available.setdefault(key, deque()).append(i)
+        for i in range(len(newtable)):
+            if i not in pairs:
+                key = keyfunc(newtable, i, newidentity[i])
+                if available.get(key):
+                    pairs[i] = available[key].popleft()
+                    matched_old.add(pairs[i])
+
+    def slotrange(table, i):
+        return (table.offsets[i], table.offsets[i] + table.slot_size_bytes(i))
+
+    result = []
+    for i in range(len(oldtable)):
+        if i not in matched_old:
+            result.append(FxSlotDiff(SLOTDIFF_REMOVED, get_meta_parsed(old, oldtable.offsets[i]).title, 
+                                     old_index = i, old_range = slotrange(oldtable, i)))
+    for i in range(len(newtable)):
+        title = get_meta_parsed(new, newtable.offsets[i]).title
+        if i not in pairs:
+            result.append(FxSlotDiff(SLOTDIFF_ADDED, title, new_index = i, new_range = slotrange(newtable, i)))
+            continue
+        o = pairs[i]
+        change = None
+        if oldidentity[o] != newidentity[i]:
+            change = SLOTDIFF_MODIFIED
+        elif slotrange(oldtable, o) != slotrange(newtable, i):
+            change = SLOTDIFF_MOVED
+        if change:
+            result.append(FxSlotDiff(change, title, o, i, slotrange(oldtable, o), slotrange(newtable, i)))
+
+    logging.debug(f"Cart diff: {len(oldtable)} -> {len(newtable)} slots, {len(result)} changes")
+    return result
+
+
+class CartFile:
+    """
+    Random access to the slots of a cart image on disk, without reading the whole file.
+
+    The file is memory mapped and the slot header chain is walked once to build an index of slot
+    offsets; after that, only the pages you actually look at are read from disk. Indexing returns
+    FxSlotView objects (see parse), decoded on demand; the decoded headers of every slot are in headers. 
+    Use as a context manager, or call close.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._file = open(filename, "rb")
+        self._mmap = None
+        if os.fstat(self._file.fileno()).st_size:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.data = memoryview(self._mmap).toreadonly()
+        else:
+            self.data = memoryview(b"")
+        self.headers = FxHeaderTable.from_data(self.data)
+        self.offsets = self.headers.offsets # Byte offset of every slot header, in order
+        self.size = min(self.headers.total_size_bytes(), len(self.data)) # The trimmed size of the cart
+        logging.debug(f"Indexed {len(self.offsets)} slots in cart file {filename} ({self.size} bytes)")
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i) -> FxSlotView:
+        return parse_slot(self.data, self.offsets[i], FxSlotView)
+
+    def __iter__(self):
+        for offset in self.offsets:
+            yield parse_slot(self.data, offset, FxSlotView)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def header(self, i) -> memoryview:
+        """Raw header bytes of slot i (only reads the header page)"""
+        return self.data[self.offsets[i]:self.offsets[i] + HEADER_LENGTH]
+
+    def meta(self, i) -> FxSlotMeta:
+        """Title, version, etc of slot i without decoding the rest of the slot"""
+        return get_meta_parsed(self.data, self.offsets[i])
+
+    def close(self):
+        self.data.release()
+        if self._mmap:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Some slot views are still alive; the mapping goes away once they do
+                logging.debug(f"Cart file {self.filename} closed while slots still reference it")
+            self._mmap = None
+        self._file.close()
+
+
+@dataclass
+class FxSave:
+    """The save of one game on a cart, identified by the hash in the game's header (its id) and its title"""
+    id: bytes
+    title: str
+    data: bytes
+
+SAVE_ARCHIVE_INDEX = "saves.json"
+
+def write_saves(filename: str, saves: List[FxSave]):
+    """
+    Write the given saves to an archive: a zip with an index (id, title and file of each save) and one file
+    per save. Saves are mostly erased flash, so they compress very well.
+    """
+    index = []
+    with zipfile.ZipFile(filename, "w", compression=zipfile.ZIP_DEFLATED) as zipf:
+        for i, save in enumerate(saves):
+            savefile = f"save{i}.bin"
+            zipf.writestr(savefile, save.data)
+            index.append({ "id": save.id.hex(), "title": save.title, "file": savefile })
+        zipf.writestr(SAVE_ARCHIVE_INDEX, json.dumps(index, indent = 2))
+    logging.info(f"Wrote {len(saves)} saves to {filename}")
+
+def read_saves(filename: str) -> List[FxSave]:
+    """Read all the saves in an archive written by write_saves"""
+    with zipfile.ZipFile(filename) as zipf:
+        index = json.loads(zipf.read(SAVE_ARCHIVE_INDEX))
+        return [ FxSave(bytes.fromhex(entry["id"]), entry["title"], zipf.read(entry["file"])) for entry in index ]
+
+
 def fix_parsed_slots(parsed_slots: List[FxParsedSlot]):
     """ Forcibly reassign all the categories, make sure first slot is a category, fill empty images with all 0's """
     category = -1
@@ -293,58 +627,118 @@ def fix_parsed_slots(parsed_slots: List[FxParsedSlot]):
         slot.category = category
         count += 1
 
-def compile_single(slot: FxParsedSlot, currentpage = 0, previouspage = 0xFFFF) -> bytearray:
+@dataclass
+class FxSlotLayout:
     """
-    Compile a single slot (with the given page identifiers, VERY important) and return the result. 
-    
-    If you're just testing, the pages aren't required (but you won't get a valid frame)
+    Where each part of a compiled slot goes. Sizes are in bytes (after padding), pages are absolute 
+    within the cart. Computing this is cheap, it only needs the sizes of the slot data.
+    """
+    currentpage: int
+    previouspage: int
+    programsize: int
+    datasize: int
+    alignsize: int
+    savesize: int
+
+    @property
+    def programpage(self):
+        return self.currentpage + PREAMBLE_PAGES
+
+    @property
+    def datapage(self):
+        return self.programpage + (self.programsize >> 8)  # Data comes after program, wherever it is
+
+    @property
+    def savepage(self):
+        return self.datapage + ((self.datasize + self.alignsize) >> 8) # Save page might not be used, calculate it anyway
+
+    @property
+    def slotpages(self):
+        return PREAMBLE_PAGES + ((self.programsize + self.datasize + self.alignsize + self.savesize) >> 8)
+
+    @property
+    def nextpage(self):
+        return self.currentpage + self.slotpages
+
+    @property
+    def offset(self):
+        return self.currentpage * FX_PAGESIZE
+
+    @property
+    def length(self):
+        return self.slotpages * FX_PAGESIZE
+
+
+def layout_single(slot: FxParsedSlot, currentpage = 0, previouspage = 0xFFFF, slotpages = None) -> FxSlotLayout:
+    """
+    Compute where everything in the given slot will go if compiled at the given page, without compiling it.
+    If slotpages is given, the slot is padded out to exactly that many pages (with any save still at the end),
+    for replacing a slot in place; an exception is raised if it doesn't fit.
     """
     if len(slot.image_raw) != SCREEN_BYTES:
         raise Exception(f"Title image for game {slot.meta.title} is incorrect size!! Expected: {SCREEN_BYTES}, was: {len(slot.image_raw)}")
+    # These are "post-padding" sizes. Program and data are padded to page size, save is padded to save size (4096)
+    programsize = len(slot.program_raw) + pad_size(len(slot.program_raw), FX_PAGESIZE)
+    datasize = len(slot.data_raw) + pad_size(len(slot.data_raw), FX_PAGESIZE)
+    savesize = len(slot.save_raw) + pad_size(len(slot.save_raw), SAVE_ALIGNMENT)
+    alignpage = currentpage + PREAMBLE_PAGES + ((programsize + datasize) >> 8) # Calculate align page start even if alignment isn't used
+    alignsize = pad_size(alignpage, 16) * 256 if savesize > 0 else 0 # Only have alignment if save
+    result = FxSlotLayout(currentpage, previouspage, programsize, datasize, alignsize, savesize)
+    if slotpages is not None:
+        if result.slotpages > slotpages:
+            raise Exception(f"Game {slot.meta.title} doesn't fit in {slotpages} pages, needs {result.slotpages}")
+        # The padding goes where the alignment does, so the save stays at the end. It has to stay aligned too
+        result.alignsize += (slotpages - result.slotpages) * FX_PAGESIZE
+        if savesize > 0 and result.savepage % 16:
+            raise Exception(f"Save for game {slot.meta.title} can't be aligned at the end of {slotpages} pages")
+    return result
+
+def layout(parsed_slots: List[FxParsedSlot]) -> List[FxSlotLayout]:
+    """Compute the layout of every slot in a cart, in order. Doesn't fix the slots, see fix_parsed_slots"""
+    result = []
+    previouspage = 0xFFFF
+    currentpage = 0
+    for slot in parsed_slots:
+        result.append(layout_single(slot, currentpage, previouspage))
+        previouspage = currentpage
+        currentpage = result[-1].nextpage
+    return result
+
+def compile_single_into(slot: FxParsedSlot, slotlayout: FxSlotLayout, output):
+    """
+    Compile a single slot directly into the given writable buffer (bytearray, memoryview, etc), which must
+    be exactly slotlayout.length long and already filled with 0xFF (the padding is never written).
+    """
+    if len(output) != slotlayout.length:
+        raise Exception(f"Output for game {slot.meta.title} is the wrong size! Expected: {slotlayout.length}, was: {len(output)}")
+    output = memoryview(output)
     # All the raw data we're about to dump into the flashcart. Some may be modified later
     header = default_header()
-    title = slot.image_raw
-    program = bytearray(pad_data(slot.program_raw, FX_PAGESIZE))  # WARN: YOU MUST ALWAYS PAD THE PROGRAM! You don't know who's supplying it!
-    datafile = bytearray(pad_data(slot.data_raw, FX_PAGESIZE))
-    savefile = bytearray(pad_data(slot.save_raw, SAVE_ALIGNMENT))
-    # These are "post-padding" sizes. Program and data are padded to page size, save is padded to save size (4096)
-    programsize = len(program)
-    datasize = len(datafile)
-    savesize = len(savefile)
+    programstart = HEADER_LENGTH + TITLE_IMAGE_LENGTH
+    datastart = programstart + slotlayout.programsize
+    savestart = datastart + slotlayout.datasize + slotlayout.alignsize
+    output[HEADER_LENGTH:programstart] = slot.image_raw
+    output[programstart:programstart + len(slot.program_raw)] = slot.program_raw
+    output[datastart:datastart + len(slot.data_raw)] = slot.data_raw
+    output[savestart:savestart + len(slot.save_raw)] = slot.save_raw
+    program = output[programstart:datastart]
     #don't flash last unused 128 bytes page
-    program_flash_size = (programsize >> 7) - 1 if program[-FLASH_PAGESIZE:] == PROGRAM_NULLPAGE else programsize >> 7
+    program_flash_size = (slotlayout.programsize >> 7) - 1 if program[-FLASH_PAGESIZE:] == PROGRAM_NULLPAGE else slotlayout.programsize >> 7
     if program_flash_size > 0xFF: # Program size in half-pages is single byte
         raise Exception(f"Somehow, program is too large for game {slot.meta.title}! Might be a problem with the binary generator! Max size: {0xFFFF} half-pages, program was {program_flash_size}")
-    id = sha256(program + datafile).digest()
-    programpage = currentpage + PREAMBLE_PAGES
-    datapage    = programpage + (programsize >> 8)  # Data comes after program, wherever it is
-    alignpage   = datapage + (datasize >> 8)        # Calculate align page start even if alignment isn't used
-    alignsize   = pad_size(alignpage, 16) * 256 if savesize > 0 else 0 # Only have alignment if save
-    savepage    = alignpage + (alignsize >> 8)      # Save page might not be used, calculate it anyway
-    total_binary_length = programsize + datasize + alignsize + savesize
-    if total_binary_length & 0xFF:
-        raise Exception(f"Sum of binary sizes is not page aligned for game {slot.meta.title}! Size: {total_binary_length}")
-    slotpages   = PREAMBLE_PAGES + (total_binary_length >> 8)
-    nextpage = currentpage + slotpages
+    # The id is the hash of the padded program + data, before any patching
+    id = sha256(output[programstart:savestart - slotlayout.alignsize]).digest()
     header[7] = slot.category   #list number
-    write_2byte_value(previouspage, header, PREVIOUS_PAGE_HEADER_INDEX)
-    write_2byte_value(nextpage, header, NEXT_PAGE_HEADER_INDEX)
-    write_2byte_value(slotpages, header, SLOT_SIZE_HEADER_INDEX)
     header[PROGRAM_SIZE_HEADER_INDEX] = program_flash_size
-    # There IS a program, so let's set some more fields!
-    if programsize > 0:
-        write_2byte_value(programpage, header, PROGRAMPAGE_HEADER_INDEX)
-        if datasize > 0:
+    # There IS a program, so let's set some more fields! The pages themselves are set by relocate_single
+    if slotlayout.programsize > 0:
+        if slotlayout.datasize > 0:
             program[0x14] = 0x18    # IDK, some constants from the other program
             program[0x15] = 0x95
-            write_2byte_value(datapage, program, 0x16)
-            write_2byte_value(datapage, header, DATAPAGE_HEADER_INDEX)
-            write_2byte_value(datasize >> 8, header, DATA_SIZE_HEADER_INDEX)
-        if savesize > 0:
+            write_2byte_value(slotlayout.datasize >> 8, header, DATA_SIZE_HEADER_INDEX)
+        if slotlayout.savesize > 0:
             program[0x18] = 0x18    # Some constants from the builder program
             program[0x19] = 0x95
-            write_2byte_value(savepage, program, 0x1a)
-            write_2byte_value(savepage, header, SAVEPAGE_HEADER_INDEX)
         header[25:57] = id  # NOTE: hash only used if program set!
         stringdata = (slot.meta.title.encode('utf-8') + b'\0' + slot.meta.version.encode('utf-8') + b'\0' +
                         slot.meta.developer.encode('utf-8') + b'\0' + slot.meta.info.encode('utf-8') + b'\0')
@@ -355,38 +749,190 @@ def compile_single(slot: FxParsedSlot, currentpage = 0, previouspage = 0xFFFF) -
     header[57:57 + len(stringdata)] = stringdata
     if len(header) != HEADER_LENGTH:
         raise Exception(f"Somehow, header length for {slot.meta.title} was not {HEADER_LENGTH}!")
+    output[:HEADER_LENGTH] = header
+    relocate_single(output, slotlayout)
     if len(program):
         patch_success, message = patch_menubuttons(program)
         if not patch_success:
             logging.warning(f"Couldn't patch menu to return to bootloader for {slot.meta.title}: {message}")
-    return header + title + program + datafile + bytearray(b'\xFF' * alignsize) + savefile
+    return program_flash_size
+
+def relocate_single(output, slotlayout: FxSlotLayout):
+    """
+    Write every page-dependent field of an already compiled slot for the given layout: the header 
+    links and pages, and the data/save pages inside the program. Nothing else in a compiled slot depends
+    on where it is in the cart, except the save alignment (which must already match the layout).
+    """
+    output = memoryview(output)
+    program = output[HEADER_LENGTH + TITLE_IMAGE_LENGTH:]
+    write_2byte_value(slotlayout.previouspage, output, PREVIOUS_PAGE_HEADER_INDEX)
+    write_2byte_value(slotlayout.nextpage, output, NEXT_PAGE_HEADER_INDEX)
+    write_2byte_value(slotlayout.slotpages, output, SLOT_SIZE_HEADER_INDEX)
+    if slotlayout.programsize > 0:
+        write_2byte_value(slotlayout.programpage, output, PROGRAMPAGE_HEADER_INDEX)
+        if slotlayout.datasize > 0:
+            write_2byte_value(slotlayout.datapage, program, 0x16)
+            write_2byte_value(slotlayout.datapage, output, DATAPAGE_HEADER_INDEX)
+        if slotlayout.savesize > 0:
+            write_2byte_value(slotlayout.savepage, program, 0x1a)
+            write_2byte_value(slotlayout.savepage, output, SAVEPAGE_HEADER_INDEX)
+
+def slot_content_hash(slot: FxParsedSlot) -> bytes:
+    """A hash of everything in a slot which ends up in the compiled slot (apart from its position)"""
+    result = sha256(bytes([slot.category]))
+    for field in [slot.image_raw, slot.program_raw, slot.data_raw, slot.save_raw] + [x.encode('utf-8') for x in 
+                  [slot.meta.title, slot.meta.version, slot.meta.developer, slot.meta.info]]:
+        result.update(len(field).to_bytes(4, 'little'))
+        result.update(field)
+    return result.digest()
+
+class CompileCache:
+    """
+    Remembers compiled slots (keyed by slot_content_hash) so compiling a cart again only does the expensive 
+    work (padding, hashing, menu patching) for slots which actually changed. Slots which only moved are copied
+    from the cache and relocated. Pass one to compile or compile_to_file and keep it around between compiles.
+
+    Only the slots used by the most recent compile are kept, which is about one extra copy of the cart.
+    """
+
+    def __init__(self):
+        self.slots = {}     # content hash -> (compiled slot, layout it was compiled with)
+        self.used = {}
+        self.hits = 0
+        self.misses = 0
+
+    def compile_single_into(self, slot: FxParsedSlot, slotlayout: FxSlotLayout, output):
+        """Same as the module-level compile_single_into, but uses and fills the cache"""
+        key = slot_content_hash(slot)
+        if not self.get_into(key, slotlayout, output):
+            compile_single_into(slot, slotlayout, output)
+            self.put(key, slotlayout, output)
+        return output[PROGRAM_SIZE_HEADER_INDEX]
+
+    def get_into(self, key: bytes, slotlayout: FxSlotLayout, output) -> bool:
+        """Write the cached slot with the given key into output, relocated to the given layout. Returns whether it was cached"""
+        cached = self.used.get(key) or self.slots.get(key)
+        if not cached:
+            self.misses += 1
+            return False
+        self.hits += 1
+        slotbin, oldlayout = cached
+        if oldlayout.alignsize == slotlayout.alignsize:
+            output[:] = slotbin
+        else:
+            # The save moved relative to the rest of the slot, splice it in at the new alignment (padding is already 0xFF)
+            fixed = HEADER_LENGTH + TITLE_IMAGE_LENGTH + slotlayout.programsize + slotlayout.datasize
+            output[:fixed] = slotbin[:fixed]
+            output[fixed + slotlayout.alignsize:] = slotbin[fixed + oldlayout.alignsize:]
+        relocate_single(output, slotlayout)
+        self.used[key] = cached
+        return True
+
+    def put(self, key: bytes, slotlayout: FxSlotLayout, slotbin):
+        """Remember the given compiled slot (compiled with the given layout)"""
+        self.used[key] = (bytes(slotbin), slotlayout)
+
+    def prune(self):
+        """Forget every slot not used since the last prune. Called at the end of every compile"""
+        logging.debug(f"Compile cache: {self.hits} hits, {self.misses} misses, {len(self.slots) - len(self.used.keys() & self.slots.keys())} dropped")
+        self.slots = self.used
+        self.used = {}
+        self.hits = 0
+        self.misses = 0
+
+def compile_single(slot: FxParsedSlot, currentpage = 0, previouspage = 0xFFFF, slotpages = None) -> bytearray:
+    """
+    Compile a single slot (with the given page identifiers, VERY important) and return the result. 
+    If slotpages is given, the result is padded to exactly that many pages (see layout_single).
+    
+    If you're just testing, the pages aren't required (but you won't get a valid frame)
+    """
+    slotlayout = layout_single(slot, currentpage, previouspage, slotpages)
+    result = bytearray(b'\xFF' * slotlayout.length)
+    compile_single_into(slot, slotlayout, result)
+    return result
+
+def compiled_size(layouts: List[FxSlotLayout]) -> int:
+    """Size in bytes of a compiled cart with the given layout, including the terminating page"""
+    currentpage = layouts[-1].nextpage if layouts else 0
+    return (currentpage + (1 if currentpage < 65536 else 0)) * FX_PAGESIZE
+
+def _compile_single_job(slot: FxParsedSlot, slotlayout: FxSlotLayout) -> bytearray:
+    """Compile a slot for the given layout in a worker process (see compile)"""
+    result = bytearray(b'\xFF' * slotlayout.length)
+    compile_single_into(slot, slotlayout, result)
+    return result
 
-def compile(parsed_slots: List[FxParsedSlot],  report_progress = None):
+def compile(parsed_slots: List[FxParsedSlot],  report_progress = None, cache: CompileCache = None, executor = None):
     """
     Compile the given parsed data of an arduboy cart back into bytes. 
 
+    The layout of the whole cart is computed first, so every slot is compiled directly into a single
+    preallocated buffer. If a cache is given, unchanged slots are reused from the previous compile.
+    If an executor (or a number of worker processes to start one with) is given, the slots are compiled
+    in parallel and assembled in order; the result is exactly the same as compiling serially.
     Taken mostly from https://github.com/MrBlinky/Arduboy-Python-Utilities/blob/main/flashcart-builder.py
     """
+    if isinstance(executor, int):
+        with ProcessPoolExecutor(executor) if executor > 0 else nullcontext() as pool:
+            return compile(parsed_slots, report_progress, cache, pool)
     logging.debug(f"Compiling flashcart with {len(parsed_slots)} slots")
     # First, perform some checks and fixes. 
     fix_parsed_slots(parsed_slots)
-    previouspage = 0xFFFF
-    currentpage = 0
-    result = bytearray()
-    games = 0
-    categories = 0
-    for slot in parsed_slots:
-        slotbin = compile_single(slot, currentpage, previouspage)
-        result = result + slotbin
-        if get_program_size_bytes(result, currentpage * FX_PAGESIZE) > 0:
-            games += 1
+    layouts = layout(parsed_slots)
+    result = bytearray(b'\xFF' * compiled_size(layouts))
+    output = memoryview(result)
+    jobs = []
+    for i, (slot, slotlayout) in enumerate(zip(parsed_slots, layouts)):
+        slotoutput = output[slotlayout.offset:slotlayout.offset + slotlayout.length]
+        key = slot_content_hash(slot) if cache else None
+        if cache and cache.get_into(key, slotlayout, slotoutput):
+            pass
+        elif executor:
+            if isinstance(slot, FxSlotView): # Views can't be sent to other processes
+                slot = slot.copy()
+            jobs.append((key, slotlayout, slotoutput, executor.submit(_compile_single_job, slot, slotlayout)))
+            continue
         else:
-            categories += 1
-        previouspage = currentpage
-        currentpage += (len(slotbin) >> 8)
+            compile_single_into(slot, slotlayout, slotoutput)
+            if cache:
+                cache.put(key, slotlayout, slotoutput)
+        if report_progress:
+            report_progress(i + 1 - len(jobs), len(parsed_slots))
+    for i, (key, slotlayout, slotoutput, job) in enumerate(jobs):
+        slotoutput[:] = job.result()
+        if cache:
+            cache.put(key, slotlayout, slotoutput)
         if report_progress:
-            report_progress(games + categories, len(parsed_slots))
-    if currentpage < 65536:
-        result += bytearray(b'\xFF' * 256)
-    logging.info(f"Compiled fx flashcart, {len(result)} bytes, {games} games, {categories} categories")
+            report_progress(len(parsed_slots) - len(jobs) + i + 1, len(parsed_slots))
+    games = sum(1 for x in layouts if output[x.offset + PROGRAM_SIZE_HEADER_INDEX] > 0)
+    output.release()
+    if cache:
+        cache.prune()
+    logging.info(f"Compiled fx flashcart, {len(result)} bytes, {games} games, {len(parsed_slots) - games} categories")
     return result
+
+def compile_to_file(parsed_slots: List[FxParsedSlot], fileobj, report_progress = None, cache: CompileCache = None) -> int:
+    """
+    Compile the given parsed data of an arduboy cart, writing each slot to the given (binary) file object
+    as soon as it's compiled. Only one slot is ever held in memory (not counting the cache, if given). 
+    Returns the amount of bytes written.
+    """
+    logging.debug(f"Compiling flashcart with {len(parsed_slots)} slots to file")
+    fix_parsed_slots(parsed_slots)
+    layouts = layout(parsed_slots)
+    total = compiled_size(layouts)
+    compile_slot = cache.compile_single_into if cache else compile_single_into
+    games = 0
+    for i, (slot, slotlayout) in enumerate(zip(parsed_slots, layouts)):
+        slotbin = bytearray(b'\xFF' * slotlayout.length)
+        if compile_slot(slot, slotlayout, slotbin) > 0:
+            games += 1
+        fileobj.write(slotbin)
+        if report_progress:
+            report_progress(i + 1, len(parsed_slots))
+    fileobj.write(b'\xFF' * (total - (layouts[-1].nextpage * FX_PAGESIZE)))
+    if cache:
+        cache.prune()
+    logging.info(f"Compiled fx flashcart to file, {total} bytes, {games} games, {len(parsed_slots) - games} categories")
+    return total
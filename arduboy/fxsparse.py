@@ -0,0 +1,211 @@
+# A compact container for FX flash backups. Full dumps are mostly erased flash (0xFF), so runs of erased pages
+# are stored as extents (start page, page count) and only the rest is kept, compressed in independent chunks of
+# one 64KiB block each. Chunks are written as they're read from the device, with the index (extents, where each
+# chunk is and the sha256 of each block) at the end of the file, so any single block can be read back without
+# touching the rest. Layout:
+#
+#   FXSPARSE_MAGIC, version (1 byte)
+#   compressed chunks, one after another (only the pages of each block which aren't erased)
+#   index (json)
+#   index offset (8 bytes), index length (8 bytes), FXSPARSE_MAGIC
+import bisect
+import json
+import logging
+import os
+import struct
+import zlib
+
+from arduboy.constants import *
+from hashlib import sha256
+
+FXSPARSE_MAGIC = b"FXSPARSE"
+FXSPARSE_VERSION = 1
+FXSPARSE_EXTENSION = ".fxsparse"
+
+_FOOTER = struct.Struct(">QQ8s")
+ERASED_PAGE = b"\xFF" * FX_PAGESIZE
+
+
+def _erased_pages(blockdata):
+    """Which pages (indexes within the block) of the given block data are erased"""
+    return [ p for p in range((len(blockdata) + FX_PAGESIZE - 1) // FX_PAGESIZE) if blockdata[p * FX_PAGESIZE:(p + 1) * FX_PAGESIZE] == ERASED_PAGE ]
+
+
+class SparseFxWriter:
+    """
+    Write a sparse FX backup, one block at a time and in order, without holding more than one block in memory.
+    length is the size of the backup (the whole flash, or just the cart). Use as a context manager, or call close
+    once every block is added; the file isn't valid until then. If anything goes wrong (an exception in the 
+    with block, or closing before every block is added), the partial file is removed.
+    """
+
+    def __init__(self, filename: str, jedec_id: bytes, capacity: int, length: int):
+        self.filename = filename
+        self.jedec_id = bytes(jedec_id)
+        self.capacity = capacity
+        self.length = length
+        self.extents = []   # [start page, page count], merged across blocks
+        self.chunks = {}    # block -> [file offset, compressed length, sha256 of the block]
+        self.next_block = 0
+        self._hash = sha256()
+        self._file = open(filename, "wb")
+        self._file.write(FXSPARSE_MAGIC + bytes([FXSPARSE_VERSION]))
+
+    def add_block(self, blockdata):
+        """Add the next block of the backup (the last one may be short). Returns the sha256 of the block"""
+        block = self.next_block
+        expected = min(FX_BLOCKSIZE, self.length - block * FX_BLOCKSIZE)
+        if len(blockdata) != expected:
+            raise Exception(f"Sparse backup block {block} is {len(blockdata)} bytes, expected {expected}")
+        self._hash.update(blockdata)
+        digest = sha256(blockdata).hexdigest()
+        erased = _erased_pages(blockdata)
+        for p in erased:
+            page = block * FX_PAGES_PER_BLOCK + p
+            if self.extents and self.extents[-1][0] + self.extents[-1][1] == page:
+                self.extents[-1][1] += 1
+            else:
+                self.extents.append([page, 1])
+        if len(erased) * FX_PAGESIZE < len(blockdata):
+            erased = set(erased)
+            kept = b"".join(blockdata[p * FX_PAGESIZE:(p + 1) * FX_PAGESIZE] for p in range((len(blockdata) + FX_PAGESIZE - 1) // FX_PAGESIZE) if p not in erased)
+            compressed = zlib.compress(kept)
+            self.chunks[block] = [self._file.tell(), len(compressed), digest]
+            self._file.write(compressed)
+        self.next_block += 1
+        return digest
+
+    def close(self):
+        """Write the index and finish the file. Returns the sha256 hex digest of the whole backup"""
+        if self._file.closed:
+            return self._hash.hexdigest()
+        blocks = (self.length + FX_BLOCKSIZE - 1) // FX_BLOCKSIZE
+        if self.next_block != blocks:
+            self.discard()
+            raise Exception(f"Sparse backup {self.filename} is incomplete, {self.next_block} of {blocks} blocks written")
+        index = json.dumps({
+            "jedec_id": self.jedec_id.hex(),
+            "capacity": self.capacity,
+            "length": self.length,
+            "sha256": self._hash.hexdigest(),
+            "extents": self.extents,
+            "chunks": { str(block): chunk for block, chunk in self.chunks.items() },
+        }).encode()
+        offset = self._file.tell()
+        self._file.write(index)
+        self._file.write(_FOOTER.pack(offset, len(index), FXSPARSE_MAGIC))
+        self._file.close()
+        logging.info(f"Wrote sparse FX backup {self.filename}: {len(self.chunks)} of {blocks} blocks stored, {os.path.getsize(self.filename)} bytes")
+        return self._hash.hexdigest()
+
+    def discard(self):
+        """Close and remove the unfinished file"""
+        self._file.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type:
+            self.discard()
+        else:
+            self.close()
+
+
+class SparseFxFile:
+    """
+    Random access to the blocks of a sparse FX backup. Only the index is read up front; each block is
+    decompressed (and checked against its hash) when asked for. Use as a context manager, or call close.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._file = open(filename, "rb")
+        try:
+            if self._file.read(len(FXSPARSE_MAGIC) + 1) != FXSPARSE_MAGIC + bytes([FXSPARSE_VERSION]):
+                raise Exception(f"{filename} is not a sparse FX backup (or is an unsupported version)")
+            self._file.seek(-_FOOTER.size, os.SEEK_END)
+            offset, length, magic = _FOOTER.unpack(self._file.read(_FOOTER.size))
+            if magic != FXSPARSE_MAGIC:
+                raise Exception(f"Sparse FX backup {filename} is incomplete")
+            self._file.seek(offset)
+            index = json.loads(self._file.read(length))
+        except Exception:
+            self._file.close()
+            raise
+        self.jedec_id = bytes.fromhex(index["jedec_id"])
+        self.capacity = index["capacity"]
+        self.length = index["length"]
+        self.sha256 = index["sha256"]
+        self.extents = index["extents"]
+        self.chunks = { int(block): chunk for block, chunk in index["chunks"].items() }
+        self._extent_starts = [ e[0] for e in self.extents ]
+
+    def __len__(self):
+        """The number of blocks in the backup"""
+        return (self.length + FX_BLOCKSIZE - 1) // FX_BLOCKSIZE
+
+    def block_length(self, block) -> int:
+        return min(FX_BLOCKSIZE, self.length - block * FX_BLOCKSIZE)
+
+    def is_erased(self, block) -> bool:
+        """Whether the given block is entirely erased (stored as nothing but extents)"""
+        return block not in self.chunks
+
+    def _erased_pages(self, block):
+        """The erased pages (indexes within the block) of the given block, from the extents"""
+        first = block * FX_PAGES_PER_BLOCK
+        last = first + (self.block_length(block) + FX_PAGESIZE - 1) // FX_PAGESIZE
+        result = set()
+        for i in range(max(0, bisect.bisect_right(self._extent_starts, first) - 1), len(self.extents)):
+            start, count = self.extents[i]
+            if start >= last:
+                break
+            result.update(range(max(start, first) - first, min(start + count, last) - first))
+        return result
+
+    def read_block(self, block) -> bytearray:
+        """The contents of the given block (the last one may be short)"""
+        length = self.block_length(block)
+        if block < 0 or length <= 0:
+            raise IndexError(f"Block {block} is not in sparse FX backup {self.filename}")
+        result = bytearray(b"\xFF" * length)
+        if self.is_erased(block):
+            return result
+        offset, compressed_length, digest = self.chunks[block]
+        self._file.seek(offset)
+        kept = zlib.decompress(self._file.read(compressed_length))
+        erased = self._erased_pages(block)
+        position = 0
+        for p in range((length + FX_PAGESIZE - 1) // FX_PAGESIZE):
+            if p not in erased:
+                pagelength = min(FX_PAGESIZE, length - p * FX_PAGESIZE)
+                result[p * FX_PAGESIZE:p * FX_PAGESIZE + pagelength] = kept[position:position + pagelength]
+                position += pagelength
+        if sha256(result).hexdigest() != digest:
+            raise Exception(f"Sparse FX backup {self.filename} is corrupt at block {block}")
+        return result
+
+    def blocks(self):
+        """Every block in order, as (block, contents)"""
+        for block in range(len(self)):
+            yield block, self.read_block(block)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_file(filename: str, data, jedec_id: bytes = b"\x00\x00\x00", capacity: int = None):
+    """Store an FX image already in memory (say, an old full backup) as a sparse backup. Returns its sha256 hex digest"""
+    with SparseFxWriter(filename, jedec_id, capacity or len(data), len(data)) as writer:
+        for start in range(0, len(data), FX_BLOCKSIZE):
+            writer.add_block(data[start:start + FX_BLOCKSIZE])
+    return writer.close()
@@ -0,0 +1,157 @@
+# Find out about arduboys being plugged in and unplugged as it happens, instead of polling comports() on a timer.
+# On linux, the kernel's uevents (the same thing udev listens to) tell us when to look; everywhere else (or if
+# that doesn't work), we poll, quickly right after something changed and slowing down while nothing does.
+import logging
+import socket
+import threading
+import time
+import arduboy.device
+
+from dataclasses import dataclass
+
+POLL_MIN = 0.05     # Fastest poll interval, right after something changed
+POLL_MAX = 1        # Slowest poll interval, after a while of nothing happening
+EVENT_SETTLE = 0.05 # How long to wait after a uevent for the rest of them (one device makes several)
+RESCAN_MAX = 5      # Even with uevents, look anyway this often, just in case
+
+DEVICE_CONNECTED = "connected"
+DEVICE_DISCONNECTED = "disconnected"
+
+@dataclass
+class DeviceEvent:
+    kind: str   # DEVICE_CONNECTED or DEVICE_DISCONNECTED
+    device: "arduboy.device.ArduboyDevice"
+
+
+class UeventMonitor:
+    """Kernel uevents for tty devices (linux only). Check 'available' before using; it's False anywhere else"""
+
+    def __init__(self):
+        self.sock = None
+        try:
+            self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, socket.NETLINK_KOBJECT_UEVENT)
+            self.sock.bind((0, 1)) # Group 1 is the kernel's own events
+        except (AttributeError, OSError) as ex:
+            logging.debug(f"No uevents, falling back to polling: {ex}")
+            self.sock = None
+
+    @property
+    def available(self):
+        return self.sock is not None
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds for a tty device to come or go. Returns whether one did"""
+        deadline = time.monotonic() + timeout
+        found = False
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return found
+            self.sock.settimeout(remaining)
+            try:
+                event = self.sock.recv(8192)
+            except (socket.timeout, BlockingIOError):
+                return found
+            if b"\0SUBSYSTEM=tty\0" in event:
+                if not found:
+                    # Collect the rest of this device's events before anyone goes looking
+                    found = True
+                    deadline = time.monotonic() + EVENT_SETTLE
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+
+def wait_until(condition, timeout = None):
+    """
+    Wait until condition() returns something truthy and return it, checking whenever a device comes or goes
+    (or polling if we can't tell). Returns None if timeout (seconds) passes first.
+    """
+    start = time.monotonic()
+    monitor = UeventMonitor()
+    interval = POLL_MIN
+    try:
+        while True:
+            result = condition()
+            if result:
+                return result
+            if timeout is not None and time.monotonic() - start > timeout:
+                return None
+            wait = interval if timeout is None else max(0, min(interval, timeout - (time.monotonic() - start)))
+            if monitor.available:
+                monitor.wait(wait)
+                interval = min(RESCAN_MAX, interval * 2)
+            else:
+                time.sleep(wait)
+                interval = min(POLL_MAX, interval * 2)
+    finally:
+        monitor.close()
+
+
+class DeviceWatcher:
+    """
+    Watches for arduboys (anything in arduboy.device.DEVICES) coming and going on a background thread, calling
+    callback with a DeviceEvent for each. Devices already connected when it starts are reported as connected.
+    Use as a context manager, or call start/stop.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.devices = []
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _scan(self):
+        current = arduboy.device.get_connected_devices(log=False)
+        key = lambda d: (d.port, d.vidpid)
+        before = set(map(key, self.devices))
+        after = set(map(key, current))
+        events = [ DeviceEvent(DEVICE_DISCONNECTED, d) for d in self.devices if key(d) not in after ]
+        events += [ DeviceEvent(DEVICE_CONNECTED, d) for d in current if key(d) not in before ]
+        self.devices = current
+        for event in events:
+            logging.debug(f"Device {event.kind}: {event.device}")
+            self.callback(event)
+        return len(events) > 0
+
+    def _watch(self):
+        monitor = UeventMonitor()
+        interval = POLL_MIN
+        try:
+            while not self._stop.is_set():
+                try:
+                    changed = self._scan()
+                except Exception as ex:
+                    logging.warning(f"Device scan error: {ex}")
+                    changed = False
+                if monitor.available:
+                    # Wake up periodically anyway so stop() doesn't have to wait for a uevent
+                    deadline = time.monotonic() + RESCAN_MAX
+                    while not self._stop.is_set() and time.monotonic() < deadline:
+                        if monitor.wait(min(POLL_MAX, deadline - time.monotonic())):
+                            break
+                else:
+                    interval = POLL_MIN if changed else min(POLL_MAX, interval * 2)
+                    self._stop.wait(interval)
+        finally:
+            monitor.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,136 @@
+# Run several bootloader operations back to back on one connection, so the device only has to be reset
+# into the bootloader (and found again) once. Useful for provisioning: flash a sketch, its dev data, an
+# eeprom, verify, exit, all as one job with one progress bar.
+import logging
+import time
+import arduboy.common
+import arduboy.device
+import arduboy.serial
+
+from arduboy.constants import *
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, List
+
+@dataclass
+class JobStep:
+    """One operation in a job. work is called with the session and a report_progress function"""
+    name: str
+    work: Callable
+    weight: int = field(default=1)  # Share of the job's progress this step takes up, roughly the bytes it moves
+    verifies: bool = field(default=False) # Whether the step checks what was written
+
+def flash_sketch_step(bindata: bytearray, changed_only = False) -> JobStep:
+    """Flash a sketch. With changed_only, only pages which differ from the device are written (and verified)"""
+    bindata = arduboy.common.pad_data(bytearray(bindata), FLASH_PAGESIZE)
+    if changed_only:
+        return JobStep("Flashing sketch", lambda s_port, rp: arduboy.serial.flash_arduhex_changed(bindata, s_port, rp), len(bindata), True)
+    return JobStep("Flashing sketch", lambda s_port, rp: arduboy.serial.flash_arduhex(bindata, s_port, rp), len(bindata))
+
+def verify_sketch_step(bindata: bytearray) -> JobStep:
+    bindata = arduboy.common.pad_data(bytearray(bindata), FLASH_PAGESIZE)
+    return JobStep("Verifying sketch", lambda s_port, rp: arduboy.serial.verify_arduhex(bindata, s_port, rp), len(bindata), True)
+
+def flash_fx_step(fxdata: bytearray, pagenumber = -1, verify = True) -> JobStep:
+    """Flash FX data, by default as dev data (at the end of the flash)"""
+    return JobStep("Flashing FX data", lambda s_port, rp: arduboy.serial.flash_fx(fxdata, pagenumber, s_port, verify, rp),
+                   len(fxdata) * (2 if verify else 1), verify)
+
+def write_eeprom_step(eepromdata: bytearray) -> JobStep:
+    return JobStep("Writing EEPROM", lambda s_port, _: arduboy.serial.write_eeprom_diff(eepromdata, s_port), len(eepromdata), True)
+
+def exit_step(normal = False) -> JobStep:
+    """Leave the bootloader: start the sketch (normal = False), or just turn off the LED and disconnect"""
+    if normal:
+        return JobStep("Exiting bootloader", lambda s_port, _: arduboy.serial.exit_normal(s_port))
+    return JobStep("Exiting bootloader", lambda s_port, _: arduboy.serial.exit_bootloader(s_port))
+
+
+def run_job(steps: List[JobStep], s_port, report_progress = None, report_status = None):
+    """
+    Run the given steps in order on the given connection (a port or BootloaderSession; ports are wrapped in a
+    session so device facts are only read once). Progress is reported for the whole job, each step taking up
+    its weight of it, and the name of each step is reported as the status as it starts. Stops at the first
+    step which raises.
+    """
+    if not isinstance(s_port, arduboy.serial.BootloaderSession):
+        s_port = arduboy.serial.BootloaderSession(s_port)
+
+    total = sum(step.weight for step in steps)
+    done = 0
+    start = time.time()
+
+    for step in steps:
+        logging.info(f"Job step: {step.name}")
+        if report_status:
+            report_status(step.name + "...")
+        def step_progress(current, step_total, done = done, weight = step.weight):
+            if report_progress and step_total:
+                report_progress(done + weight * current // step_total, total)
+        step.work(s_port, step_progress)
+        done += step.weight
+        if report_progress:
+            report_progress(done, total)
+
+    logging.info("Job of {} steps done in {} seconds".format(len(steps), round(time.time() - start,2)))
+
+def run_job_on_device(steps: List[JobStep], report_progress = None, report_status = None, device = None):
+    """Find the single connected device (putting it in its bootloader) once, then run the whole job on it"""
+    if device is None:
+        device = arduboy.device.find_single()
+    s_port = device.connect_serial()
+    try:
+        run_job(steps, s_port, report_progress, report_status)
+    finally:
+        s_port.close() # Exiting already closes it, this is in case the job didn't (or failed)
+
+
+@dataclass
+class DeviceJobResult:
+    """What happened when running a job on one of many devices (see run_job_on_all)"""
+    port: str
+    jedec_id: bytearray = field(default=None)   # None if the device has no flash chip (or never got that far)
+    seconds: float = field(default=0)
+    ok: bool = field(default=False)             # Every step finished without error
+    verified: bool = field(default=False)       # ok, and at least one step checked what was written
+    error: str = field(default=None)
+
+def run_job_on_all(steps: List[JobStep], devices = None, report_progress = None) -> List[DeviceJobResult]:
+    """
+    Run the same job on many devices at once, one thread per device. If no devices are given, every connected
+    arduboy is found and put in its bootloader (see arduboy.device.find_all). A failure on one device doesn't
+    stop the others; check the results, which are in the same order as the devices. report_progress, if
+    given, is called with the port as well as the current and total progress.
+    """
+    if devices is None:
+        devices = arduboy.device.find_all()
+
+    def work(device):
+        result = DeviceJobResult(device.port)
+        start = time.time()
+        s_port = None
+        try:
+            s_port = arduboy.serial.BootloaderSession(device.connect_serial())
+            try:
+                # Only bootloaders with flash cart support know the jedec command
+                if s_port.version >= 13:
+                    result.jedec_id = s_port.jedec_info.id
+            except Exception as ex:
+                logging.debug(f"No flash chip on {device.port}: {ex}")
+            run_job(steps, s_port, (lambda cur, tot: report_progress(device.port, cur, tot)) if report_progress else None)
+            result.ok = True
+            result.verified = any(step.verifies for step in steps)
+        except Exception as ex:
+            logging.exception(ex)
+            result.error = str(ex)
+        finally:
+            if s_port:
+                s_port.close()
+            result.seconds = time.time() - start
+        logging.info(f"Job on {device.port}: {'ok' if result.ok else result.error} in {result.seconds:.2f} seconds")
+        return result
+
+    if not devices:
+        return []
+    with ThreadPoolExecutor(max_workers = len(devices)) as executor:
+        return list(executor.map(work, devices))
@@ -0,0 +1,201 @@
+# Opt-in instrumentation for the serial connection to the bootloader. Wrap a port in an InstrumentedPort
+# and everything arduboy.serial does through it is timed and counted in a SerialMetrics.
+import json
+import logging
+import time
+
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List
+
+# Upper bounds (in milliseconds) of the latency histogram buckets; anything slower goes in one last bucket
+LATENCY_BUCKETS_MS = [0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+# Names and lengths of the bootloader commands the toolset uses
+COMMAND_NAMES = {
+    ord("A") : ("address", 3),
+    ord("B") : ("write", 4),
+    ord("g") : ("read", 4),
+    ord("V") : ("version", 1),
+    ord("j") : ("jedec", 1),
+    ord("r") : ("lockbits", 1),
+    ord("x") : ("led", 2),
+    ord("E") : ("exit", 1),
+}
+COMMAND_DATA = "data"   # A write which doesn't start with a command
+HOST_TIME = "host"      # Time between getting a response and sending the next thing (our own processing, sleeps, etc)
+
+@dataclass
+class LatencyHistogram:
+    count: int = field(default=0)
+    total: float = field(default=0)
+    min: float = field(default=None)
+    max: float = field(default=None)
+    buckets: List[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS_MS) + 1))
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+        milliseconds = seconds * 1000
+        bucket = 0
+        while bucket < len(LATENCY_BUCKETS_MS) and milliseconds > LATENCY_BUCKETS_MS[bucket]:
+            bucket += 1
+        self.buckets[bucket] += 1
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+@dataclass
+class OperationMetrics:
+    name: str
+    seconds: float = field(default=0)
+    bytes_written: int = field(default=0)
+    bytes_read: int = field(default=0)
+
+    def throughput(self):
+        """Bytes moved per second, both directions"""
+        return (self.bytes_written + self.bytes_read) / self.seconds if self.seconds else 0
+
+
+class SerialMetrics:
+    """
+    Everything recorded about serial traffic: a latency histogram per command (time from sending the command
+    to its response fully arriving), the host time between responses and the next command, bytes moved, and
+    per-operation totals for any operations marked with operation().
+    """
+
+    def __init__(self):
+        self.latencies: Dict[str, LatencyHistogram] = {}
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.operations: List[OperationMetrics] = []
+        self._current: List[OperationMetrics] = []
+
+    def add_latency(self, command: str, seconds: float):
+        if command not in self.latencies:
+            self.latencies[command] = LatencyHistogram()
+        self.latencies[command].add(seconds)
+
+    def add_transfer(self, written: int, read: int):
+        self.bytes_written += written
+        self.bytes_read += read
+        for operation in self._current:
+            operation.bytes_written += written
+            operation.bytes_read += read
+
+    @contextmanager
+    def operation(self, name: str):
+        """Record the time and bytes moved for everything done within this context under the given name"""
+        operation = OperationMetrics(name)
+        self._current.append(operation)
+        start = time.perf_counter()
+        try:
+            yield operation
+        finally:
+            operation.seconds = time.perf_counter() - start
+            self._current.remove(operation)
+            self.operations.append(operation)
+            logging.debug(f"Serial operation '{name}': {operation.seconds:.2f}s, {operation.throughput():.0f} bytes/s")
+
+    def to_dict(self):
+        return {
+            "bytes_written" : self.bytes_written,
+            "bytes_read" : self.bytes_read,
+            "latency_buckets_ms" : LATENCY_BUCKETS_MS,
+            "latencies" : { k : asdict(v) for k, v in self.latencies.items() },
+            "operations" : [ dict(asdict(o), throughput = o.throughput()) for o in self.operations ],
+        }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def summary(self) -> List[str]:
+        """Human readable lines describing the metrics"""
+        lines = [f"Total: {self.bytes_written} bytes written, {self.bytes_read} bytes read"]
+        for name, histogram in sorted(self.latencies.items(), key = lambda x: -x[1].total):
+            lines.append(f"{name:>9}: {histogram.count} x {histogram.mean() * 1000:.2f}ms avg " +
+                         f"({histogram.min * 1000:.2f} - {histogram.max * 1000:.2f}ms), {histogram.total:.2f}s total")
+        for operation in self.operations:
+            lines.append(f"{operation.name}: {operation.seconds:.2f}s, {operation.bytes_written + operation.bytes_read} bytes, " +
+                         f"{operation.throughput() / 1024:.1f} KiB/s")
+        return lines
+
+
+def command_name(data) -> str:
+    """Name the commands in the given write; several batched together are joined like 'led+address+write'"""
+    names = []
+    i = 0
+    while i < len(data) and data[i] in COMMAND_NAMES:
+        name, length = COMMAND_NAMES[data[i]]
+        if name not in names:
+            names.append(name)
+        # Write commands are followed by their payload
+        if name == "write" and i + 3 <= len(data):
+            length += ((data[i + 1] << 8) | data[i + 2]) or 0x10000
+        i += length
+    return "+".join(names) if names else COMMAND_DATA
+
+
+class InstrumentedPort:
+    """Wraps a serial port (or anything like one), recording all traffic through it into the given metrics"""
+
+    def __init__(self, s_port, metrics: SerialMetrics):
+        self.s_port = s_port
+        self.metrics = metrics
+        self._command = None        # The command we're getting the response for
+        self._command_start = 0
+        self._response_end = None   # When the last read of the response finished
+
+    def _finish_command(self, now):
+        """Record the current command, if it got a response. Its response is only known to be done once we move on"""
+        if self._command is not None and self._response_end is not None:
+            self.metrics.add_latency(self._command, self._response_end - self._command_start)
+            self.metrics.add_latency(HOST_TIME, now - self._response_end)
+            self._command = None
+
+    def write(self, data):
+        now = time.perf_counter()
+        self._finish_command(now)
+        # Everything written until a response is read (payloads etc) is part of the first command
+        if self._command is None:
+            self._command = command_name(data)
+            self._command_start = now
+            self._response_end = None
+        result = self.s_port.write(data)
+        self.metrics.add_transfer(len(data), 0)
+        return result
+
+    def read(self, size = 1):
+        result = self.s_port.read(size)
+        self._response_end = time.perf_counter()
+        self.metrics.add_transfer(0, len(result))
+        return result
+
+    def close(self):
+        self._finish_command(time.perf_counter())
+        self.s_port.close()
+
+    def __getattr__(self, name):
+        return getattr(self.s_port, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# Metrics for every port opened through arduboy.device, if enabled (see enable_global_metrics)
+global_metrics: SerialMetrics = None
+
+def enable_global_metrics():
+    global global_metrics
+    if not global_metrics:
+        global_metrics = SerialMetrics()
+    return global_metrics
+
+def disable_global_metrics():
+    global global_metrics
+    global_metrics = None
@@ -1,13 +1,18 @@
 # Given a connected serial port, exit the bootloader
 import logging
 import time
-import io
+import os
+import dataclasses
 import arduboy.common
 import arduboy.arduhex
+import arduboy.fxcart
+import arduboy.fxsparse
 
 from arduboy.constants import *
 from arduboy.device import MANUFACTURERS
 from dataclasses import dataclass
+from hashlib import sha256
+from typing import List
 
 
 
@@ -30,13 +35,18 @@ def exit_normal(s_port):
     s_port.close()
 
 def get_version(s_port):
+    if isinstance(s_port, BootloaderSession):
+        return s_port.version
     s_port.write(b"V")
     return int(s_port.read(2))
 
+# How long to wait before asking for the jedec id a second time
+JEDEC_RETRY_WAIT = 0.5
+
 def get_jedec_id(s_port):
     s_port.write(b"j")
     jedec_id = s_port.read(3)
-    time.sleep(0.5)   #  Why is this necessary? This sucks... maybe weird manufacturer quirks?
+    time.sleep(JEDEC_RETRY_WAIT)   #  Why is this necessary? This sucks... maybe weird manufacturer quirks?
     s_port.write(b"j")
     jedec_id2 = s_port.read(3)
     if jedec_id2 != jedec_id or jedec_id == b'\x00\x00\x00' or jedec_id == b'\xFF\xFF\xFF':
@@ -47,6 +57,25 @@ def address_command(page):
     """Get the set-address command for the given INTERNAL FLASH page (128 byte pages), it's nontrivial"""
     return bytearray([ord("A"), page >> 2, (page & 3) << 6])
 
+def fx_address_command(page):
+    """Get the set-address command for the given FX page (256 byte pages)"""
+    return bytearray([ord("A"), page >> 8, page & 0xFF])
+
+def fx_read_command(length):
+    """Get the read command for the given amount of FX bytes (max 1 block, which is sent as 0)"""
+    return bytearray([ord("g"), (length >> 8) & 0xFF, length & 0xFF, ord("C")])
+
+def fx_write_command(length):
+    """Get the write command for the given amount of FX bytes (max 1 block, which is sent as 0)"""
+    return bytearray([ord("B"), (length >> 8) & 0xFF, length & 0xFF, ord("C")])
+
+def read_fx(s_port, pagenumber, length):
+    """Read the given amount of bytes (max 1 block) from the FX flash at the given page"""
+    s_port.write(fx_address_command(pagenumber))
+    s_port.read(1)
+    s_port.write(fx_read_command(length))
+    return s_port.read(length)
+
 
 @dataclass
 class JedecInfo:
@@ -64,6 +93,8 @@ class JedecInfo:
 
 # Get parsed jedec info from device. Will throw exception if device has no jedec info
 def get_jedec_info(s_port) -> JedecInfo:
+    if isinstance(s_port, BootloaderSession):
+        return s_port.jedec_info
     jedec_id = get_jedec_id(s_port)
     if jedec_id[0] in MANUFACTURERS.keys():
         manufacturer = MANUFACTURERS[jedec_id[0]]
@@ -73,7 +104,11 @@ def get_jedec_info(s_port) -> JedecInfo:
 
 # Given a connected serial port, see if bootloader is "caterina"
 def is_caterina(s_port):
-    version = get_version(s_port)   #get bootloader software version
+    if isinstance(s_port, BootloaderSession):
+        return s_port.caterina
+    return _is_caterina(s_port, get_version(s_port))  #get bootloader software version
+
+def _is_caterina(s_port, version):
     if version == 10:       #original caterina 1.0 bootloader
         s_port.write(b"r")  #read lock bits
         return ord(s_port.read(1)) & 0x10 != 0
@@ -84,6 +119,11 @@ def bootloader_length(s_port):
     return  2048 + (2048 if is_caterina(s_port) else 1024)
 
 def read_bootloader(s_port):
+    if isinstance(s_port, BootloaderSession):
+        return bytearray(s_port.bootloader)
+    return _read_bootloader(s_port)
+
+def _read_bootloader(s_port):
     blength = bootloader_length(s_port)
     logging.debug(f"Reading bootloader, length = {blength}")
     # Read the larger of the two bootloaders
@@ -95,25 +135,162 @@ def read_bootloader(s_port):
     return result[-blength:]
 
 
+class BootloaderSession:
+    """
+    An open connection to a device in its bootloader, which remembers facts about the device (version, jedec
+    info, caterina or not, the bootloader itself and the device type) the first time they're needed, instead of
+    asking the device every time. Can be used anywhere a serial port can; all functions here will use the
+    remembered facts. The facts are only good for as long as the connection is.
+    """
+
+    def __init__(self, s_port):
+        self.s_port = s_port
+        self._version = None
+        self._jedec_info = None
+        self._caterina = None
+        self._bootloader = None
+        self._device_type = None
+
+    @property
+    def version(self) -> int:
+        if self._version is None:
+            self._version = get_version(self.s_port)
+        return self._version
+
+    @property
+    def jedec_info(self) -> JedecInfo:
+        """Raises the same exception as get_jedec_info if there's no flash chip (which isn't remembered)"""
+        if self._jedec_info is None:
+            self._jedec_info = get_jedec_info(self.s_port)
+        return self._jedec_info
+
+    @property
+    def caterina(self) -> bool:
+        if self._caterina is None:
+            self._caterina = _is_caterina(self.s_port, self.version)
+        return self._caterina
+
+    @property
+    def bootloader(self) -> bytearray:
+        if self._bootloader is None:
+            self._bootloader = _read_bootloader(self)
+        return self._bootloader
+
+    @property
+    def device_type(self) -> str:
+        """Same as arduboy.shortcuts.detect_device_type"""
+        if self._device_type is None:
+            self._device_type = arduboy.arduhex.analyze_sketch(self.bootloader, bootloader=True).detected_device
+        return self._device_type
+
+    def write(self, data):
+        return self.s_port.write(data)
+
+    def read(self, size = 1):
+        return self.s_port.read(size)
+
+    def close(self):
+        self.s_port.close()
+
+    def __getattr__(self, name):
+        return getattr(self.s_port, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# How many sketch pages can be sent before waiting for their acks. The bootloader handles commands in
+# order, so this just keeps the USB pipe full instead of paying a round trip for every page
+FLASH_PIPELINE_WINDOW = 16
+
+def flash_write_command(length):
+    """Get the write command for the given amount of INTERNAL FLASH bytes"""
+    return bytearray([ord("B"), (length >> 8) & 0xFF, length & 0xFF, ord("F")])
+
+def flash_read_command(length):
+    """Get the read command for the given amount of INTERNAL FLASH bytes"""
+    return bytearray([ord("g"), (length >> 8) & 0xFF, length & 0xFF, ord("F")])
+
 # Flash the given arduboy hex file to the given connected arduboy. Can report progress
-# by giving a function that accepts a "current" and "total" parameter.
-def flash_arduhex(bindata: bytearray, s_port, report_progress: None):
+# by giving a function that accepts a "current" and "total" parameter. Up to window pages
+# are sent before their acks are read; a window of 1 waits on every page.
+def flash_arduhex(bindata: bytearray, s_port, report_progress: None, window = FLASH_PIPELINE_WINDOW):
     # Analyze the bindata
+    bindata, analysis = _prepare_arduhex(bindata, s_port)
+    logging.info("Flashing {} pages".format(analysis.total_pages))
+    write_flash_pages(bindata, range(analysis.total_pages), s_port, report_progress, window)
+
+def _prepare_arduhex(bindata: bytearray, s_port):
     bindata = arduboy.common.pad_data(bindata.copy(), FLASH_SIZE)
     analysis = arduboy.arduhex.analyze_sketch(bindata)
     logging.debug(f"Info on hex file: {analysis.total_pages} pages, is_caterina: {analysis.overwrites_caterina}")
     # Just like fx flash rejects non-fx chips and bad bootloaders, this one too will reject "bad" bootloader
     if analysis.overwrites_caterina and is_caterina(s_port):
         raise Exception("Upload will likely corrupt the bootloader.")
-    logging.info("Flashing {} pages".format(analysis.total_pages))
-    for i in range(analysis.total_pages): # (FLASH_PAGECOUNT):
-        s_port.write(address_command(i))
-        s_port.read(1)
-        s_port.write(b"B\x00\x80F")
-        s_port.write(bindata[i * FLASH_PAGESIZE: (i + 1) * FLASH_PAGESIZE])
-        s_port.read(1)
+    return bindata, analysis
+
+# Write the given flash pages (page numbers) out of bindata (a full flash image), sending a window of pages
+# at a time before reading back their acks.
+def write_flash_pages(bindata: bytearray, pages, s_port, report_progress = None, window = FLASH_PIPELINE_WINDOW):
+    pages = list(pages)
+    write_command = flash_write_command(FLASH_PAGESIZE)
+    for first in range(0, len(pages), window):
+        batch = pages[first:first + window]
+        commands = bytearray()
+        for i in batch:
+            commands += address_command(i)
+            commands += write_command
+            commands += bindata[i * FLASH_PAGESIZE: (i + 1) * FLASH_PAGESIZE]
+        s_port.write(commands)
+        # One ack for the address and one for the write, for every page
+        acks = s_port.read(2 * len(batch))
+        if len(acks) != 2 * len(batch):
+            raise Exception("Flash failed at address {:04X}, no response from bootloader.".format(batch[0] * FLASH_PAGESIZE))
+        if report_progress:
+            report_progress(first + len(batch), len(pages))
+
+# Flash only the pages of the sketch which differ from what's already on the arduboy, then verify just those.
+# The current sketch is read back with one command, which is much faster than writing (and wearing out) pages
+# that haven't changed, as in a typical edit-upload loop. Returns the number of pages written.
+def flash_arduhex_changed(bindata: bytearray, s_port, report_progress = None, window = FLASH_PIPELINE_WINDOW):
+    bindata, analysis = _prepare_arduhex(bindata, s_port)
+    total = analysis.total_pages
+    if total == 0:
+        return 0 # Nothing to write, and a read of length 0 would read 64k
+    s_port.write(address_command(0))
+    s_port.read(1)
+    s_port.write(flash_read_command(total * FLASH_PAGESIZE))
+    current = s_port.read(total * FLASH_PAGESIZE)
+    if len(current) != total * FLASH_PAGESIZE:
+        raise Exception("Couldn't read current sketch, no response from bootloader.")
+    changed = [ i for i in range(total) if current[i * FLASH_PAGESIZE : (i + 1) * FLASH_PAGESIZE] != bindata[i * FLASH_PAGESIZE : (i + 1) * FLASH_PAGESIZE] ]
+    logging.info(f"Flashing {len(changed)} of {total} pages (the rest are unchanged)")
+    # Writing is the slow part, so it gets most of the progress
+    def write_progress(current, _):
+        if report_progress:
+            report_progress(current, len(changed) * 2)
+    write_flash_pages(bindata, changed, s_port, write_progress, window)
+    # Verify the written pages, each is its own address + read so batch those up too
+    read_command = flash_read_command(FLASH_PAGESIZE)
+    for first in range(0, len(changed), window):
+        batch = changed[first:first + window]
+        commands = bytearray()
+        for i in batch:
+            commands += address_command(i)
+            commands += read_command
+        s_port.write(commands)
+        for i in batch:
+            response = s_port.read(1 + FLASH_PAGESIZE)
+            if response[1:] != bindata[i * FLASH_PAGESIZE : (i + 1) * FLASH_PAGESIZE]:
+                # Drain the rest of the batch so the bootloader is left in a usable state
+                s_port.read((1 + FLASH_PAGESIZE) * (len(batch) - batch.index(i) - 1))
+                raise Exception("Verify failed at address {:04X}. Upload unsuccessful.".format(i * FLASH_PAGESIZE))
         if report_progress:
-            report_progress(i, analysis.total_pages)
+            report_progress(len(changed) + first + len(batch), len(changed) * 2)
+    return len(changed)
 
 # Read the sketch off arduboy. Does not strip unused bytes (but will strip bootloader if configured)
 def backup_sketch(s_port, include_bootloader = False):
@@ -130,20 +307,24 @@ def backup_sketch(s_port, include_bootloader = False):
     return backupdata
 
 # Verify that the given arduboy hex file is correctly flashed to the given connected arduboy. Can report progress
-# by giving a function that accepts a "current" and "total" parameter.
+# by giving a function that accepts a "current" and "total" parameter. The whole sketch is read back with one command.
 def verify_arduhex(bindata: bytearray, s_port, report_progress: None):
     analysis = arduboy.arduhex.analyze_sketch(bindata)
     logging.info("Verifying {} flash pages".format(analysis.total_pages))
-    flash_page = 0
+    if analysis.total_pages == 0:
+        # Nothing to compare, and a zero length read means 64K to the bootloader
+        return
+    s_port.write(address_command(0))
+    s_port.read(1)
+    s_port.write(flash_read_command(analysis.total_pages * FLASH_PAGESIZE))
+    # The read is still taken a page at a time so we know where it failed (and can report progress)
     for i in range (analysis.total_pages) :
-        s_port.write(address_command(i)) # bytearray([ord("A"), i >> 2, (i & 3) << 6]))
-        s_port.read(1)
-        s_port.write(b"g\x00\x80F")
-        if s_port.read(128) != bindata[i * 128 : (i + 1) * 128]:
-            raise Exception("Verify failed at address {:04X}. Upload unsuccessful.".format(i * 128))
-        flash_page += 1
+        if s_port.read(FLASH_PAGESIZE) != bindata[i * FLASH_PAGESIZE : (i + 1) * FLASH_PAGESIZE]:
+            # Drain the rest of the read so the bootloader is left in a usable state
+            s_port.read((analysis.total_pages - i - 1) * FLASH_PAGESIZE)
+            raise Exception("Verify failed at address {:04X}. Upload unsuccessful.".format(i * FLASH_PAGESIZE))
         if report_progress:
-            report_progress(flash_page, analysis.total_pages)
+            report_progress(i + 1, analysis.total_pages)
 
 # Read the 1k eeprom as a byte array. Cannot report progress (too small)
 def read_eeprom(s_port):
@@ -166,6 +347,46 @@ def write_eeprom(eepromdata, s_port):
     s_port.write(eepromdata)
     s_port.read(1)
 
+def eeprom_address_command(address):
+    """Get the set-address command for the given EEPROM byte address"""
+    return bytearray([ord("A"), address >> 8, address & 0xFF])
+
+def eeprom_changed_runs(old, new):
+    """The (start, end) ranges of bytes which differ between two equal length eeproms"""
+    runs = []
+    start = None
+    for i in range(len(new)):
+        if old[i] != new[i]:
+            if start is None:
+                start = i
+        elif start is not None:
+            runs.append((start, i))
+            start = None
+    if start is not None:
+        runs.append((start, len(new)))
+    return runs
+
+# Write the 1k eeprom as a byte array, but only the bytes which differ from what's already there. EEPROM
+# writes are slow (several milliseconds a byte) while reads are fast, so this is much faster than write_eeprom
+# when only a few bytes changed (a save, for instance). The written bytes are read back and checked.
+# Returns how many bytes were written.
+def write_eeprom_diff(eepromdata, s_port):
+    if len(eepromdata) != 1024:
+        raise Exception("Provided EEPROM data does not contain exactly 1K (1024 bytes)")
+    current = read_eeprom(s_port)
+    runs = eeprom_changed_runs(current, eepromdata)
+    logging.debug(f"Writing {len(runs)} changed EEPROM runs ({sum(e - s for s, e in runs)} bytes)")
+    # Each run costs a couple of fast round trips, always cheaper than rewriting even one unchanged byte
+    for start, end in runs:
+        s_port.write(eeprom_address_command(start))
+        s_port.read(1)
+        s_port.write(bytearray([ord("B"), (end - start) >> 8, (end - start) & 0xFF, ord("E")]))
+        s_port.write(eepromdata[start:end])
+        s_port.read(1)
+    if runs and read_eeprom(s_port) != eepromdata:
+        raise Exception("EEPROM verify failed. Restore unsuccessful.")
+    return sum(end - start for start, end in runs)
+
 # Erase entire eeprom (apparently means all 0xFF). Cannot report progress (too small)
 def erase_eeprom(s_port):
     s_port.write(address_command(0)) # b"A\x00\x00")
@@ -183,18 +404,11 @@ def get_and_verify_jdec_bootloader(s_port):
     logging.info(f"JDEC info: {jedec_info}")
     return jedec_info
 
-# Write the given flash blob (of exact size?) to the given exact page offset in fx.
-# Taken almost verbatim from https://github.com/MrBlinky/Arduboy-Python-Utilities/blob/main/flashcart-writer.py.
-# This one strays from the design of the other flashing functions because the verification is builtin.
-def flash_fx(flashdata: bytearray, pagenumber: int, s_port, verify = True, report_progress = None):
-
-    if not len(flashdata):
-        raise Exception("No flash data provided!")
-
-    info = get_and_verify_jdec_bootloader(s_port)
-    flashdata = arduboy.common.pad_data(flashdata, FX_PAGESIZE)
-    
-    start=time.time()
+# Make the given flash blob (to be written at the given page) cover only whole blocks, reading whatever is
+# already on the device for the partial blocks at the start and end. Returns the new data and its page
+# (the given data is left alone).
+def prepare_fx_blocks(flashdata: bytearray, pagenumber: int, s_port, info: JedecInfo):
+    flashdata = arduboy.common.pad_data(bytearray(flashdata), FX_PAGESIZE)
 
     # If someone requested to write to the end of the flash, figure out the page number such that
     # it would encompass the whole data right at the end
@@ -206,10 +420,7 @@ def flash_fx(flashdata: bytearray, pagenumber: int, s_port, verify = True, repor
         blocklen  = pagenumber % FX_PAGES_PER_BLOCK * FX_PAGESIZE
         blockaddr = pagenumber // FX_PAGES_PER_BLOCK * FX_PAGES_PER_BLOCK
         #read partial block data start
-        s_port.write(bytearray([ord("A"), blockaddr >> 8, blockaddr & 0xFF]))
-        s_port.read(1)
-        s_port.write(bytearray([ord("g"), (blocklen >> 8) & 0xFF, blocklen & 0xFF,ord("C")]))
-        flashdata = s_port.read(blocklen) + flashdata
+        flashdata = read_fx(s_port, blockaddr, blocklen) + flashdata
         pagenumber = blockaddr
       
     # when ending partially in a block, preserve the ending of old block data
@@ -217,47 +428,365 @@ def flash_fx(flashdata: bytearray, pagenumber: int, s_port, verify = True, repor
         blocklen = FX_BLOCKSIZE - len(flashdata) % FX_BLOCKSIZE
         blockaddr = pagenumber + len(flashdata) // FX_PAGESIZE
         #read partial block data end
-        s_port.write(bytearray([ord("A"), blockaddr >> 8, blockaddr & 0xFF]))
-        s_port.read(1)
-        s_port.write(bytearray([ord("g"), (blocklen >> 8) & 0xFF, blocklen & 0xFF,ord("C")]))
-        flashdata += s_port.read(blocklen)
+        flashdata += read_fx(s_port, blockaddr, blocklen)
 
-    ## write to flash cart ##
-    blocks = len(flashdata) // FX_BLOCKSIZE
-    logging.info("Flashing {} blocks to FX in port {}".format(blocks, s_port.port))
+    return flashdata, pagenumber
 
-    for block in range (blocks):
-        if (block & 1 == 0) or verify:
-            s_port.write(b"x\xC2") #RGB LED RED, buttons disabled
+# Write (and verify) whole blocks of the given flash blob, which must be block aligned and start at a block aligned page.
+# If blocks is given, only those block indexes (within flashdata) are written, everything else is left alone.
+# Each block's LED, address and write commands go out together, followed straight away by its verify read, so a
+# block costs one round trip to the device instead of two. The readback of block N is compared only after block N+1
+# has been sent, while the device is busy erasing and writing it; so at most one more block is written after a bad
+# one. No threads: the device is never sending while we're sending, so nothing can back up.
+def write_fx_blocks(flashdata: bytearray, pagenumber: int, s_port, verify = True, report_progress = None, blocks = None):
+    if blocks is None:
+        blocks = range(len(flashdata) // FX_BLOCKSIZE)
+
+    logging.info("Flashing {} blocks to FX in port {}".format(len(blocks), s_port.port))
+
+    flashview = memoryview(flashdata)
+    pending = None      # The last block's (readback, data, address), still to be compared
+
+    def check(pending):
+        readback, blockdata, blockaddr = pending
+        if readback != blockdata:
+            raise Exception("FX verify failed at address {:04X}. Upload unsuccessful.".format(blockaddr))
+
+    for i, block in enumerate(blocks):
+        if (i & 1 == 0) or verify:
+            led = b"x\xC2" #RGB LED RED, buttons disabled
         else:  
-            s_port.write(b"x\xC0") #RGB LED OFF, buttons disabled
-        s_port.read(1)
+            led = b"x\xC0" #RGB LED OFF, buttons disabled
         blockaddr = pagenumber + block * FX_BLOCKSIZE // FX_PAGESIZE
         blocklen = FX_BLOCKSIZE
-        #write block 
-        s_port.write(bytearray([ord("A"), blockaddr >> 8, blockaddr & 0xFF]))
-        s_port.read(1)
-        s_port.write(bytearray([ord("B"), (blocklen >> 8) & 0xFF, blocklen & 0xFF,ord("C")]))
-        s_port.write(flashdata[block * FX_BLOCKSIZE : block * FX_BLOCKSIZE + blocklen])
-        s_port.read(1)
+        blockdata = flashview[block * FX_BLOCKSIZE : block * FX_BLOCKSIZE + blocklen]
+        #write block, the acks are for the led, address and write
+        s_port.write(led + fx_address_command(blockaddr) + fx_write_command(blocklen))
+        s_port.write(blockdata)
         if verify:
+            s_port.write(b"x\xC1" + fx_address_command(blockaddr) + fx_read_command(blocklen)) #RGB BLUE RED, buttons disabled
+        if pending:
+            try:
+                check(pending)
+            except Exception:
+                # Take this block's responses so the bootloader is left in a usable state
+                s_port.read(3 + 2 + blocklen)
+                raise
+        s_port.read(3)
+        if verify:
+            s_port.read(2)
+            pending = (s_port.read(blocklen), blockdata, blockaddr)
+        if report_progress:
+            report_progress(i + 1, len(blocks))
+
+    if pending:
+        check(pending)
+
+    s_port.write(b"x\x40")#RGB LED off, buttons enabled
+    s_port.read(1)
+
+# Write the given flash blob (of exact size?) to the given exact page offset in fx.
+# Taken almost verbatim from https://github.com/MrBlinky/Arduboy-Python-Utilities/blob/main/flashcart-writer.py.
+# This one strays from the design of the other flashing functions because the verification is builtin.
+def flash_fx(flashdata: bytearray, pagenumber: int, s_port, verify = True, report_progress = None):
+
+    if not len(flashdata):
+        raise Exception("No flash data provided!")
+
+    info = get_and_verify_jdec_bootloader(s_port)
+    
+    start=time.time()
+
+    flashdata, pagenumber = prepare_fx_blocks(flashdata, pagenumber, s_port, info)
+    write_fx_blocks(flashdata, pagenumber, s_port, verify, report_progress)
+
+    logging.info("Wrote {} blocks in {} seconds".format(len(flashdata) // FX_BLOCKSIZE, round(time.time() - start,2)))
+
+
+def fx_cache_filename(cachedir, info: JedecInfo, fingerprint: str):
+    """The file in the given cache folder holding the last image written to a cart with the given id and fingerprint"""
+    return os.path.join(cachedir, f"{info.id.hex()}_{fingerprint}.bin")
+
+# Write a full cart image (starting at page 0), but only the blocks which differ from the image last written to 
+# the same cart, using a cache of written images in cachedir. The cart is identified by its jedec id and the 
+# fingerprint of its header chain (see arduboy.fxcart.fingerprint). If there's no cached image for the cart, 
+# the whole image is written. When the fingerprint matches, the cache is trusted: only the blocks it says changed
+# are written (and verified), the rest aren't even read, so changes it doesn't know about (games writing saves, 
+# dev data, other tools) are left as they are on the device. Set check_unchanged to read back and compare every 
+# block the cache says is the same as well, writing any that differ; that's a read of the whole image.
+def flash_fx_diff(flashdata: bytearray, s_port, cachedir, verify = True, report_progress = None, check_unchanged = False):
+
+    if not len(flashdata):
+        raise Exception("No flash data provided!")
+
+    # Before touching the device, so a cache folder we can't write doesn't fail the upload halfway
+    os.makedirs(cachedir, exist_ok=True)
+
+    info = get_and_verify_jdec_bootloader(s_port)
+
+    start=time.time()
+
+    fingerprint = sha256()
+    walk_fx(s_port, info, lambda header, _: fingerprint.update(header) or True)
+    cachefile = fx_cache_filename(cachedir, info, fingerprint.hexdigest())
+    cached = None
+    if os.path.exists(cachefile):
+        with open(cachefile, "rb") as f:
+            cached = f.read()
+        # If anything goes wrong from here on, the cached image can't be trusted anymore
+        os.remove(cachefile)
+    else:
+        logging.info(f"No cached image for cart {info.id.hex()}, writing whole image")
+
+    flashdata, pagenumber = prepare_fx_blocks(flashdata, 0, s_port, info)
+
+    blocks = None
+    if cached is not None:
+        blocks = []
+        stale = 0
+        for b in range(len(flashdata) // FX_BLOCKSIZE):
+            blockdata = flashdata[b * FX_BLOCKSIZE:(b + 1) * FX_BLOCKSIZE]
+            if blockdata != cached[b * FX_BLOCKSIZE:(b + 1) * FX_BLOCKSIZE]:
+                blocks.append(b)
+            elif check_unchanged and read_fx(s_port, b * FX_PAGES_PER_BLOCK, FX_BLOCKSIZE) != blockdata:
+                blocks.append(b)
+                stale += 1
+        logging.info(f"Cached image found for cart {info.id.hex()}, {len(blocks)} of {len(flashdata) // FX_BLOCKSIZE} blocks changed ({stale} not in the cache)")
+
+    write_fx_blocks(flashdata, pagenumber, s_port, verify, report_progress, blocks)
+
+    newcachefile = fx_cache_filename(cachedir, info, arduboy.fxcart.fingerprint(flashdata))
+    with open(newcachefile + ".tmp", "wb") as f:
+        f.write(flashdata)
+    os.replace(newcachefile + ".tmp", newcachefile)
+
+    logging.info("Differential FX write done in {} seconds".format(round(time.time() - start,2)))
+
+
+# Write a compiled cart (starting at page 0), but only the blocks holding slots which aren't already on the device.
+# The device's slot headers (and title images, which the header hash doesn't cover) are scanned and compared with
+# the local cart's at the same offsets. A header holds the hash of the program and data along with the slot's 
+# position and size, so a slot with the same header is the same game in the same place. Unlike flash_fx_diff, no
+# image of what was written before is needed, but changes which don't touch the hash (like patching a program 
+# after compiling) can't be detected, and neither can a slot whose header is intact but whose body isn't (say, 
+# after an interrupted flash); the bodies of skipped slots are never read. Use flash_fx to rewrite everything when
+# in doubt. Saves on the device are kept for games which didn't change, even when a neighbouring game's change 
+# means their block is rewritten. Returns the number of blocks written.
+def sync_fx(local_cart: bytearray, s_port, verify = True, report_progress = None):
+
+    if not len(local_cart):
+        raise Exception("No flash data provided!")
+
+    info = get_and_verify_jdec_bootloader(s_port)
+
+    start=time.time()
+
+    preamble = arduboy.fxcart.HEADER_LENGTH + arduboy.fxcart.TITLE_IMAGE_LENGTH
+    device_slots = {}
+    def read_preamble(header, header_addr):
+        device_slots[header_addr] = bytes(header) + read_fx(s_port, header_addr // FX_PAGESIZE + 1, arduboy.fxcart.TITLE_IMAGE_LENGTH)
+        return True
+    device_end, _ = walk_fx(s_port, info, read_preamble)
+
+    table = arduboy.fxcart.FxHeaderTable.from_data(local_cart)
+    cart_end = table.total_size_bytes()
+    flashdata, pagenumber = prepare_fx_blocks(local_cart, 0, s_port, info)
+
+    def blockrange(start, end):
+        return range(start // FX_BLOCKSIZE, (end - 1) // FX_BLOCKSIZE + 1)
+
+    blocks = set()
+    unchanged = []
+    for i in range(len(table)):
+        offset = table.offsets[i]
+        if device_slots.get(offset) == bytes(local_cart[offset:offset + preamble]):
+            unchanged.append(i)
+        else:
+            blocks.update(blockrange(offset, offset + table.slot_size_bytes(i)))
+    # Whatever comes after the cart (the terminating page) is only already there if the device's cart ends in the same place
+    tail = local_cart[cart_end:]
+    if len(tail) and (device_end != cart_end or tail.count(0xFF) != len(tail)):
+        blocks.update(blockrange(cart_end, len(local_cart)))
+
+    # Keep the device's saves for unchanged games in blocks being rewritten anyway
+    for i in unchanged:
+        if table.save_page[i] != 0xFFFF:
+            save_start = table.save_page[i] * FX_PAGESIZE
+            save_end = table.offsets[i] + table.slot_size_bytes(i)
+            for b in blockrange(save_start, save_end):
+                if b in blocks:
+                    start_addr = max(save_start, b * FX_BLOCKSIZE)
+                    end_addr = min(save_end, (b + 1) * FX_BLOCKSIZE)
+                    flashdata[start_addr:end_addr] = read_fx(s_port, start_addr // FX_PAGESIZE, end_addr - start_addr)
+
+    logging.info(f"Syncing cart: {len(unchanged)} of {len(table)} slots already on device, {len(blocks)} of {len(flashdata) // FX_BLOCKSIZE} blocks to write")
+    write_fx_blocks(flashdata, pagenumber, s_port, verify, report_progress, sorted(blocks))
+
+    logging.info("FX sync done in {} seconds".format(round(time.time() - start,2)))
+
+    return len(blocks)
+
+
+# Replace one game on the device's cart with the given slot (say, a new version of it), without touching the
+# rest of the cart. The slot to replace is found by title (the given slot's title if none is given) with a header
+# scan, and the new slot is compiled for the same place, keeping the old slot's size and category so the slot 
+# chain stays intact; it must fit in the old slot's pages. Only the blocks the slot is in are written, with the 
+# data around it in those blocks preserved. The player's save on the device is kept (like sync_fx does) unless
+# the new slot's save is a different size, or keep_save is cleared. Returns the page the slot was written to.
+def update_fx_slot(slot: arduboy.fxcart.FxParsedSlot, s_port, title = None, verify = True, report_progress = None, keep_save = True):
+
+    if title is None:
+        title = slot.meta.title
+
+    info = get_and_verify_jdec_bootloader(s_port)
+
+    start=time.time()
+
+    found = None
+    def find_slot(header, header_addr):
+        nonlocal found
+        if arduboy.fxcart.get_meta_parsed(header, 0).title == title and slot.is_category() == (header[arduboy.fxcart.PROGRAM_SIZE_HEADER_INDEX] == 0):
+            found = (bytes(header), header_addr)
+            return False
+        return True
+    walk_fx(s_port, info, find_slot)
+
+    if not found:
+        raise Exception(f"Couldn't find '{title}' on the device's cart!")
+    header, header_addr = found
+    currentpage = header_addr // FX_PAGESIZE
+    slotpages = arduboy.fxcart.get_slot_size_bytes(header, 0) // FX_PAGESIZE
+    previouspage = arduboy.fxcart.get_2byte_value(header, arduboy.fxcart.PREVIOUS_PAGE_HEADER_INDEX)
+    slot = dataclasses.replace(slot, category = arduboy.fxcart.get_category(header, 0))
+    slotbin = arduboy.fxcart.compile_single(slot, currentpage, previouspage, slotpages)
+
+    # The save is at the end of the slot in both, so the same size means the same place
+    savesize = arduboy.fxcart.layout_single(slot, currentpage, previouspage, slotpages).savesize
+    save_page = arduboy.fxcart.get_save_page(header, 0)
+    device_savesize = header_addr + slotpages * FX_PAGESIZE - save_page * FX_PAGESIZE if save_page != 0xFFFF else 0
+    if keep_save and savesize and savesize == device_savesize:
+        logging.info(f"Keeping the {savesize} byte save of '{title}' from the device")
+        slotbin[-savesize:] = read_fx_blocks(s_port, save_page, savesize)
+    elif device_savesize:
+        logging.warning(f"Replacing the save of '{title}' on the device ({device_savesize} bytes, new save is {savesize} bytes)")
+
+    logging.info(f"Updating '{title}' in place at page {currentpage} ({slotpages} pages)")
+    flashdata, pagenumber = prepare_fx_blocks(slotbin, currentpage, s_port, info)
+    write_fx_blocks(flashdata, pagenumber, s_port, verify, report_progress)
+
+    logging.info("Updated slot in {} seconds".format(round(time.time() - start,2)))
+
+    return currentpage
+
+
+def _walk_fx_saves(s_port, jedec_info: JedecInfo):
+    """Every game with a save on the device's cart, as (id, title, save address, save length), from a header scan"""
+    result = []
+    def find_save(header, header_addr):
+        save_page = arduboy.fxcart.get_save_page(header, 0)
+        if header[arduboy.fxcart.PROGRAM_SIZE_HEADER_INDEX] and save_page != 0xFFFF:
+            save_addr = save_page * FX_PAGESIZE
+            save_length = header_addr + arduboy.fxcart.get_slot_size_bytes(header, 0) - save_addr
+            if save_length > 0:
+                result.append((bytes(header[25:57]), arduboy.fxcart.get_meta_parsed(header, 0).title, save_addr, save_length))
+        return True
+    walk_fx(s_port, jedec_info, find_save)
+    return result
+
+# Read the save of every game on the device's cart, found with a header scan; only the saves themselves are read,
+# not the rest of the cart. Write them to a file with arduboy.fxcart.write_saves and restore them with restore_fx_saves.
+def harvest_fx_saves(s_port, report_progress = None) -> List[arduboy.fxcart.FxSave]:
+
+    jedec_info = get_and_verify_jdec_bootloader(s_port)
+
+    start=time.time()
+
+    found = _walk_fx_saves(s_port, jedec_info)
+    result = []
+    for i, (id, title, save_addr, save_length) in enumerate(found):
+        data = read_fx_blocks(s_port, save_addr // FX_PAGESIZE, save_length)
+        result.append(arduboy.fxcart.FxSave(id, title, bytes(data)))
+        if report_progress:
+            report_progress(i + 1, len(found))
+
+    logging.info("Harvested {} saves ({} bytes) in {} seconds".format(len(result), sum(len(x.data) for x in result), round(time.time() - start,2)))
+
+    return result
+
+# Write the given saves back to the games they belong to on the device's cart, matched by id (preferring the same
+# title if a game is on the cart more than once). Saves are 4KiB aligned, but the bootloader erases whole 64KiB
+# blocks, so each block holding a save is read, the saves spliced in, and written back; blocks where every save 
+# is already the same are left alone. Returns the saves which couldn't be restored (no such game, or the save 
+# size changed).
+def restore_fx_saves(saves: List[arduboy.fxcart.FxSave], s_port, verify = True, report_progress = None) -> List[arduboy.fxcart.FxSave]:
+
+    jedec_info = get_and_verify_jdec_bootloader(s_port)
+
+    start=time.time()
+
+    available = {}
+    for id, title, save_addr, save_length in _walk_fx_saves(s_port, jedec_info):
+        available.setdefault(id, []).append((title, save_addr, save_length))
+
+    missing = []
+    writes = []     # (save address, save data)
+    for save in saves:
+        candidates = available.get(save.id, [])
+        match = next((c for c in candidates if c[0] == save.title), candidates[0] if candidates else None)
+        if not match or match[2] != len(save.data):
+            logging.warning(f"No place to restore save for '{save.title}' ({save.id.hex()}) on this cart")
+            missing.append(save)
+            continue
+        candidates.remove(match)
+        writes.append((match[1], save.data))
+
+    blocks = sorted(set(b for save_addr, data in writes for b in range(save_addr // FX_BLOCKSIZE, (save_addr + len(data) - 1) // FX_BLOCKSIZE + 1)))
+    written = 0
+    for i, block in enumerate(blocks):
+        blockstart = block * FX_BLOCKSIZE
+        current = read_fx(s_port, block * FX_PAGES_PER_BLOCK, FX_BLOCKSIZE)
+        blockdata = bytearray(current)
+        for save_addr, data in writes:
+            start_addr = max(save_addr, blockstart)
+            end_addr = min(save_addr + len(data), blockstart + FX_BLOCKSIZE)
+            if start_addr < end_addr:
+                blockdata[start_addr - blockstart:end_addr - blockstart] = data[start_addr - save_addr:end_addr - save_addr]
+        if blockdata != current:
+            write_fx_blocks(blockdata, block * FX_PAGES_PER_BLOCK, s_port, verify)
+            written += 1
+        if report_progress:
+            report_progress(i + 1, len(blocks))
+
+    logging.info("Restored {} saves ({} blocks written) in {} seconds".format(len(writes), written, round(time.time() - start,2)))
+
+    return missing
+
+
+def read_fx_blocks(s_port, pagenumber, length, report_progress = None):
+    """Read the given amount of bytes from the FX flash starting at the given page, a block at a time"""
+    result = bytearray(length)
+    blocks = (length + FX_BLOCKSIZE - 1) // FX_BLOCKSIZE
+
+    for block in range (0, blocks):
+        if block & 1:
+            s_port.write(b"x\xC0") #RGB BLUE OFF, buttons disabled
+        else:  
             s_port.write(b"x\xC1") #RGB BLUE RED, buttons disabled
-            s_port.read(1)
-            s_port.write(bytearray([ord("A"), blockaddr >> 8, blockaddr & 0xFF]))
-            s_port.read(1)
-            s_port.write(bytearray([ord("g"), (blocklen >> 8) & 0xFF, blocklen & 0xFF,ord("C")]))
-            if s_port.read(blocklen) != flashdata[block * FX_BLOCKSIZE : block * FX_BLOCKSIZE + blocklen]:
-                raise Exception("FX verify failed at address {:04X}. Upload unsuccessful.".format(blockaddr))
+        s_port.read(1)      
+
+        blockstart = block * FX_BLOCKSIZE
+        blocklen = min(FX_BLOCKSIZE, length - blockstart)
+        result[blockstart:blockstart + blocklen] = read_fx(s_port, pagenumber + block * FX_PAGES_PER_BLOCK, blocklen)
+
         if report_progress:
             report_progress(block + 1, blocks)
-    
+
     s_port.write(b"x\x40")#RGB LED off, buttons enabled
     s_port.read(1)
-    logging.info("Wrote {} blocks in {} seconds".format(blocks, round(time.time() - start,2)))
 
+    return result
 
 # Read FX data and return the binary dump. Can report progress same as arduhex functions. 
-# def backup_fx(s_port, filename, report_progress = None):
 def backup_fx(s_port, report_progress = None):
 
     ## detect flash cart ## 
@@ -265,45 +794,233 @@ def backup_fx(s_port, report_progress = None):
 
     start=time.time()
     
-    blocks = jedec_info.capacity // FX_BLOCKSIZE
-    logging.info(f"Reading entire FX in port {s_port.port}") # into file {filename}")
+    logging.info(f"Reading entire FX in port {s_port.port}")
+    result = read_fx_blocks(s_port, 0, jedec_info.capacity, report_progress)
+    logging.info("Read {} blocks in {} seconds".format(len(result) // FX_BLOCKSIZE, round(time.time() - start,2)))
 
-    with io.BytesIO() as binfile: # open(filename,"wb") as binfile:
-        for block in range (0, blocks):
-            if block & 1:
-                s_port.write(b"x\xC0") #RGB BLUE OFF, buttons disabled
-            else:  
-                s_port.write(b"x\xC1") #RGB BLUE RED, buttons disabled
-            s_port.read(1)      
+    return result
 
-            # block * FX_BLOCKSIZE = REAL ADDRESS, dividing by pagesize give PAGE ADDRESS
-            blockaddr = block * FX_BLOCKSIZE // FX_PAGESIZE
+# Read only the part of the FX flash the cart uses, found by walking the slot headers. The result is the
+# same as a full backup passed through arduboy.fxcart.trim. If include_devdata is set, the development data
+# at the end of the flash is read as well, and the result is the size of the whole flash, with the unread
+# gap between the cart and the dev data filled as erased (0xFF). Nothing on the flash says how big the dev data
+# is, so unless devdata_length is given, it's found by reading backwards from the end of the flash a block at a 
+# time until an erased block is found. Dev data with a whole erased block in it is cut short there; the block
+# before is checked too, and a warning logged if it isn't erased, but pass devdata_length if you know it.
+def backup_fx_used(s_port, include_devdata = False, report_progress = None, devdata_length = None):
+
+    jedec_info = get_and_verify_jdec_bootloader(s_port)
+
+    start=time.time()
+
+    cartsize, slots = walk_fx(s_port, jedec_info)
+    logging.info(f"Reading {cartsize} bytes ({slots} slots) of FX in port {s_port.port}")
+    result = read_fx_blocks(s_port, 0, cartsize, report_progress)
+
+    if include_devdata:
+        devblocks = []
+        devstart = jedec_info.capacity
+        cartend = (cartsize + FX_BLOCKSIZE - 1) // FX_BLOCKSIZE * FX_BLOCKSIZE
+        devend = cartend
+        if devdata_length is not None:
+            devend = max(cartend, jedec_info.capacity - (devdata_length + FX_BLOCKSIZE - 1) // FX_BLOCKSIZE * FX_BLOCKSIZE)
+        while devstart - FX_BLOCKSIZE >= devend:
+            block = read_fx(s_port, (devstart - FX_BLOCKSIZE) // FX_PAGESIZE, FX_BLOCKSIZE)
+            if devdata_length is None and block.count(0xFF) == len(block):
+                if devstart - 2 * FX_BLOCKSIZE >= cartend:
+                    before = read_fx(s_port, (devstart - 2 * FX_BLOCKSIZE) // FX_PAGESIZE, FX_BLOCKSIZE)
+                    if before.count(0xFF) != len(before):
+                        logging.warning(f"Dev data scan stopped at the erased block at {devstart - FX_BLOCKSIZE:X}, but the block before it isn't erased; the dev data may be cut short")
+                break
+            devblocks.append(block)
+            devstart -= FX_BLOCKSIZE
+        logging.info(f"Read {jedec_info.capacity - devstart} bytes of dev data")
+        result += b"\xFF" * (devstart - cartsize)
+        for block in reversed(devblocks):
+            result += block
 
-            s_port.write("A".encode())
-            s_port.write(bytearray([blockaddr >> 8, blockaddr & 0xFF]))
-            s_port.read(1)
+    logging.info("Read {} bytes in {} seconds".format(len(result), round(time.time() - start,2)))
 
-            blocklen = FX_BLOCKSIZE
+    return result
 
-            s_port.write("g".encode())
-            s_port.write(bytearray([(blocklen >> 8) & 0xFF, blocklen & 0xFF]))
 
-            s_port.write("C".encode())
-            contents=s_port.read(blocklen)
-            binfile.write(contents)
+FX_JOURNAL_EXTENSION = ".journal"
 
+def _fx_fingerprint(s_port, jedec_info: JedecInfo):
+    """
+    The length of the cart and a hash of the first page of the FX flash plus every cart header, so a journal 
+    isn't resumed against a different device or a reflashed cart. Saves (and dev data) aren't covered.
+    """
+    fingerprint = sha256(read_fx(s_port, 0, FX_PAGESIZE))
+    def header_work(header, header_addr):
+        fingerprint.update(header)
+        return True
+    length = walk_fx(s_port, jedec_info, header_work)[0]
+    return length, fingerprint.hexdigest()
+
+def _read_fx_journal(journalfile, header):
+    """The blocks (and their hashes) already backed up according to the given journal, if it's for the same backup"""
+    done = {}
+    if os.path.exists(journalfile):
+        with open(journalfile, "r") as f:
+            lines = f.read().splitlines()
+        if lines and lines[0] == header:
+            for line in lines[1:]:
+                parts = line.split()
+                # A partially written last line is just ignored, that block is read again
+                if len(parts) == 2 and len(parts[1]) == sha256().digest_size * 2:
+                    done[int(parts[0])] = parts[1]
+    return done
+
+# Stream an FX backup straight into the given file, one block at a time, instead of building it in memory. 
+# The blocks written so far are recorded in a journal next to the file (filename + FX_JOURNAL_EXTENSION), 
+# so if the backup is interrupted, calling this again with the same file resumes from the last good block.
+# The journal records the device and a fingerprint of its contents (the first page and the cart headers), and
+# the backup starts over if either is different. Once all blocks are read, the file is checked against the block hashes in the journal and the journal
+# is removed. If used_only is set, only the part of the flash the cart uses is read (see backup_fx_used).
+# Returns the sha256 hex digest of the whole backup.
+def backup_fx_to_file(s_port, filename, used_only = False, report_progress = None):
+
+    jedec_info = get_and_verify_jdec_bootloader(s_port)
+
+    start=time.time()
+
+    cartlength, fingerprint = _fx_fingerprint(s_port, jedec_info)
+    length = cartlength if used_only else jedec_info.capacity
+    blocks = (length + FX_BLOCKSIZE - 1) // FX_BLOCKSIZE
+    journalfile = filename + FX_JOURNAL_EXTENSION
+    header = f"fxbackup {jedec_info.id.hex()} {length} {fingerprint}"
+    done = _read_fx_journal(journalfile, header) if os.path.exists(filename) else {}
+
+    if done:
+        logging.info(f"Resuming FX backup to {filename}, {len(done)} of {blocks} blocks already done")
+    else:
+        logging.info(f"Backing up {length} bytes of FX in port {s_port.port} to {filename}")
+        with open(journalfile, "w") as f:
+            f.write(header + "\n")
+
+    with open(filename, "r+b" if done else "wb") as binfile, open(journalfile, "a") as journal:
+        binfile.truncate(length)
+        for block in range(blocks):
+            if block not in done:
+                if block & 1:
+                    s_port.write(b"x\xC0") #RGB BLUE OFF, buttons disabled
+                else:  
+                    s_port.write(b"x\xC1") #RGB BLUE RED, buttons disabled
+                s_port.read(1)
+                blocklen = min(FX_BLOCKSIZE, length - block * FX_BLOCKSIZE)
+                contents = read_fx(s_port, block * FX_PAGES_PER_BLOCK, blocklen)
+                if len(contents) != blocklen:
+                    raise Exception(f"FX backup read only {len(contents)} of {blocklen} bytes at block {block}")
+                binfile.seek(block * FX_BLOCKSIZE)
+                binfile.write(contents)
+                # The block must be on disk before the journal says it's done
+                binfile.flush()
+                os.fsync(binfile.fileno())
+                done[block] = sha256(contents).hexdigest()
+                journal.write(f"{block} {done[block]}\n")
+                journal.flush()
             if report_progress:
                 report_progress(block + 1, blocks)
 
-        binfile.seek(0)
-        result = binfile.read()
-
     s_port.write(b"x\x40")#RGB LED off, buttons enabled
     s_port.read(1)
-    logging.info("Read {} blocks in {} seconds".format(blocks, round(time.time() - start,2)))
 
-    return bytearray(result)
+    # Check what actually ended up in the file, hashing the whole thing as we go
+    total = sha256()
+    with open(filename, "rb") as binfile:
+        for block in range(blocks):
+            contents = binfile.read(FX_BLOCKSIZE)
+            if sha256(contents).hexdigest() != done[block]:
+                os.remove(journalfile)
+                raise Exception(f"FX backup file {filename} is corrupt at block {block}, backup must be restarted")
+            total.update(contents)
 
+    os.remove(journalfile)
+    logging.info("Backed up {} blocks in {} seconds".format(blocks, round(time.time() - start,2)))
+
+    return total.hexdigest()
+
+
+# Back up the FX flash to a sparse backup (see arduboy.fxsparse), streamed a block at a time: erased pages are stored
+# as extents and the rest compressed, which is much smaller for the usual mostly empty flash. The file is written 
+# under a temporary name and only renamed to filename once it's complete; if the backup fails, the temporary file
+# is removed and filename is left as it was. If used_only is set, only the part of
+# the flash the cart uses is read (see backup_fx_used). Returns the sha256 hex digest of the whole backup.
+def backup_fx_sparse(s_port, filename, used_only = False, report_progress = None):
+
+    jedec_info = get_and_verify_jdec_bootloader(s_port)
+
+    start=time.time()
+
+    length = walk_fx(s_port, jedec_info)[0] if used_only else jedec_info.capacity
+    blocks = (length + FX_BLOCKSIZE - 1) // FX_BLOCKSIZE
+    logging.info(f"Backing up {length} bytes of FX in port {s_port.port} to sparse backup {filename}")
+
+    tempfile = filename + ".tmp"
+    try:
+        # The writer removes the temporary file itself if anything goes wrong while it's open
+        with arduboy.fxsparse.SparseFxWriter(tempfile, jedec_info.id, jedec_info.capacity, length) as writer:
+            for block in range(blocks):
+                if block & 1:
+                    s_port.write(b"x\xC0") #RGB BLUE OFF, buttons disabled
+                else:  
+                    s_port.write(b"x\xC1") #RGB BLUE RED, buttons disabled
+                s_port.read(1)
+                blocklen = min(FX_BLOCKSIZE, length - block * FX_BLOCKSIZE)
+                contents = read_fx(s_port, block * FX_PAGES_PER_BLOCK, blocklen)
+                if len(contents) != blocklen:
+                    raise Exception(f"FX backup read only {len(contents)} of {blocklen} bytes at block {block}")
+                writer.add_block(contents)
+                if report_progress:
+                    report_progress(block + 1, blocks)
+
+        s_port.write(b"x\x40")#RGB LED off, buttons enabled
+        s_port.read(1)
+
+        os.replace(tempfile, filename)
+    except:
+        if os.path.exists(tempfile):
+            os.remove(tempfile)
+        raise
+    logging.info("Backed up {} blocks in {} seconds".format(blocks, round(time.time() - start,2)))
+
+    return writer.close()
+
+# Write a sparse backup (see arduboy.fxsparse) back to the FX flash a block at a time, never holding more than
+# one block of it in memory. Blocks with data are written with the same block writer as flash_fx. Entirely 
+# erased blocks only need writing if the device has something there; with erase_empty (the default) they're read 
+# and erased if they aren't already, otherwise they're left alone (faster, but whatever was there stays). Nothing
+# says what's on the device without reading it, so erase_empty costs a read of every erased block in the backup:
+# for the usual mostly empty backup, that's close to reading the whole flash. Pass erase_empty = False if the 
+# flash is known to be erased already (or what's left there doesn't matter).
+def restore_fx_sparse(filename, s_port, verify = True, report_progress = None, erase_empty = True):
+
+    jedec_info = get_and_verify_jdec_bootloader(s_port)
+
+    start=time.time()
+
+    with arduboy.fxsparse.SparseFxFile(filename) as backup:
+        if backup.length > jedec_info.capacity:
+            raise Exception(f"Backup is {backup.length} bytes, too big for this flash chip ({jedec_info.capacity} bytes)")
+        if backup.jedec_id != bytes(jedec_info.id):
+            logging.warning(f"Restoring backup of flash chip {backup.jedec_id.hex()} to {jedec_info.id.hex()}")
+        written = 0
+        for block in range(len(backup)):
+            pagenumber = block * FX_PAGES_PER_BLOCK
+            if backup.is_erased(block):
+                if erase_empty and read_fx(s_port, pagenumber, backup.block_length(block)).count(0xFF) != backup.block_length(block):
+                    flashdata, pagenumber = prepare_fx_blocks(backup.read_block(block), pagenumber, s_port, jedec_info)
+                    write_fx_blocks(flashdata, pagenumber, s_port, verify)
+                    written += 1
+            else:
+                flashdata, pagenumber = prepare_fx_blocks(backup.read_block(block), pagenumber, s_port, jedec_info)
+                write_fx_blocks(flashdata, pagenumber, s_port, verify)
+                written += 1
+            if report_progress:
+                report_progress(block + 1, len(backup))
+
+    logging.info("Restored sparse backup, {} blocks written in {} seconds".format(written, round(time.time() - start,2)))
 
 
 def scan_fx(s_port, header_work = None, report_progress = None):
@@ -316,11 +1033,17 @@ def scan_fx(s_port, header_work = None, report_progress = None):
     ## detect flash cart ## 
     jedec_info = get_and_verify_jdec_bootloader(s_port)
 
+    return walk_fx(s_port, jedec_info, header_work, report_progress)
+
+
+def walk_fx(s_port, jedec_info: JedecInfo, header_work = None, report_progress = None):
+    """Same as scan_fx, but for when you already have the jedec info"""
+
     header_addr = 0     # The actual current byte address
     slots = 0           # The number of slots
 
     # We don't know when we'll reach the end of the cart, we have to parse the headers
-    while True:
+    while header_addr < jedec_info.capacity:
         if (slots // 64) & 1:
             s_port.write(b"x\xC0") #RGB BLUE OFF, buttons disabled
         else:  
@@ -328,16 +1051,11 @@ def scan_fx(s_port, header_work = None, report_progress = None):
         s_port.read(1)      
 
         # Read just the header bytes
-        blockaddr = header_addr // FX_PAGESIZE
-        readlen = arduboy.fxcart.HEADER_LENGTH
-        s_port.write(bytearray([ord("A"), blockaddr >> 8, blockaddr & 0xFF]))
-        s_port.read(1)
-        s_port.write(bytearray([ord("g"), (readlen >> 8) & 0xFF, readlen & 0xFF, ord("C")]))
-
-        header = s_port.read(readlen)
+        header = read_fx(s_port, header_addr // FX_PAGESIZE, arduboy.fxcart.HEADER_LENGTH)
 
-        # This chunk of flash indicates the end of the cart, because it was not a header!
-        if not arduboy.fxcart.is_slot(header, 0):
+        # This chunk of flash indicates the end of the cart, because it was not a header! A slot
+        # with no size is just as bad, we'd never get anywhere
+        if not arduboy.fxcart.is_slot(header, 0) or not arduboy.fxcart.get_slot_size_bytes(header, 0):
             break
 
         slots += 1
@@ -50,7 +50,7 @@ def arduboy_from_slot(slot: arduboy.fxcart.FxParsedSlot, device: str) -> arduboy
             arduboy.arduhex.ArduboyBinary(
                 bindevice,
                 "", # Just dont trust the titles. TODO: May change later
-                arduboy.common.bin_to_hex(arduboy.arduhex.analyze_sketch(slot.program_raw).trimmed_data),
+                arduboy.common.bin_to_hex(arduboy.arduhex.analyze_sketch(bytearray(slot.program_raw)).trimmed_data),
                 slot.data_raw,
                 slot.save_raw,
                 arduboy.image.bin_to_pilimage(slot.image_raw)
@@ -70,6 +70,8 @@ def detect_device_type(s_port: Serial):
     Using (perhaps faulty) logic, attempt to figure out what kind of device is connected. This function may
     take some time, as it has to read from the device. Must be in bootloader, as usual!
     """
+    if isinstance(s_port, arduboy.serial.BootloaderSession):
+        return s_port.device_type
     logging.info(f"Detecting device on: {s_port.name}")
     bootloader = arduboy.serial.read_bootloader(s_port)
     analysis = arduboy.arduhex.analyze_sketch(bootloader, bootloader=True)
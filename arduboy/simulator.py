@@ -0,0 +1,222 @@
+# A simulated arduboy bootloader, for testing and benchmarking arduboy.serial without a device.
+# It understands the same subset of the bootloader protocol that the toolset uses, and can either
+# stand in for a pyserial Serial object directly or be served over a pty (linux only).
+import logging
+import os
+import threading
+import time
+
+from arduboy.constants import *
+from collections import deque
+
+SIM_DEFAULT_JEDEC = bytes([0xEF, 0x40, 0x18])   # Winbond, 16MiB
+SIM_DEFAULT_VERSION = 13                        # Cathy3k, has flashcart support
+SIM_EEPROM_SIZE = 1024
+SIM_ACK = b"\r"
+
+class SimulatedBootloader:
+    """
+    Simulates an arduboy sitting in its bootloader. Supports the A, B, g, V, j, r, x and E commands against
+    32KiB of program flash, a 1KiB EEPROM and a flash chip of whatever size the JEDEC id says.
+
+    Timing is modeled with a latency (seconds, the round trip to the device for each response) and a bandwidth
+    (bytes per second, None for unlimited); reads wait until the simulated device would have sent the data.
+    Commands sent without waiting on the previous response don't pay the latency again. EEPROM writes can
+    also be given a time per byte, and program flash writes a time per page.
+    Like pyserial, a read returns early (with fewer bytes) if nothing more is coming.
+    """
+
+    def __init__(self, jedec_id = SIM_DEFAULT_JEDEC, version = SIM_DEFAULT_VERSION, lockbits = 0xEF, latency = 0, bandwidth = None,
+                 eeprom_byte_time = 0, flash_page_time = 0):
+        self.jedec_id = bytes(jedec_id)
+        self.version = version
+        self.lockbits = lockbits
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.eeprom_byte_time = eeprom_byte_time   # Real EEPROM takes about 3.3ms to write each byte
+        self.flash_page_time = flash_page_time     # And about 4ms to erase and write each program flash page
+        self.fx = bytearray(b"\xFF" * (1 << self.jedec_id[2]))
+        self.program = bytearray(b"\xFF" * FLASH_SIZE)
+        self.eeprom = bytearray(b"\xFF" * SIM_EEPROM_SIZE)
+        self.port = "simulated"
+        self.timeout = None
+        self.is_open = True
+        self.exited = False
+        self.led = 0
+        self.address = 0
+        self.commands = {}              # Count of each command seen
+        self._pending = bytearray()     # Received but not yet handled (incomplete command)
+        self._responses = deque()       # (time available, bytes)
+        self._busy_until = 0
+
+    def _transfer_time(self, length):
+        return length / self.bandwidth if self.bandwidth else 0
+
+    def _respond(self, data):
+        # The device sends at the bandwidth, one thing at a time, but latency is paid in flight and doesn't add up
+        self._busy_until = max(time.perf_counter(), self._busy_until) + self._transfer_time(len(data))
+        self._responses.append((self._busy_until + self.latency, bytes(data)))
+
+    def _memory(self, memtype):
+        """The buffer and the byte address multiplier for the given bootloader memory type"""
+        if memtype == ord("C"):
+            return self.fx, FX_PAGESIZE
+        elif memtype == ord("F"):
+            return self.program, 2   # Flash addresses are in words
+        elif memtype == ord("E"):
+            return self.eeprom, 1
+        raise Exception(f"Simulated bootloader: unknown memory type {memtype}")
+
+    def _step(self):
+        """Handle the next complete command in the pending buffer, returning False if there isn't one"""
+        b = self._pending
+        if not b:
+            return False
+        command = chr(b[0])
+        if command == "A":
+            if len(b) < 3:
+                return False
+            self.address = (b[1] << 8) | b[2]
+            length = 3
+            self._respond(SIM_ACK)
+        elif command in "gB":
+            if len(b) < 4:
+                return False
+            datalength = ((b[1] << 8) | b[2]) or 0x10000
+            memory, multiplier = self._memory(b[3])
+            start = self.address * multiplier
+            if command == "g":
+                length = 4
+                self._respond(memory[start:start + datalength])
+            else:
+                if len(b) < 4 + datalength:
+                    return False
+                length = 4 + datalength
+                memory[start:start + datalength] = b[4:length]
+                if memory is self.eeprom:
+                    self._busy_until = max(time.perf_counter(), self._busy_until) + datalength * self.eeprom_byte_time
+                elif memory is self.program:
+                    self._busy_until = max(time.perf_counter(), self._busy_until) + -(-datalength // FLASH_PAGESIZE) * self.flash_page_time
+                self._respond(SIM_ACK)
+            self.address += datalength // multiplier
+        elif command == "V":
+            length = 1
+            self._respond(f"{self.version:02d}".encode())
+        elif command == "j":
+            length = 1
+            self._respond(self.jedec_id)
+        elif command == "r":
+            length = 1
+            self._respond(bytes([self.lockbits]))
+        elif command == "x":
+            if len(b) < 2:
+                return False
+            self.led = b[1]
+            length = 2
+            self._respond(SIM_ACK)
+        elif command == "E":
+            length = 1
+            self.exited = True
+            self._respond(SIM_ACK)
+        else:
+            raise Exception(f"Simulated bootloader: unknown command {b[0]:02X}")
+        self.commands[command] = self.commands.get(command, 0) + 1
+        del b[:length]
+        return True
+
+    def write(self, data):
+        if self.exited:
+            raise Exception("Simulated bootloader has exited")
+        # The data has to get to the device before it can respond
+        self._busy_until = max(time.perf_counter(), self._busy_until) + self._transfer_time(len(data))
+        self._pending += data
+        while self._step():
+            pass
+        return len(data)
+
+    def read(self, size = 1):
+        result = bytearray()
+        while len(result) < size and self._responses:
+            ready, data = self._responses[0]
+            wait = ready - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            taken = data[:size - len(result)]
+            result += taken
+            if len(taken) == len(data):
+                self._responses.popleft()
+            else:
+                self._responses[0] = (ready, data[len(taken):])
+        return bytes(result)
+
+    @property
+    def in_waiting(self):
+        now = time.perf_counter()
+        return sum(len(data) for ready, data in self._responses if ready <= now)
+
+    def reset_input_buffer(self):
+        self._responses.clear()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+class PtyBootloader:
+    """
+    Serve a SimulatedBootloader over a pty, so it can be opened like a real port (pyserial Serial(bootloader.port)).
+    Use as a context manager, or call start/stop. Linux (and probably other unix) only.
+    """
+
+    def __init__(self, simulated: SimulatedBootloader = None):
+        self.simulated = simulated or SimulatedBootloader()
+        self.port = None
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        import pty
+        import tty
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        logging.debug(f"Serving simulated bootloader on {self.port}")
+        return self
+
+    def _serve(self):
+        import select
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._master], [], [], 0.05)
+            if not readable:
+                continue
+            try:
+                data = os.read(self._master, 0x10000)
+            except OSError:
+                break
+            self.simulated.write(data)
+            while self.simulated._responses:
+                response = self.simulated.read(len(self.simulated._responses[0][1]))
+                view = memoryview(response)
+                while view:
+                    view = view[os.write(self._master, view):]
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        for fd in [self._master, self._slave]:
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
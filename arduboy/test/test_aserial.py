@@ -0,0 +1,128 @@
+
+import unittest
+import asyncio
+import sys
+import arduboy.aserial
+import arduboy.fxcart
+import arduboy.serial
+import arduboy.simulator
+
+from arduboy.constants import *
+from unittest import mock
+from .common import *
+from .test_fxcart import makecart
+from .test_serial import TEST_JEDEC
+
+class CancellingPort(arduboy.aserial.AsyncPortAdapter):
+    """Cancels task once the given command is sent. Like AsyncSerial, nothing is read once cancelled"""
+
+    def __init__(self, s_port, command):
+        super().__init__(s_port)
+        self.command = bytes(command)
+        self.task = None
+
+    async def read(self, size = 1):
+        await asyncio.sleep(0)
+        return self.s_port.read(size)
+
+    async def write(self, data):
+        if bytes(data) == self.command:
+            self.command = None
+            self.task.cancel()
+        return self.s_port.write(data)
+
+
+class TestAserial(unittest.TestCase):
+
+    def setUp(self):
+        self.jedec_wait = arduboy.serial.JEDEC_RETRY_WAIT
+        arduboy.serial.JEDEC_RETRY_WAIT = 0
+        self.device = arduboy.simulator.SimulatedBootloader(TEST_JEDEC)
+        self.port = arduboy.aserial.AsyncPortAdapter(self.device)
+
+    def tearDown(self):
+        arduboy.serial.JEDEC_RETRY_WAIT = self.jedec_wait
+
+    def test_sketch(self):
+        sketch = arduboy.common.pad_data(makebytearray(10000), FLASH_PAGESIZE)
+        async def work():
+            progress = [ p async for p in arduboy.aserial.flash_arduhex(sketch, self.port) ]
+            self.assertEqual(progress[-1], (len(sketch) // FLASH_PAGESIZE, len(sketch) // FLASH_PAGESIZE))
+            await arduboy.aserial.verify_arduhex(sketch, self.port)
+            return await arduboy.aserial.backup_sketch(self.port)
+        backup = asyncio.run(work())
+        self.assertEqual(backup[:len(sketch)], sketch)
+        self.assertEqual(len(backup), FLASH_SIZE - BOOTLOADER_CATHY_SIZE)
+
+    def test_verify_empty(self):
+        # Nothing to verify must not send a zero length read (which is 64K to the bootloader)
+        async def work():
+            with mock.patch("arduboy.arduhex.analyze_sketch", return_value = arduboy.arduhex.SketchAnalysis()):
+                await arduboy.aserial.verify_arduhex(bytearray(), self.port)
+            return await arduboy.aserial.get_version(self.port)
+        self.assertEqual(asyncio.run(work()), arduboy.simulator.SIM_DEFAULT_VERSION)
+
+    def test_eeprom(self):
+        eeprom = makebytearray(1024)
+        async def work():
+            await arduboy.aserial.write_eeprom(eeprom, self.port)
+            return await arduboy.aserial.read_eeprom(self.port)
+        self.assertEqual(asyncio.run(work()), eeprom)
+
+    def test_fx(self):
+        cart = arduboy.fxcart.trim(arduboy.fxcart.compile(makecart()))
+        async def work():
+            await arduboy.aserial.flash_fx(cart, 0, self.port)
+            scan = arduboy.aserial.scan_fx(self.port)
+            async for _ in scan:
+                pass
+            return scan.result, await arduboy.aserial.backup_fx(self.port)
+        scan, backup = asyncio.run(work())
+        self.assertEqual(scan, (len(cart), len(makecart())))
+        self.assertEqual(backup, self.device.fx)
+        self.assertEqual(backup[:len(cart)], cart)
+
+    def test_cancel(self):
+        async def work():
+            operation = arduboy.aserial.backup_fx(self.port)
+            async def consume():
+                async for current, _ in operation:
+                    if current == 3:
+                        task.cancel()
+            task = asyncio.ensure_future(consume())
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            # Cancelled between blocks, so the bootloader is still in a usable state
+            return await arduboy.aserial.get_version(self.port)
+        self.assertEqual(asyncio.run(work()), arduboy.simulator.SIM_DEFAULT_VERSION)
+        self.assertLess(self.device.commands["g"], len(self.device.fx) // FX_BLOCKSIZE)
+        self.assertEqual(self.device.led, 0x40)
+
+    def test_cancel_command(self):
+        # Cancelled right after a command is sent (the jedec query, then a partial block read): the response 
+        # must still be read, or the next command gets it instead of its own
+        for command in (b"j", arduboy.serial.fx_read_command(FX_PAGESIZE)):
+            with self.subTest(command = command):
+                port = CancellingPort(self.device, command)
+                async def work():
+                    port.task = asyncio.ensure_future(arduboy.aserial.flash_fx(makebytearray(FX_PAGESIZE), 1, port))
+                    with self.assertRaises(asyncio.CancelledError):
+                        await port.task
+                    return await arduboy.aserial.get_version(port)
+                self.assertEqual(asyncio.run(work()), arduboy.simulator.SIM_DEFAULT_VERSION)
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "pty only on linux")
+    def test_pty(self):
+        eeprom = makebytearray(1024)
+        async def work(port):
+            await arduboy.aserial.write_eeprom(eeprom, port)
+            return await arduboy.aserial.read_eeprom(port)
+        with arduboy.simulator.PtyBootloader(self.device) as bootloader:
+            port = arduboy.aserial.open_serial(bootloader.port, timeout = 5)
+            self.assertIsInstance(port, arduboy.aserial.AsyncSerial)
+            self.assertEqual(asyncio.run(work(port)), eeprom)
+            port.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
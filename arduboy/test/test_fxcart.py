@@ -1,11 +1,30 @@
+import copy
+import sys
 import unittest
 import arduboy.fxcart
 
 from arduboy.constants import *
 from .common import *
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from pathlib import Path
 
 
+def makecart():
+    """A small but valid cart: two categories and two games"""
+    def game(title, datalen, savelen):
+        return arduboy.fxcart.FxParsedSlot(
+            0, makebytearray(SCREEN_BYTES), makebytearray(9999), makebytearray(datalen), makebytearray(savelen),
+            arduboy.fxcart.FxSlotMeta(title, "1.0", "haloopdy", f"Info for {title}")
+        )
+    def category(title):
+        return arduboy.fxcart.FxParsedSlot(
+            0, makebytearray(SCREEN_BYTES), bytearray(), bytearray(), bytearray(),
+            arduboy.fxcart.FxSlotMeta(title, "", "", "")
+        )
+    return [ category("Bootloader"), category("Games"), game("First", 20000, 4096), game("Second", 0, 0) ]
+
+
 class TestFxCart(unittest.TestCase):
 
     def test_emptyslot(self):
@@ -79,6 +98,200 @@ class TestFxCart(unittest.TestCase):
         self.assertEqual(slot.save_raw, slot2.save_raw)
         self.assertEqual(slot.meta, slot2.meta)
     
+    def test_parse_zerocopy(self):
+        slot = arduboy.fxcart.FxParsedSlot(
+            5, 
+            makebytearray(arduboy.fxcart.TITLE_IMAGE_LENGTH),
+            makebytearray(9999),
+            makebytearray(20000),
+            makebytearray(arduboy.fxcart.SAVE_ALIGNMENT),
+            arduboy.fxcart.FxSlotMeta("Fun game", "1.0.1", "haloopdy", "Still not that fun")
+        )
+        slotbin = arduboy.fxcart.compile_single(slot)
+        copied = arduboy.fxcart.parse(slotbin)[0]
+        viewed = arduboy.fxcart.parse(slotbin, zerocopy=True)[0]
+        self.assertIsInstance(viewed, arduboy.fxcart.FxSlotView)
+        for field in ["image_raw", "program_raw", "data_raw", "save_raw"]:
+            with self.subTest(field = field):
+                view = getattr(viewed, field)
+                self.assertIsInstance(view, memoryview)
+                self.assertTrue(view.readonly)
+                self.assertEqual(view, getattr(copied, field))
+        self.assertEqual(viewed.category, copied.category)
+        self.assertEqual(viewed.meta, copied.meta)
+        # Views are the same slots as copies, and no bigger
+        self.assertEqual(viewed, copied)
+        self.assertEqual(arduboy.fxcart.parse(slotbin, zerocopy=True), arduboy.fxcart.parse(slotbin))
+        self.assertFalse(hasattr(viewed, "__dict__"))
+        self.assertLessEqual(sys.getsizeof(viewed), sys.getsizeof(copied))
+        # Writing means assigning a new buffer, which must leave the original cart alone
+        viewed.save_raw = bytearray(len(viewed.save_raw))
+        self.assertEqual(arduboy.fxcart.parse(slotbin)[0].save_raw, copied.save_raw)
+        # And the views must compile exactly like the copies
+        self.assertEqual(arduboy.fxcart.compile_single(copied), arduboy.fxcart.compile_single(arduboy.fxcart.parse(slotbin, zerocopy=True)[0]))
+
+    def test_parse_zerocopy_edit(self):
+        cartbin = arduboy.fxcart.compile(makecart())
+        original = bytes(cartbin)
+        viewed = arduboy.fxcart.parse(cartbin, zerocopy=True)[2]
+        # Views are read only, editing in place takes a copy first
+        with self.assertRaises(TypeError):
+            viewed.data_raw[0] ^= 0xFF
+        with self.assertRaises(TypeError):
+            viewed.save_raw += b"\xFF"
+        # Assigning a new buffer is fine, and only replaces that field
+        reassigned = arduboy.fxcart.parse(cartbin, zerocopy=True)[2]
+        reassigned.save_raw = bytearray(reassigned.save_raw) + b"\xFF"
+        self.assertIsInstance(reassigned.data_raw, memoryview)
+        self.assertEqual(len(reassigned.save_raw), len(viewed.save_raw) + 1)
+        edited = viewed.copy()
+        self.assertEqual(edited, viewed)
+        edited.data_raw[0] ^= 0xFF
+        edited.save_raw[:4] = b"SAVE"
+        edited.meta.title = "Edited"
+        self.assertNotEqual(edited, viewed)
+        self.assertEqual(bytes(cartbin), original)
+        self.assertEqual(viewed.meta.title, "First")
+        # The edits make it into a compile, the original slots are still the same
+        slots = arduboy.fxcart.parse(cartbin, zerocopy=True)
+        slots[2] = edited
+        reparsed = arduboy.fxcart.parse(arduboy.fxcart.compile(slots))
+        self.assertEqual(reparsed[2], edited)
+        self.assertEqual(reparsed[3], arduboy.fxcart.parse(cartbin)[3])
+
+    def test_cartfile(self):
+        cartbin = arduboy.fxcart.compile(makecart())
+        tempfile = get_tempfile_name(self._testMethodName, ".bin")
+        with open(tempfile, "wb") as f:
+            f.write(cartbin + b'\xFF' * 100000)
+        parsed = arduboy.fxcart.parse(cartbin)
+        with arduboy.fxcart.CartFile(tempfile) as cart:
+            self.assertEqual(len(cart), len(parsed))
+            self.assertEqual(cart.size, len(arduboy.fxcart.trim(cartbin)))
+            self.assertEqual([cart.meta(i) for i in range(len(cart))], [x.meta for x in parsed])
+            self.assertEqual(cart[2].save_raw, parsed[2].save_raw)
+            self.assertEqual(cart[-1].program_raw, parsed[-1].program_raw)
+            self.assertEqual(len(list(cart)), len(parsed))
+            with self.assertRaises(IndexError):
+                cart[len(parsed)]
+
+    def test_trimfile(self):
+        cartbin = arduboy.fxcart.compile(makecart())
+        tempfile = get_tempfile_name(self._testMethodName, ".bin")
+        outfile = get_tempfile_name(self._testMethodName, "out.bin")
+        with open(tempfile, "wb") as f:
+            f.write(cartbin + b'\xFF' * 100000)
+        arduboy.fxcart.trim_file(tempfile, outfile)
+        arduboy.fxcart.trim_file(tempfile)
+        for filename in [tempfile, outfile]:
+            with self.subTest(filename = filename):
+                with open(filename, "rb") as f:
+                    self.assertEqual(f.read(), arduboy.fxcart.trim(cartbin))
+
+    def test_compile_to_file(self):
+        cartbin = arduboy.fxcart.compile(makecart())
+        with BytesIO() as f:
+            written = arduboy.fxcart.compile_to_file(makecart(), f)
+            self.assertEqual(written, len(cartbin))
+            self.assertEqual(f.getvalue(), cartbin)
+
+    def test_layout(self):
+        slots = makecart()
+        cartbin = arduboy.fxcart.compile(slots)
+        layouts = arduboy.fxcart.layout(slots)
+        self.assertEqual(len(layouts), len(slots))
+        for slotlayout in layouts:
+            with self.subTest(page = slotlayout.currentpage):
+                self.assertEqual(arduboy.fxcart.get_slot_size_bytes(cartbin, slotlayout.offset), slotlayout.length)
+                if slotlayout.savesize:
+                    self.assertEqual(arduboy.fxcart.get_save_page(cartbin, slotlayout.offset), slotlayout.savepage)
+                    self.assertEqual(slotlayout.savepage % (arduboy.fxcart.SAVE_ALIGNMENT // FX_PAGESIZE), 0)
+        self.assertEqual(arduboy.fxcart.compiled_size(layouts), len(cartbin))
+
+    def test_compile_cache(self):
+        slots = makecart()
+        cache = arduboy.fxcart.CompileCache()
+        self.assertEqual(arduboy.fxcart.compile(slots, cache=cache), arduboy.fxcart.compile(makecart()))
+        # Moving a game shifts its save alignment, and editing a title forces a recompile of just that slot
+        slots.insert(2, slots.pop())
+        slots[3].meta.title = "First, but edited"
+        expected = arduboy.fxcart.compile(copy.deepcopy(slots))
+        self.assertEqual(arduboy.fxcart.compile(slots, cache=cache), expected)
+        self.assertEqual(len(cache.slots), len(slots))
+        # Nothing changed, so the cached compile must be identical
+        self.assertEqual(arduboy.fxcart.compile(slots, cache=cache), expected)
+
+    def test_compile_parallel(self):
+        expected = arduboy.fxcart.compile(makecart())
+        self.assertEqual(arduboy.fxcart.compile(makecart(), executor=2), expected)
+        with ThreadPoolExecutor(2) as executor:
+            cache = arduboy.fxcart.CompileCache()
+            self.assertEqual(arduboy.fxcart.compile(makecart(), cache=cache, executor=executor), expected)
+            self.assertEqual(arduboy.fxcart.compile(makecart(), cache=cache, executor=executor), expected)
+
+    def test_headertable(self):
+        slots = makecart()
+        slots.append(copy.deepcopy(slots[2]))
+        cartbin = arduboy.fxcart.compile(slots)
+        table = arduboy.fxcart.FxHeaderTable.from_data(cartbin)
+        self.assertEqual(len(table), len(slots))
+        self.assertEqual(table.total_size_bytes(), len(arduboy.fxcart.trim(cartbin)))
+        for i, offset in enumerate(table.offsets):
+            with self.subTest(i = i):
+                self.assertEqual(table.slot_size_bytes(i), arduboy.fxcart.get_slot_size_bytes(cartbin, offset))
+                self.assertEqual(table.category[i], arduboy.fxcart.get_category(cartbin, offset))
+                self.assertEqual(table.program_page[i], arduboy.fxcart.get_program_page(cartbin, offset))
+                self.assertEqual(table.data_page[i], arduboy.fxcart.get_data_page(cartbin, offset))
+                self.assertEqual(table.save_page[i], arduboy.fxcart.get_save_page(cartbin, offset))
+                self.assertEqual(table.id(i), bytes(cartbin[offset + 25:offset + 57]))
+        self.assertEqual(table.games(), [2, 3, 4])
+        self.assertEqual(table.in_category(1), [2, 3, 4])
+        self.assertEqual(list(table.duplicates().values()), [[2, 4]])
+
+    def test_fingerprint(self):
+        cartbin = arduboy.fxcart.compile(makecart())
+        self.assertEqual(arduboy.fxcart.fingerprint(cartbin), arduboy.fxcart.fingerprint(cartbin + b'\xFF' * 5000))
+        slots = makecart()
+        slots[2].data_raw[0] ^= 0xFF # Changes the hash in the header
+        self.assertNotEqual(arduboy.fxcart.fingerprint(cartbin), arduboy.fxcart.fingerprint(arduboy.fxcart.compile(slots)))
+
+    def test_diff(self):
+        oldbin = arduboy.fxcart.compile(makecart())
+        self.assertEqual(arduboy.fxcart.diff(oldbin, oldbin), [])
+        # Swap the games, change the second one's data, and add a new category at the end
+        slots = makecart()
+        slots[2], slots[3] = slots[3], slots[2]
+        slots[2].data_raw = makebytearray(500)
+        slots.append(copy.deepcopy(slots[0]))
+        slots[-1].image_raw = bytearray(b'\x55' * SCREEN_BYTES)
+        slots[-1].meta.title = "New"
+        changes = arduboy.fxcart.diff(oldbin, arduboy.fxcart.compile(slots))
+        self.assertEqual([(c.change, c.title, c.old_index, c.new_index) for c in changes], [
+            (arduboy.fxcart.SLOTDIFF_MODIFIED, "Second", 3, 2),
+            (arduboy.fxcart.SLOTDIFF_MOVED, "First", 2, 3),
+            (arduboy.fxcart.SLOTDIFF_ADDED, "New", None, 4),
+        ])
+        # And going back the other way, the new category is removed
+        changes = arduboy.fxcart.diff(arduboy.fxcart.compile(slots), oldbin)
+        self.assertEqual(changes[0].change, arduboy.fxcart.SLOTDIFF_REMOVED)
+        self.assertEqual(changes[0].old_index, 4)
+        self.assertIsNone(changes[0].new_range)
+
+    def test_compile_single_slotpages(self):
+        slot = makecart()[2]
+        natural = arduboy.fxcart.compile_single(slot)
+        padded = arduboy.fxcart.compile_single(slot, 0, 0xFFFF, len(natural) // FX_PAGESIZE + 32)
+        self.assertEqual(len(padded), len(natural) + 32 * FX_PAGESIZE)
+        parsed = arduboy.fxcart.parse(padded)[0]
+        # The save stays at the end, the rest of the slot is the same
+        self.assertEqual(parsed.save_raw, slot.save_raw)
+        self.assertEqual(parsed.program_raw[0x20:], arduboy.fxcart.parse(natural)[0].program_raw[0x20:])
+        self.assertEqual(arduboy.fxcart.get_slot_size_bytes(padded, 0), len(padded))
+        with self.assertRaises(Exception):
+            arduboy.fxcart.compile_single(slot, 0, 0xFFFF, len(natural) // FX_PAGESIZE - 16)
+        with self.assertRaises(Exception):
+            arduboy.fxcart.compile_single(slot, 0, 0xFFFF, len(natural) // FX_PAGESIZE + 1) # Save can't be aligned
+
     def test_fxenabled_nolen_nofx(self):
         slot = arduboy.fxcart.empty_slot()
         slot.save_raw = bytearray()
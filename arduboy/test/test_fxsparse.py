@@ -0,0 +1,82 @@
+import unittest
+import os
+import arduboy.fxcart
+import arduboy.fxsparse
+
+from arduboy.constants import *
+from .common import *
+from .test_fxcart import makecart
+
+class TestFxSparse(unittest.TestCase):
+
+    def makeimage(self):
+        # A cart at the start, a partially erased block, dev data at the end and nothing in between
+        image = bytearray(b"\xFF" * (FX_BLOCKSIZE * 8))
+        cart = arduboy.fxcart.compile(makecart())
+        image[:len(cart)] = cart
+        image[FX_BLOCKSIZE * 3 + 5000:FX_BLOCKSIZE * 3 + 9000] = makebytearray(4000)
+        image[-3000:] = makebytearray(3000)
+        return image
+
+    def test_roundtrip(self):
+        image = self.makeimage()
+        filename = get_tempfile_name("fxsparse", "fxsparse")
+        digest = arduboy.fxsparse.write_file(filename, image, b"\xEF\x40\x14")
+        self.assertLess(os.path.getsize(filename), len(image) // 10)
+        with arduboy.fxsparse.SparseFxFile(filename) as backup:
+            self.assertEqual(backup.jedec_id, b"\xEF\x40\x14")
+            self.assertEqual(backup.sha256, digest)
+            self.assertEqual(len(backup), 8)
+            self.assertEqual([backup.is_erased(b) for b in range(8)], [False, True, True, False, True, True, True, False])
+            # Random access, in any order
+            self.assertEqual(backup.read_block(3), image[FX_BLOCKSIZE * 3:FX_BLOCKSIZE * 4])
+            self.assertEqual(backup.read_block(1), image[FX_BLOCKSIZE:FX_BLOCKSIZE * 2])
+            self.assertEqual(b"".join(data for _, data in backup.blocks()), image)
+            with self.assertRaises(IndexError):
+                backup.read_block(8)
+
+    def test_short(self):
+        # A trimmed backup doesn't end on a block
+        image = self.makeimage()[:FX_BLOCKSIZE + 512]
+        image[-256:] = makebytearray(256)
+        filename = get_tempfile_name("fxsparse_short", "fxsparse")
+        arduboy.fxsparse.write_file(filename, image)
+        with arduboy.fxsparse.SparseFxFile(filename) as backup:
+            self.assertEqual(len(backup), 2)
+            self.assertEqual(backup.read_block(1), image[FX_BLOCKSIZE:])
+
+    def test_corrupt(self):
+        image = self.makeimage()
+        filename = get_tempfile_name("fxsparse_corrupt", "fxsparse")
+        arduboy.fxsparse.write_file(filename, image)
+        with arduboy.fxsparse.SparseFxFile(filename) as backup:
+            offset, length, _ = backup.chunks[3]
+        with open(filename, "r+b") as f:
+            f.seek(offset + length // 2)
+            value = f.read(1)[0]
+            f.seek(offset + length // 2)
+            f.write(bytes([value ^ 0xFF]))
+        with arduboy.fxsparse.SparseFxFile(filename) as backup:
+            self.assertEqual(backup.read_block(0), image[:FX_BLOCKSIZE]) # The other blocks are fine
+            with self.assertRaises(Exception):
+                backup.read_block(3)
+        # An unfinished file isn't mistaken for a backup
+        with open(filename, "r+b") as f:
+            f.truncate(offset + length)
+        with self.assertRaises(Exception):
+            arduboy.fxsparse.SparseFxFile(filename)
+
+    def test_partial_removed(self):
+        image = self.makeimage()
+        filename = get_tempfile_name("fxsparse_partial", "fxsparse")
+        # Failing partway through leaves nothing behind
+        with self.assertRaises(Exception):
+            with arduboy.fxsparse.SparseFxWriter(filename, b"\x00\x00\x00", len(image), len(image)) as writer:
+                writer.add_block(image[:FX_BLOCKSIZE])
+                raise Exception("Cable unplugged")
+        self.assertFalse(os.path.exists(filename))
+        # And so does finishing too early
+        with self.assertRaises(Exception):
+            with arduboy.fxsparse.SparseFxWriter(filename, b"\x00\x00\x00", len(image), len(image)) as writer:
+                writer.add_block(image[:FX_BLOCKSIZE])
+        self.assertFalse(os.path.exists(filename))
@@ -0,0 +1,49 @@
+
+import unittest
+import arduboy.device
+import arduboy.hotplug
+
+from unittest import mock
+
+def makedevice(port, vidpid):
+    return arduboy.device.ArduboyDevice(port, vidpid, "Test", arduboy.device.device_has_bootloader(vidpid))
+
+class TestHotplug(unittest.TestCase):
+
+    def test_waituntil(self):
+        calls = []
+        def condition():
+            calls.append(1)
+            return "found" if len(calls) == 3 else None
+        self.assertEqual(arduboy.hotplug.wait_until(condition, 5), "found")
+        self.assertIsNone(arduboy.hotplug.wait_until(lambda: None, 0.1))
+
+    def test_watcher_events(self):
+        events = []
+        watcher = arduboy.hotplug.DeviceWatcher(events.append)
+        sketch = makedevice("ttyACM0", arduboy.device.DEVICES[1])
+        bootloader = makedevice("ttyACM0", arduboy.device.DEVICES[0])
+        other = makedevice("ttyACM1", arduboy.device.DEVICES[1])
+        # Scan directly rather than running the thread, it's the same thing minus the waiting
+        for connected in [[sketch], [sketch, other], [bootloader, other], []]:
+            with mock.patch("arduboy.device.get_connected_devices", return_value = connected):
+                watcher._scan()
+        self.assertEqual([(e.kind, e.device.port, e.device.has_bootloader) for e in events], [
+            (arduboy.hotplug.DEVICE_CONNECTED, "ttyACM0", False),
+            (arduboy.hotplug.DEVICE_CONNECTED, "ttyACM1", False),
+            (arduboy.hotplug.DEVICE_DISCONNECTED, "ttyACM0", False), # Reset into the bootloader
+            (arduboy.hotplug.DEVICE_CONNECTED, "ttyACM0", True),
+            (arduboy.hotplug.DEVICE_DISCONNECTED, "ttyACM0", True),
+            (arduboy.hotplug.DEVICE_DISCONNECTED, "ttyACM1", False),
+        ])
+
+    def test_watcher_thread(self):
+        events = []
+        with mock.patch("arduboy.device.get_connected_devices", return_value = [makedevice("ttyACM0", arduboy.device.DEVICES[0])]):
+            with arduboy.hotplug.DeviceWatcher(events.append):
+                arduboy.hotplug.wait_until(lambda: events, 5)
+        self.assertEqual(len(events), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
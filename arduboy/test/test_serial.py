@@ -0,0 +1,478 @@
+
+import unittest
+import os
+import sys
+import time
+import serial
+import arduboy.fxcart
+import arduboy.fxsparse
+import arduboy.serial
+import arduboy.simulator
+import arduboy.metrics
+import arduboy.shortcuts
+import arduboy.job
+import json
+
+from unittest import mock
+
+from arduboy.constants import *
+from .common import *
+from .test_fxcart import makecart
+from hashlib import sha256
+
+# Small chip so the tests don't push 16MiB around
+TEST_JEDEC = bytes([0xEF, 0x40, 0x14]) # 1MiB
+
+class TestSerial(unittest.TestCase):
+
+    def setUp(self):
+        # get_jedec_id waits on the real device, not the simulated one
+        self.jedec_wait = arduboy.serial.JEDEC_RETRY_WAIT
+        arduboy.serial.JEDEC_RETRY_WAIT = 0
+        self.device = arduboy.simulator.SimulatedBootloader(TEST_JEDEC)
+
+    def tearDown(self):
+        arduboy.serial.JEDEC_RETRY_WAIT = self.jedec_wait
+
+    def test_deviceinfo(self):
+        self.assertEqual(arduboy.serial.get_version(self.device), arduboy.simulator.SIM_DEFAULT_VERSION)
+        info = arduboy.serial.get_jedec_info(self.device)
+        self.assertEqual(info.capacity, 1 << 20)
+        self.assertEqual(info.manufacturer, "Winbond")
+        self.assertFalse(arduboy.serial.is_caterina(self.device))
+
+    def test_sketch(self):
+        sketch = makebytearray(10000)
+        arduboy.serial.flash_arduhex(sketch, self.device, None)
+        arduboy.serial.verify_arduhex(arduboy.common.pad_data(sketch, FLASH_PAGESIZE), self.device, None)
+        self.assertEqual(self.device.program[:len(sketch)], sketch)
+        self.assertEqual(arduboy.serial.backup_sketch(self.device)[:len(sketch)], sketch)
+        self.device.program[5000] ^= 0xFF
+        with self.assertRaises(Exception):
+            arduboy.serial.verify_arduhex(arduboy.common.pad_data(sketch, FLASH_PAGESIZE), self.device, None)
+        # Nothing to verify must not send a zero length read (which is 64K to the bootloader)
+        with mock.patch("arduboy.arduhex.analyze_sketch", return_value = arduboy.arduhex.SketchAnalysis()):
+            arduboy.serial.verify_arduhex(bytearray(), self.device, None)
+        self.assertEqual(arduboy.serial.get_version(self.device), arduboy.simulator.SIM_DEFAULT_VERSION)
+
+    def test_sketch_changed(self):
+        sketch = makebytearray(10000)
+        arduboy.serial.flash_arduhex(sketch, self.device, None)
+        self.assertEqual(arduboy.serial.flash_arduhex_changed(sketch, self.device), 0)
+        sketch[300] ^= 0xFF
+        sketch[9000:9010] = b"0123456789"
+        self.assertEqual(arduboy.serial.flash_arduhex_changed(sketch, self.device), 2)
+        self.assertEqual(self.device.program[:len(sketch)], sketch)
+        # A longer sketch writes the new pages too
+        sketch += makebytearray(1000)
+        self.assertEqual(arduboy.serial.flash_arduhex_changed(sketch, self.device), 8)
+        self.assertEqual(self.device.program[:len(sketch)], sketch)
+
+    def test_eeprom(self):
+        eeprom = makebytearray(1024)
+        arduboy.serial.write_eeprom(eeprom, self.device)
+        self.assertEqual(arduboy.serial.read_eeprom(self.device), eeprom)
+        arduboy.serial.erase_eeprom(self.device)
+        self.assertEqual(arduboy.serial.read_eeprom(self.device), b"\xFF" * 1024)
+
+    def test_eeprom_diff(self):
+        eeprom = makebytearray(1024)
+        arduboy.serial.write_eeprom(eeprom, self.device)
+        eeprom[10:13] = b"abc"
+        eeprom[1000] ^= 0xFF
+        self.assertEqual(arduboy.serial.eeprom_changed_runs(self.device.eeprom, eeprom), [(10, 13), (1000, 1001)])
+        self.assertEqual(arduboy.serial.write_eeprom_diff(eeprom, self.device), 4)
+        self.assertEqual(self.device.eeprom, eeprom)
+        self.assertEqual(arduboy.serial.write_eeprom_diff(eeprom, self.device), 0)
+        changed = sum(1 for b in eeprom if b != 0)
+        eeprom[:] = b"\x00" * 1024
+        self.assertEqual(arduboy.serial.write_eeprom_diff(eeprom, self.device), changed)
+        self.assertEqual(self.device.eeprom, eeprom)
+
+    def test_fx(self):
+        cart = arduboy.fxcart.trim(arduboy.fxcart.compile(makecart()))
+        arduboy.serial.flash_fx(cart, 0, self.device)
+        self.assertEqual(arduboy.serial.scan_fx(self.device), (len(cart), len(makecart())))
+        devdata = makebytearray(1000)
+        arduboy.serial.flash_fx(devdata, -1, self.device)
+        full = arduboy.serial.backup_fx(self.device)
+        self.assertEqual(full, self.device.fx)
+        self.assertEqual(arduboy.serial.backup_fx_used(self.device), cart)
+        self.assertEqual(arduboy.serial.backup_fx_used(self.device, True), full)
+
+    def test_fx_write_pipeline(self):
+        data = makebytearray(FX_BLOCKSIZE * 4)
+        # Count the turnarounds (reading after writing), each of which is a round trip on a real device
+        write, read = self.device.write, self.device.read
+        turnarounds = 0
+        writing = False
+        def counting_write(buffer):
+            nonlocal writing
+            writing = True
+            return write(buffer)
+        def counting_read(size):
+            nonlocal writing, turnarounds
+            if writing:
+                turnarounds += 1
+                writing = False
+            return read(size)
+        self.device.write, self.device.read = counting_write, counting_read
+        arduboy.serial.write_fx_blocks(data, 0, self.device)
+        # One per block (write and verify together), and one for the LED at the end
+        self.assertEqual(turnarounds, 5)
+        self.assertEqual(self.device.fx[:len(data)], data)
+        # A bad block is only compared once the next one is sent, but it's still caught
+        def corrupting_write(buffer):
+            result = write(buffer)
+            if len(buffer) == FX_BLOCKSIZE and self.device.commands["B"] == 2:
+                self.device.fx[FX_BLOCKSIZE + 100] ^= 0xFF
+            return result
+        self.device.write, self.device.read = corrupting_write, read
+        self.device.commands.clear()
+        with self.assertRaises(Exception):
+            arduboy.serial.write_fx_blocks(data, 0, self.device)
+        self.assertEqual(self.device.commands["B"], 3)
+        self.device.write = write
+        self.assertEqual(arduboy.serial.get_version(self.device), arduboy.simulator.SIM_DEFAULT_VERSION)
+
+    def test_fx_used_devdata(self):
+        cart = arduboy.fxcart.trim(arduboy.fxcart.compile(makecart()))
+        arduboy.serial.flash_fx(cart, 0, self.device)
+        # Dev data with a whole erased block in the middle of it
+        devdata = makebytearray(FX_BLOCKSIZE * 3)
+        devdata[FX_BLOCKSIZE:FX_BLOCKSIZE * 2] = b"\xFF" * FX_BLOCKSIZE
+        arduboy.serial.flash_fx(devdata, -1, self.device)
+        with self.assertLogs(level = "WARNING"):
+            scanned = arduboy.serial.backup_fx_used(self.device, True)
+        self.assertEqual(scanned[-FX_BLOCKSIZE:], devdata[-FX_BLOCKSIZE:])
+        self.assertNotEqual(scanned, self.device.fx)
+        self.assertEqual(arduboy.serial.backup_fx_used(self.device, True, devdata_length = len(devdata)), self.device.fx)
+
+    def test_fx_sync(self):
+        slots = makecart()
+        for i in range(6):
+            slot = makecart()[2]
+            slot.data_raw = makebytearray(70000 + i)
+            slot.meta.title = f"Big {i}"
+            slots.append(slot)
+        cart = arduboy.fxcart.compile(slots)
+        arduboy.serial.flash_fx(cart, 0, self.device)
+        self.assertEqual(arduboy.serial.sync_fx(cart, self.device), 0)
+        # A game on the device saved something, that shouldn't go away
+        table = arduboy.fxcart.FxHeaderTable.from_data(cart)
+        saveaddr = table.save_page[4] * FX_PAGESIZE
+        self.device.fx[saveaddr:saveaddr + 4] = b"SAVE"
+        # Update two games without changing their size
+        slots[5].data_raw[1000] ^= 0xFF
+        slots[8].program_raw[0] ^= 0xFF
+        newcart = arduboy.fxcart.compile(slots)
+        written = arduboy.serial.sync_fx(newcart, self.device)
+        self.assertGreater(written, 0)
+        self.assertLess(written, len(newcart) // FX_BLOCKSIZE)
+        expected = bytearray(newcart)
+        expected[saveaddr:saveaddr + 4] = b"SAVE"
+        self.assertEqual(self.device.fx[:len(newcart)], expected)
+        # A smaller cart has to end where it ends now
+        shortcart = arduboy.fxcart.compile(slots[:5])
+        arduboy.serial.sync_fx(shortcart, self.device)
+        self.assertEqual(arduboy.serial.scan_fx(self.device)[1], 5)
+
+    def test_fx_update_slot(self):
+        slots = makecart()
+        slots.append(makecart()[3])
+        slots[-1].meta.title = "Third"
+        cart = arduboy.fxcart.compile(slots)
+        arduboy.serial.flash_fx(cart, 0, self.device)
+        devdata = makebytearray(1000)
+        arduboy.serial.flash_fx(devdata, -1, self.device)
+        # The player has made progress since the cart was flashed
+        save_addr = arduboy.fxcart.FxHeaderTable.from_data(cart).save_page[2] * FX_PAGESIZE
+        progress = bytes(range(256)) * 16
+        self.device.fx[save_addr:save_addr + len(progress)] = progress
+        # A new, smaller version of the first game
+        update = makecart()[2]
+        update.program_raw = makebytearray(5000)
+        update.data_raw = makebytearray(10000)
+        page = arduboy.serial.update_fx_slot(update, self.device)
+        table = arduboy.fxcart.FxHeaderTable.from_data(self.device.fx)
+        self.assertEqual(page * FX_PAGESIZE, table.offsets[2])
+        self.assertEqual(list(table.offsets), list(arduboy.fxcart.FxHeaderTable.from_data(cart).offsets))
+        updated = arduboy.fxcart.parse(self.device.fx)
+        self.assertEqual(len(updated), len(slots))
+        update.category = 1
+        expected = arduboy.fxcart.compile_single(update, page, table.previous_page[2], table.slot_pages[2])
+        expected[-len(progress):] = progress
+        self.assertEqual(self.device.fx[table.offsets[2]:table.offsets[2] + len(expected)], expected)
+        self.assertEqual(updated[2].data_raw, arduboy.common.pad_data(update.data_raw.copy(), FX_PAGESIZE))
+        # The save on the device is kept, not the one in the new slot
+        self.assertEqual(table.save_page[2] * FX_PAGESIZE, save_addr)
+        self.assertEqual(updated[2].save_raw, progress)
+        self.assertEqual(updated[2].category, 1)
+        # The slots around it are untouched
+        for i in [0, 1, 3, 4]:
+            start, end = table.offsets[i], table.offsets[i] + table.slot_size_bytes(i)
+            self.assertEqual(self.device.fx[start:end], cart[start:end])
+        self.assertEqual(self.device.fx[-FX_PAGESIZE * 4:][:len(devdata)], devdata)
+        # Unless asked not to, or the save is a different size, then it's the new slot's save
+        arduboy.serial.update_fx_slot(update, self.device, keep_save = False)
+        self.assertEqual(arduboy.fxcart.parse(self.device.fx)[2].save_raw, update.save_raw)
+        self.device.fx[save_addr:save_addr + len(progress)] = progress
+        update.save_raw = makebytearray(8192)
+        with self.assertLogs(level = "WARNING"):
+            arduboy.serial.update_fx_slot(update, self.device)
+        self.assertEqual(arduboy.fxcart.parse(self.device.fx)[2].save_raw, update.save_raw)
+        # Bigger doesn't fit
+        update.data_raw = makebytearray(30000)
+        with self.assertRaises(Exception):
+            arduboy.serial.update_fx_slot(update, self.device)
+        with self.assertRaises(Exception):
+            arduboy.serial.update_fx_slot(update, self.device, "Nothing")
+
+    def test_fx_saves(self):
+        slots = makecart()
+        slots.append(makecart()[2])
+        slots[-1].meta.title = "First again" # Same game, so same id
+        slots.append(makecart()[2])
+        slots[-1].program_raw[0] ^= 0xFF
+        slots[-1].meta.title = "Third"
+        cart = arduboy.fxcart.compile(slots)
+        arduboy.serial.flash_fx(cart, 0, self.device)
+        table = arduboy.fxcart.FxHeaderTable.from_data(cart)
+        games = [2, 4, 5]
+        for n, i in enumerate(games):
+            addr = table.save_page[i] * FX_PAGESIZE
+            self.device.fx[addr:addr + 5] = f"SAVE{n}".encode()
+        reads = self.device.commands.get("g", 0)
+        saves = arduboy.serial.harvest_fx_saves(self.device)
+        self.assertEqual([s.title for s in saves], ["First", "First again", "Third"])
+        self.assertEqual([s.data[:5] for s in saves], [b"SAVE0", b"SAVE1", b"SAVE2"])
+        self.assertEqual(saves[0].id, table.id(2))
+        # Headers and saves, nothing else
+        self.assertEqual(self.device.commands["g"] - reads, len(slots) + 1 + len(games))
+        filename = get_tempfile_name("fxsaves", "zip")
+        arduboy.fxcart.write_saves(filename, saves)
+        self.assertEqual(arduboy.fxcart.read_saves(filename), saves)
+        # Wipe the saves on a freshly flashed cart, then put them back
+        arduboy.serial.flash_fx(cart, 0, self.device)
+        saves.append(arduboy.fxcart.FxSave(b"\x00" * 32, "Not here", b"\xFF" * 4096))
+        missing = arduboy.serial.restore_fx_saves(arduboy.fxcart.read_saves(filename) + saves[-1:], self.device)
+        self.assertEqual(missing, saves[-1:])
+        self.assertEqual(arduboy.serial.harvest_fx_saves(self.device), saves[:-1])
+        expected = bytearray(cart)
+        for n, i in enumerate(games):
+            addr = table.save_page[i] * FX_PAGESIZE
+            expected[addr:addr + 5] = f"SAVE{n}".encode()
+        self.assertEqual(self.device.fx[:len(cart)], expected)
+
+    def test_fx_sparse(self):
+        cart = arduboy.fxcart.compile(makecart())
+        arduboy.serial.flash_fx(cart, 0, self.device)
+        devdata = makebytearray(5000)
+        arduboy.serial.flash_fx(devdata, -1, self.device)
+        original = bytearray(self.device.fx)
+        filename = get_tempfile_name("fxsparse_serial", "fxsparse")
+        self.assertEqual(arduboy.serial.backup_fx_sparse(self.device, filename), sha256(original).hexdigest())
+        self.assertFalse(os.path.exists(filename + ".tmp"))
+        # Something else gets written in the middle of the flash, and the cart is erased
+        self.device.fx[:] = b"\xFF" * len(self.device.fx)
+        self.device.fx[FX_BLOCKSIZE * 5:FX_BLOCKSIZE * 5 + 100] = makebytearray(100)
+        writes = self.device.commands.get("B", 0)
+        arduboy.serial.restore_fx_sparse(filename, self.device)
+        self.assertEqual(self.device.fx, original)
+        # The cart, the dev data and the block that had to be erased
+        self.assertEqual(self.device.commands["B"] - writes, 3)
+        # Used only backups stop at the end of the cart
+        arduboy.serial.backup_fx_sparse(self.device, filename, True)
+        with arduboy.fxsparse.SparseFxFile(filename) as backup:
+            self.assertEqual(backup.length, len(arduboy.fxcart.trim(cart)))
+        # A failed backup leaves no temporary file, and the last good backup alone
+        with open(filename, "rb") as f:
+            previous = f.read()
+        read = self.device.read
+        def failing_read(size):
+            if size == FX_BLOCKSIZE:
+                raise Exception("Cable unplugged")
+            return read(size)
+        self.device.read = failing_read
+        with self.assertRaises(Exception):
+            arduboy.serial.backup_fx_sparse(self.device, filename)
+        self.device.read = read
+        self.device.reset_input_buffer()
+        self.assertFalse(os.path.exists(filename + ".tmp"))
+        with open(filename, "rb") as f:
+            self.assertEqual(f.read(), previous)
+
+    def test_fx_backupfile(self):
+        self.device.fx[:] = makebytearray(len(self.device.fx))
+        filename = get_tempfile_name("fxbackupfile", "bin")
+        # Interrupt the backup partway, the second run should pick up where it left off
+        read = self.device.read
+        def failing_read(size):
+            if self.device.commands.get("g", 0) == 5:
+                raise Exception("Cable unplugged")
+            return read(size)
+        self.device.read = failing_read
+        with self.assertRaises(Exception):
+            arduboy.serial.backup_fx_to_file(self.device, filename)
+        self.device.read = read
+        self.device.reset_input_buffer()
+        self.assertTrue(os.path.exists(filename + arduboy.serial.FX_JOURNAL_EXTENSION))
+        with open(filename + arduboy.serial.FX_JOURNAL_EXTENSION, "r") as f:
+            done = len(f.read().splitlines()) - 1
+        self.assertGreater(done, 0)
+        self.device.commands.clear()
+        digest = arduboy.serial.backup_fx_to_file(self.device, filename)
+        # The fingerprint reads the first page and the (single, not a cart) header
+        blocks = len(self.device.fx) // FX_BLOCKSIZE
+        self.assertEqual(self.device.commands["g"], blocks - done + 2)
+        self.assertFalse(os.path.exists(filename + arduboy.serial.FX_JOURNAL_EXTENSION))
+        with open(filename, "rb") as f:
+            self.assertEqual(f.read(), self.device.fx)
+        self.assertEqual(digest, arduboy.fxcart.sha256(self.device.fx).hexdigest())
+        # Interrupted again, but the flash changes before the next run: the journal must not be resumed
+        self.device.commands.clear()
+        self.device.read = failing_read
+        with self.assertRaises(Exception):
+            arduboy.serial.backup_fx_to_file(self.device, filename)
+        self.device.read = read
+        self.device.reset_input_buffer()
+        self.device.fx[:FX_PAGESIZE] = bytes(b ^ 0xFF for b in self.device.fx[:FX_PAGESIZE])
+        self.device.commands.clear()
+        arduboy.serial.backup_fx_to_file(self.device, filename)
+        self.assertEqual(self.device.commands["g"], blocks + 2)
+        with open(filename, "rb") as f:
+            self.assertEqual(f.read(), self.device.fx)
+
+    def test_fx_diff(self):
+        cachedir = get_tempfile_name("fxdiff", "cache")
+        cart = arduboy.fxcart.compile(makecart())
+        arduboy.serial.flash_fx_diff(cart, self.device, cachedir)
+        self.assertEqual(self.device.fx[:len(cart)], cart)
+        # Same cart again: nothing is written
+        self.device.commands.clear()
+        arduboy.serial.flash_fx_diff(cart, self.device, cachedir)
+        self.assertNotIn("B", self.device.commands)
+        # Without reading back the blocks the cache says are the same, unlike the full check
+        trusted_reads = self.device.commands["g"]
+        self.device.commands.clear()
+        arduboy.serial.flash_fx_diff(cart, self.device, cachedir, check_unchanged = True)
+        self.assertNotIn("B", self.device.commands)
+        self.assertEqual(self.device.commands["g"], trusted_reads + (len(cart) + FX_BLOCKSIZE - 1) // FX_BLOCKSIZE)
+        self.device.commands.clear()
+        # Something else changed a game's program behind the cache's back (no header touched): the cache is 
+        # trusted by default, so only the full check catches it
+        offset = arduboy.fxcart.FxHeaderTable.from_data(cart).offsets[2] + 2000
+        self.device.fx[offset] ^= 0xFF
+        arduboy.serial.flash_fx_diff(cart, self.device, cachedir)
+        self.assertNotIn("B", self.device.commands)
+        self.assertNotEqual(self.device.fx[:len(cart)], cart)
+        arduboy.serial.flash_fx_diff(cart, self.device, cachedir, check_unchanged = True)
+        self.assertEqual(self.device.commands["B"], 1)
+        self.assertEqual(self.device.fx[:len(cart)], cart)
+        # A change to the cart writes (and verifies) just the changed blocks
+        changed = cart.copy()
+        changed[offset] ^= 0x55
+        self.device.commands.clear()
+        arduboy.serial.flash_fx_diff(changed, self.device, cachedir)
+        self.assertEqual(self.device.commands["B"], 1)
+        self.assertEqual(self.device.fx[:len(changed)], changed)
+
+    def test_latency(self):
+        device = arduboy.simulator.SimulatedBootloader(TEST_JEDEC, latency = 0.01)
+        start = time.perf_counter()
+        arduboy.serial.get_version(device)
+        self.assertGreaterEqual(time.perf_counter() - start, 0.01)
+
+    def test_session(self):
+        self.device.version = 10 # Caterina, so the lock bits are read too
+        self.device.lockbits = 0x10
+        with arduboy.serial.BootloaderSession(self.device) as session:
+            for _ in range(3):
+                self.assertTrue(arduboy.serial.is_caterina(session))
+                self.assertEqual(arduboy.serial.get_jedec_info(session).capacity, 1 << 20)
+                self.assertEqual(len(arduboy.serial.read_bootloader(session)), BOOTLOADER_CATERINA_SIZE)
+                arduboy.shortcuts.detect_device_type(session)
+                arduboy.serial.backup_sketch(session)
+            self.assertEqual(self.device.commands["V"], 1)
+            self.assertEqual(self.device.commands["r"], 1)
+            self.assertEqual(self.device.commands["j"], 2) # get_jedec_id asks twice
+            # One read for the bootloader, then one per sketch backup
+            self.assertEqual(self.device.commands["g"], 4)
+        self.assertFalse(self.device.is_open)
+
+    def test_job(self):
+        sketch = makebytearray(5000)
+        devdata = makebytearray(3000)
+        eeprom = makebytearray(1024)
+        progress = []
+        status = []
+        arduboy.job.run_job([
+            arduboy.job.flash_sketch_step(sketch),
+            arduboy.job.verify_sketch_step(sketch),
+            arduboy.job.flash_fx_step(devdata),
+            arduboy.job.write_eeprom_step(eeprom),
+            arduboy.job.exit_step(),
+        ], self.device, lambda c, t: progress.append((c, t)), status.append)
+        self.assertEqual(self.device.program[:len(sketch)], sketch)
+        self.assertEqual(self.device.fx[-FX_PAGESIZE * 12:-FX_PAGESIZE * 12 + len(devdata)], devdata)
+        self.assertEqual(self.device.eeprom, eeprom)
+        self.assertTrue(self.device.exited)
+        self.assertEqual(len(status), 5)
+        # Progress only ever goes forward, over the whole job
+        self.assertEqual(progress, sorted(progress))
+        self.assertEqual(progress[-1][0], progress[-1][1])
+        self.assertEqual(len(set(t for _, t in progress)), 1)
+
+    def test_job_all(self):
+        class SimulatedDevice:
+            def __init__(self, port, simulated):
+                self.port = port
+                self.simulated = simulated
+                self.simulated.port = port
+            def connect_serial(self):
+                return self.simulated
+        devices = [ SimulatedDevice(f"sim{i}", arduboy.simulator.SimulatedBootloader(TEST_JEDEC)) for i in range(4) ]
+        devices[2].simulated.jedec_id = bytes([0xC8, 0x40, 0x14])
+        devices[3].simulated.version = 12 # No flash cart support
+        sketch = makebytearray(2000)
+        devdata = makebytearray(1000)
+        results = arduboy.job.run_job_on_all([
+            arduboy.job.flash_sketch_step(sketch), arduboy.job.verify_sketch_step(sketch), arduboy.job.flash_fx_step(devdata)
+        ], devices)
+        self.assertEqual([r.port for r in results], ["sim0", "sim1", "sim2", "sim3"])
+        self.assertEqual([r.ok for r in results], [True, True, True, False])
+        self.assertTrue(results[0].verified)
+        self.assertEqual(results[2].jedec_id[0], 0xC8)
+        self.assertIsNone(results[3].jedec_id)
+        self.assertIn("flash cart", results[3].error)
+        for device in devices:
+            self.assertEqual(device.simulated.program[:len(sketch)], sketch)
+
+    def test_metrics(self):
+        metrics = arduboy.metrics.SerialMetrics()
+        s_port = arduboy.metrics.InstrumentedPort(self.device, metrics)
+        with metrics.operation("flash"):
+            arduboy.serial.flash_fx(makebytearray(FX_BLOCKSIZE * 2), 0, s_port)
+        self.assertEqual(s_port.port, self.device.port)
+        # Two blocks written (and read back) plus the commands around them
+        self.assertGreater(metrics.bytes_written, FX_BLOCKSIZE * 2)
+        self.assertGreater(metrics.bytes_read, FX_BLOCKSIZE * 2)
+        self.assertEqual(metrics.latencies["led+address+write"].count, 2)
+        self.assertEqual(metrics.latencies["jedec"].count, 2)
+        self.assertEqual(metrics.operations[0].bytes_written, metrics.bytes_written)
+        exported = json.loads(metrics.to_json())
+        self.assertEqual(exported["operations"][0]["name"], "flash")
+        self.assertEqual(sum(exported["latencies"]["version"]["buckets"]), 1)
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "pty only on linux")
+    def test_pty(self):
+        with arduboy.simulator.PtyBootloader(self.device) as bootloader:
+            s_port = serial.Serial(bootloader.port, 115200, timeout = 5)
+            eeprom = makebytearray(1024)
+            arduboy.serial.write_eeprom(eeprom, s_port)
+            self.assertEqual(arduboy.serial.read_eeprom(s_port), eeprom)
+            s_port.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
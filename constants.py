@@ -7,10 +7,12 @@ SCRIPTDIR = os.path.dirname(os.path.abspath(__file__))
 IMAGE_FILEFILTER = "Images (*.png *.jpg *.jpeg *.gif *.bmp);;All Files (*)"
 HEX_FILEFILTER = "All Supported Files (*.hex);;All Files (*)"
 BIN_FILEFILTER = "All Supported Files (*.bin);;All Files (*)"
+FXBACKUP_FILEFILTER = "All Supported Files (*.bin *.fxsparse);;All Files (*)"
 ARDUHEX_FILEFILTER = "All Supported Files (*.hex *.arduboy *.zip);;All Files (*)"
 ARDUBOY_FILEFILTER = "All Supported Files (*.arduboy);;All Files (*)"
 HEADER_FILEFILTER = "All Supported Files (*.h);;All Files(*)"
 TEXT_FILEFILTER = "All Supported Files (*.txt);;All Files(*)"
+SAVES_FILEFILTER = "All Supported Files (*.zip);;All Files (*)"
 
 TINYFONT = "m3x6.ttf"
 TINYFONT_WIDTH = 4 #WARN: This is not always the case!!
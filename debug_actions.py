@@ -1,12 +1,13 @@
 import datetime
 import logging
+import arduboy.metrics
 
 import gui_utils
 import gui_common
 
 from dataclasses import dataclass
 from PyQt6.QtCore import QTimer, pyqtSignal, Qt, QThread, QObject
-from PyQt6.QtWidgets import QWidget, QVBoxLayout, QListWidget, QHBoxLayout, QLabel, QListWidgetItem
+from PyQt6.QtWidgets import QWidget, QVBoxLayout, QListWidget, QHBoxLayout, QLabel, QListWidgetItem, QCheckBox, QPlainTextEdit, QPushButton, QFileDialog
 
 
 @dataclass
@@ -63,10 +64,47 @@ class DebugWindow(QWidget):
         self.actionlist = QListWidget()
         layout.addWidget(self.actionlist)
 
+        # Serial metrics, so slow cables and hubs show up as numbers. Off unless asked for
+        self.metrics_cb = QCheckBox("Record serial metrics")
+        self.metrics_cb.setChecked(arduboy.metrics.global_metrics is not None)
+        self.metrics_cb.toggled.connect(self.toggle_metrics)
+        self.metrics_text = QPlainTextEdit()
+        self.metrics_text.setReadOnly(True)
+        self.metrics_text.setMaximumHeight(150)
+        metrics_export = QPushButton("Export metrics")
+        metrics_export.clicked.connect(self.export_metrics)
+        metrics_layout = QHBoxLayout()
+        metrics_layout.addWidget(self.metrics_cb)
+        metrics_layout.addStretch()
+        metrics_layout.addWidget(metrics_export)
+        layout.addLayout(metrics_layout)
+        layout.addWidget(self.metrics_text)
+
         for a in container.actions:
             self.add_item(a)
 
         container.add_item.connect(self.add_item)
+        self.refresh_metrics()
+
+    def toggle_metrics(self, checked):
+        if checked:
+            arduboy.metrics.enable_global_metrics()
+        else:
+            arduboy.metrics.disable_global_metrics()
+        self.refresh_metrics()
+
+    def refresh_metrics(self):
+        metrics = arduboy.metrics.global_metrics
+        self.metrics_text.setPlainText("\n".join(metrics.summary()) if metrics else "Not recording")
+
+    def export_metrics(self):
+        metrics = arduboy.metrics.global_metrics
+        if not metrics:
+            return
+        filepath, _ = QFileDialog.getSaveFileName(self, "Export serial metrics", "serial-metrics.json", "JSON Files (*.json)")
+        if filepath:
+            with open(filepath, "w") as f:
+                f.write(metrics.to_json(indent = 2))
     
     def add_item(self, action: DebugAction):
         item = QListWidgetItem()
@@ -76,6 +114,8 @@ class DebugWindow(QWidget):
         self.actionlist.addItem(item)
         self.actionlist.setItemWidget(item, widget)
         self.actionlist.setCurrentItem(item)
+        # Actions are usually added right after some serial operation finishes
+        self.refresh_metrics()
 
 
 # The globally configured debug container everyone can use. I don't really care
@@ -43,6 +43,7 @@ class CartWindow(QMainWindow):
 
         self.filepath = None
         self.search_text = None
+        self.compile_cache = arduboy.fxcart.CompileCache() # Saving/flashing only recompiles slots that changed
         self.resize(800, 600)
         self._add_slot_signal.connect(self.add_slot)
 
@@ -385,8 +386,8 @@ class CartWindow(QMainWindow):
             widget = widget.parent()
 
     # UNFORTUNATELY, any dialog box handles its own exceptions (it's hard not to), so you must check the return
-    # type from here. Ew, TODO: fix this!
-    def get_current_as_raw(self):
+    # type from here. Ew, TODO: fix this! If a file is given, the cart is streamed into it and the size is returned instead
+    def get_current_as_raw(self, fileobj = None):
         slots = self.get_slots_widgets()
         fxbin = bytearray()
 
@@ -407,7 +408,10 @@ class CartWindow(QMainWindow):
                     slot.image_raw = arduboy.image.pilimage_to_bin(pilimage)
                     widget.image._finish_image(pilimage.convert("L").tobytes()) # Very hacky backdoor stuff! TODO: make this nicer!
             repstatus("Compiling FX cart...")
-            fxbin = arduboy.fxcart.compile([x for x,_ in slots], repprog)
+            if fileobj:
+                fxbin = arduboy.fxcart.compile_to_file([x for x,_ in slots], fileobj, repprog, self.compile_cache)
+            else:
+                fxbin = arduboy.fxcart.compile([x for x,_ in slots], repprog, self.compile_cache)
         dialog = widget_progress.do_progress_work(do_work, "Compiling FX Cart", simple = True)
         if dialog.error_state:
             return None
@@ -417,11 +421,14 @@ class CartWindow(QMainWindow):
     # All saves are basically the same at the end of the day, this is what they do. This removes
     # modification state and sets current document to whatever you give
     def do_self_save(self, filepath):
-        rawdata = self.get_current_as_raw()
-        if not rawdata:
+        # The cart is streamed to a temporary file first, so a failed compile doesn't destroy the old one
+        temppath = filepath + ".tmp"
+        with open(temppath, "wb") as f:
+            written = self.get_current_as_raw(f)
+        if not written:
+            os.remove(temppath)
             return
-        with open(filepath, "wb") as f:
-            f.write(rawdata)
+        os.replace(temppath, filepath)
         self.filepath = filepath
         self.set_modified(False)
         debug_actions.global_debug.add_action_str(f"Saved cart in editor to file {filepath}")
@@ -470,7 +477,7 @@ class CartWindow(QMainWindow):
         # IDK how long it takes to parse, just throw up a loading window just in case anyway
         def do_work(repprog, repstatus):
             nonlocal parsed # widgits # parsed
-            parsed = arduboy.fxcart.parse(bindata, repprog)
+            parsed = arduboy.fxcart.parse(bindata, repprog, zerocopy=True)
             repstatus("Rendering items...")
             count = 0
             for slot in parsed:
@@ -512,10 +519,8 @@ class CartWindow(QMainWindow):
             def do_work(device, repprog, repstatus):
                 nonlocal bindata
                 repstatus("Reading FX flash...")
-                s_port = device.connect_serial()
-                bindata = arduboy.serial.backup_fx(s_port, repprog)
-                repstatus("Trimming FX file...")
-                bindata = arduboy.fxcart.trim(bindata)
+                s_port = arduboy.serial.BootloaderSession(device.connect_serial())
+                bindata = arduboy.serial.backup_fx_used(s_port, False, repprog)
             dialog = widget_progress.do_progress_work(do_work, "Load FX Flash")
             if not dialog.error_state:
                 self.filepath = None # There is no file anymore
@@ -524,20 +529,32 @@ class CartWindow(QMainWindow):
     
     def action_flash(self):
         # Might as well ask... it's kind of a big deal to flash
-        reply = QMessageBox.question(self, "Flash FX Cart",
-            f"Are you sure you want to flash this cart to the Arduboy?\n\nThis will overwrite the ENTIRE cart!",
-            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.No)
-        if reply != QMessageBox.StandardButton.Yes:
+        box = QMessageBox(QMessageBox.Icon.Question, "Flash FX Cart",
+            "Are you sure you want to flash this cart to the Arduboy?\n\n"
+            "'Changed games' only rewrites the games whose header or title image differ from what's on the Arduboy, "
+            "which is much faster, and keeps the saves of the other games. It can't tell if a game on the Arduboy is "
+            "damaged (say, after an interrupted flash).\n\n"
+            "'Entire cart' overwrites the ENTIRE cart, saves and all.", parent = self)
+        changed_button = box.addButton("Changed games", QMessageBox.ButtonRole.AcceptRole)
+        full_button = box.addButton("Entire cart", QMessageBox.ButtonRole.AcceptRole)
+        box.addButton(QMessageBox.StandardButton.Cancel)
+        box.exec()
+        if box.clickedButton() not in (changed_button, full_button):
             return 
+        full = box.clickedButton() == full_button
         # Must compile data first
         bindata = self.get_current_as_raw()
         if not bindata:
             return
         def do_work(device, repprog, repstatus):
             nonlocal bindata
-            s_port = device.connect_serial()
+            s_port = arduboy.serial.BootloaderSession(device.connect_serial())
             repstatus("Flashing FX Cart...")
-            arduboy.serial.flash_fx(bindata, 0, s_port, verify=True, report_progress=repprog)
+            if full:
+                arduboy.serial.flash_fx(bindata, 0, s_port, verify=True, report_progress=repprog)
+            else:
+                # Only rewrites the games which aren't already on the device (checked against its headers)
+                arduboy.serial.sync_fx(bindata, s_port, verify=True, report_progress=repprog)
         dialog = widget_progress.do_progress_work(do_work, "Flash FX Cart")
         if not dialog.error_state:
             debug_actions.global_debug.add_action_str(f"Flashed cart in editor to Arduboy")
@@ -702,7 +719,7 @@ class CartWindow(QMainWindow):
         if cslot:
             if cslot.is_category():
                 raise Exception("Can't add saves to categories!")
-            cslot.save_raw += bytearray([0xFF] * arduboy.fxcart.SAVE_ALIGNMENT)
+            cslot.save_raw = bytearray(cslot.save_raw) + bytearray([0xFF] * arduboy.fxcart.SAVE_ALIGNMENT)
             widget.update_metalabel()
             self.set_modified(True)
             debug_actions.global_debug.add_action_str(f"Added more save for: {cslot.meta.title}")
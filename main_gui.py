@@ -1,4 +1,5 @@
 import arduboy.device
+import arduboy.hotplug
 import arduboy.arduhex
 import arduboy.serial
 import arduboy.fxcart
@@ -25,7 +26,7 @@ import logging
 from PyQt6.QtWidgets import QMainWindow, QVBoxLayout, QWidget, QTabWidget
 from PyQt6 import QtGui
 from PyQt6.QtGui import QAction
-from PyQt6.QtCore import QTimer, Qt
+from PyQt6.QtCore import Qt, pyqtSignal
 
 
 def main():
@@ -39,6 +40,8 @@ def main():
 
 
 class MainWindow(QMainWindow):
+    device_change = pyqtSignal()
+
     def __init__(self):
         super().__init__()
 
@@ -48,9 +51,10 @@ class MainWindow(QMainWindow):
 
         self.create_menu()
 
-        # The timer to test connections
-        self.connection_timer = QTimer(self)
-        self.connection_timer.timeout.connect(self.refresh_connection_status)
+        # Connections are only checked when a device comes or goes. The watcher calls from its own thread,
+        # the signal gets us back on the gui thread
+        self.device_change.connect(self.refresh_connection_status)
+        self.device_watcher = arduboy.hotplug.DeviceWatcher(lambda _: self.device_change.emit())
         self.do_updates = True
         self.last_device = None
 
@@ -87,7 +91,8 @@ class MainWindow(QMainWindow):
         central_widget.setLayout(layout)
         self.setCentralWidget(central_widget)
 
-        self.connection_timer.start(1000)
+        self.refresh_connection_status()
+        self.device_watcher.start()
         debug_actions.global_debug.add_action_str("Opened Arduboy Toolset")
     
 
@@ -168,6 +173,7 @@ class MainWindow(QMainWindow):
         self.cart_window.activateWindow()
     
     def closeEvent(self, event) -> None:
+        self.device_watcher.stop()
         debug_actions.remove_global_debug_window()
         if hasattr(self, 'cart_window'):
             self.cart_window.close()
@@ -56,6 +56,16 @@ def set_basic_logging():
 
 
 
+def get_fx_cache_dir():
+    """Where images written to carts are remembered, for differential flashing. Per user, the app folder might be read only"""
+    if sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    elif sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~/AppData/Local")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "arduboy_toolset", "fxcache")
+
 def get_filesafe_datetime():
     return time.strftime("%Y%m%d-%H%M%S", time.localtime())
 
@@ -68,6 +78,9 @@ def get_eeprom_backup_filename():
 def get_fx_backup_filename():
     return f"flashcart-backup-{get_filesafe_datetime()}.bin"
 
+def get_fx_saves_backup_filename():
+    return f"flashcart-saves-{get_filesafe_datetime()}.zip"
+
 def get_arduhex_backup_filename(arduparsed: arduboy.arduhex.ArduboyParsed):
     return slugify.slugify(arduparsed.title or arduparsed.original_filename or "") + f"_{get_filesafe_datetime()}.arduboy"
 
@@ -10,7 +10,7 @@ import debug_actions
 
 import logging
 
-from PyQt6.QtWidgets import QVBoxLayout, QWidget, QPushButton
+from PyQt6.QtWidgets import QCheckBox, QVBoxLayout, QWidget, QPushButton
 
 # A fully self contained widget which can upload and backup EEPROM from arduboy
 class EEPROMWidget(QWidget):
@@ -25,7 +25,10 @@ class EEPROMWidget(QWidget):
         self.upload_picker = widgets_common.FilePicker(constants.BIN_FILEFILTER)
         self.upload_button = QPushButton("Restore")
         self.upload_button.clicked.connect(self.do_upload)
-        upload_group, _ = gui_utils.make_file_action("Restore EEPROM", self.upload_picker, self.upload_button, "⬆️", gui_common.SUCCESSCOLOR)
+        upload_group, upload_layout = gui_utils.make_file_action("Restore EEPROM", self.upload_picker, self.upload_button, "⬆️", gui_common.SUCCESSCOLOR)
+
+        self.changedonly_cb = QCheckBox("Only write bytes that changed (faster, trusts what's read from the Arduboy)")
+        upload_layout.addWidget(self.changedonly_cb)
 
         # Backup EEPROM
         self.backup_picker = widgets_common.FilePicker(constants.BIN_FILEFILTER, True, utils.get_eeprom_backup_filename)
@@ -56,9 +59,12 @@ class EEPROMWidget(QWidget):
             repstatus("Restoring EEPROM from file...")
             with open (filepath,"rb") as f:
                 eepromdata = bytearray(f.read())
-            s_port = device.connect_serial()
+            s_port = arduboy.serial.BootloaderSession(device.connect_serial())
             logging.info(f"Restoring eeprom from {filepath} into {device}")
-            arduboy.serial.write_eeprom(eepromdata, s_port)
+            if self.changedonly_cb.isChecked():
+                arduboy.serial.write_eeprom_diff(eepromdata, s_port)
+            else:
+                arduboy.serial.write_eeprom(eepromdata, s_port)
             arduboy.serial.exit_bootloader(s_port) # Eh, might as well do bootloader here too
 
         dialog = widget_progress.do_progress_work(do_work, "Restore EEPROM")
@@ -71,7 +77,7 @@ class EEPROMWidget(QWidget):
 
         def do_work(device, _, repstatus):
             repstatus("Saving EEPROM to file...")
-            s_port = device.connect_serial()
+            s_port = arduboy.serial.BootloaderSession(device.connect_serial())
             logging.info(f"Backing up eeprom from {device} into {filepath}")
             eepromdata = arduboy.serial.read_eeprom(s_port)
             with open (filepath,"wb") as f:
@@ -88,7 +94,7 @@ class EEPROMWidget(QWidget):
 
         def do_work(device, _, repstatus):
             repstatus("ERASING EEPROM...")
-            s_port = device.connect_serial()
+            s_port = arduboy.serial.BootloaderSession(device.connect_serial())
             logging.info(f"Erasing eeprom in {device}")
             arduboy.serial.erase_eeprom(s_port)
             arduboy.serial.exit_bootloader(s_port) 
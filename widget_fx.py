@@ -1,4 +1,5 @@
 import arduboy.fxcart
+import arduboy.fxsparse
 import arduboy.serial
 
 import gui_common
@@ -21,7 +22,7 @@ class FxWidget(QWidget):
         self.coninfo = widgets_common.ConnectionInfo()
 
         # Upload FX
-        self.upload_picker = widgets_common.FilePicker(constants.BIN_FILEFILTER)
+        self.upload_picker = widgets_common.FilePicker(constants.FXBACKUP_FILEFILTER)
         self.upload_button = QPushButton("Upload")
         self.upload_button.clicked.connect(self.do_upload)
         upload_group, upload_layout = gui_utils.make_file_action("Upload Flashcart", self.upload_picker, self.upload_button, "⬆️", gui_common.SUCCESSCOLOR)
@@ -29,12 +30,15 @@ class FxWidget(QWidget):
         self.contrast_picker = widgets_common.ContrastPicker()
         contrast_container, self.contrast_cb = gui_utils.make_toggleable_element("Patch contrast", self.contrast_picker, nostretch=True)
         self.ssd1309_cb = QCheckBox("Patch for screen SSD1309")
+        self.diff_cb = QCheckBox("Only write blocks changed since the last upload from this computer")
+        self.diff_cb.setToolTip("Much faster, but anything changed on the cart by something else since then is left as it is")
 
         upload_layout.addWidget(contrast_container)
         upload_layout.addWidget(self.ssd1309_cb)
+        upload_layout.addWidget(self.diff_cb)
 
         # Backup FX
-        self.backup_picker = widgets_common.FilePicker(constants.BIN_FILEFILTER, True, utils.get_fx_backup_filename)
+        self.backup_picker = widgets_common.FilePicker(constants.FXBACKUP_FILEFILTER, True, utils.get_fx_backup_filename)
         self.backup_button = QPushButton("Backup")
         self.backup_button.clicked.connect(self.do_backup)
         backup_group, backup_layout = gui_utils.make_file_action("Backup Flashcart", self.backup_picker, self.backup_button, "⬇️", gui_common.BACKUPCOLOR)
@@ -44,6 +48,17 @@ class FxWidget(QWidget):
 
         backup_layout.addWidget(self.trim_cb)
 
+        # Saves only, much faster than backing up the whole cart
+        self.savesbackup_picker = widgets_common.FilePicker(constants.SAVES_FILEFILTER, True, utils.get_fx_saves_backup_filename)
+        self.savesbackup_button = QPushButton("Backup")
+        self.savesbackup_button.clicked.connect(self.do_savesbackup)
+        savesbackup_group, _ = gui_utils.make_file_action("Backup Game Saves", self.savesbackup_picker, self.savesbackup_button, "⬇️", gui_common.BACKUPCOLOR)
+
+        self.savesrestore_picker = widgets_common.FilePicker(constants.SAVES_FILEFILTER)
+        self.savesrestore_button = QPushButton("Restore")
+        self.savesrestore_button.clicked.connect(self.do_savesrestore)
+        savesrestore_group, _ = gui_utils.make_file_action("Restore Game Saves", self.savesrestore_picker, self.savesrestore_button, "⬆️", gui_common.SUCCESSCOLOR)
+
         # Extras
         warninglabel = QLabel("NOTE: Flashcarts take much longer to upload + backup than sketches!")
         warninglabel.setStyleSheet(f"color: {gui_common.SUBDUEDCOLOR}; padding: 10px")
@@ -51,7 +66,7 @@ class FxWidget(QWidget):
         self.size_button = QPushButton("Check current cart size")
         self.size_button.clicked.connect(self.do_checksize)
 
-        gui_utils.add_children_nostretch(fx_layout, [self.coninfo, upload_group, backup_group, self.size_button, warninglabel])
+        gui_utils.add_children_nostretch(fx_layout, [self.coninfo, upload_group, backup_group, savesbackup_group, savesrestore_group, self.size_button, warninglabel])
 
         self.setLayout(fx_layout)
 
@@ -59,6 +74,8 @@ class FxWidget(QWidget):
         self.coninfo.set_connected_device(device)
         self.upload_button.setEnabled(device is not None)
         self.backup_button.setEnabled(device is not None)
+        self.savesbackup_button.setEnabled(device is not None)
+        self.savesrestore_button.setEnabled(device is not None)
         self.size_button.setEnabled(device is not None)
 
     def do_upload(self): 
@@ -66,13 +83,23 @@ class FxWidget(QWidget):
         if not filepath: return
 
         def do_work(device, repprog, repstatus):
+            if filepath.endswith(arduboy.fxsparse.FXSPARSE_EXTENSION):
+                # Sparse backups are restored as they are, a block at a time (so they can't be patched)
+                s_port = arduboy.serial.BootloaderSession(device.connect_serial())
+                repstatus("Restoring sparse FX backup...")
+                arduboy.serial.restore_fx_sparse(filepath, s_port, True, repprog)
+                arduboy.serial.exit_normal(s_port) 
+                return
             repstatus("Reading FX bin file...")
             flashbytes = arduboy.fxcart.read(filepath)
             gui_utils.screen_patch(flashbytes, self.ssd1309_cb, self.contrast_cb, self.contrast_picker)
-            s_port = device.connect_serial()
+            s_port = arduboy.serial.BootloaderSession(device.connect_serial())
             # TODO: Let users set the page number?
             repstatus("Uploading FX bin file...")
-            arduboy.serial.flash_fx(flashbytes, 0, s_port, True, repprog)
+            if self.diff_cb.isChecked():
+                arduboy.serial.flash_fx_diff(flashbytes, s_port, utils.get_fx_cache_dir(), True, repprog)
+            else:
+                arduboy.serial.flash_fx(flashbytes, 0, s_port, True, repprog)
             arduboy.serial.exit_normal(s_port) 
 
         dialog = widget_progress.do_progress_work(do_work, "Upload FX Flash")
@@ -85,13 +112,14 @@ class FxWidget(QWidget):
 
         def do_work(device, repprog, repstatus):
             repstatus("Saving FX Flash to file...")
-            s_port = device.connect_serial()
-            bindata = arduboy.serial.backup_fx(s_port, repprog)
-            if self.trim_cb.isChecked():
-                repstatus("Trimming FX file...")
-                bindata = arduboy.fxcart.trim(bindata)
-            with open (filepath,"wb") as f:
-                f.write(bindata)
+            s_port = arduboy.serial.BootloaderSession(device.connect_serial())
+            # Trimming only reads the part of the flash the cart uses. If this fails partway, backing up
+            # to the same file again picks up where it left off
+            if filepath.endswith(arduboy.fxsparse.FXSPARSE_EXTENSION):
+                # Erased flash isn't stored, the rest is compressed
+                arduboy.serial.backup_fx_sparse(s_port, filepath, self.trim_cb.isChecked(), repprog)
+            else:
+                arduboy.serial.backup_fx_to_file(s_port, filepath, self.trim_cb.isChecked(), repprog)
             arduboy.serial.exit_normal(s_port) 
 
         dialog = widget_progress.do_progress_work(do_work, "Backup FX Flash")
@@ -99,6 +127,47 @@ class FxWidget(QWidget):
             debug_actions.global_debug.add_action_str(f"Backed up Arduboy flashcart to {filepath}")
     
 
+    def do_savesbackup(self):
+        filepath = self.savesbackup_picker.check_filepath(self) 
+        if not filepath: return
+
+        saves = []
+
+        def do_work(device, repprog, repstatus):
+            nonlocal saves
+            repstatus("Reading game saves...")
+            s_port = arduboy.serial.BootloaderSession(device.connect_serial())
+            saves = arduboy.serial.harvest_fx_saves(s_port, repprog)
+            repstatus("Writing saves to filesystem...")
+            arduboy.fxcart.write_saves(filepath, saves)
+            arduboy.serial.exit_normal(s_port) 
+
+        dialog = widget_progress.do_progress_work(do_work, "Backup Game Saves")
+        if not dialog.error_state:
+            debug_actions.global_debug.add_action_str(f"Backed up {len(saves)} game saves to {filepath}")
+
+    def do_savesrestore(self):
+        filepath = self.savesrestore_picker.check_filepath(self) 
+        if not filepath: return
+
+        missing = []
+
+        def do_work(device, repprog, repstatus):
+            nonlocal missing
+            repstatus("Reading saves file...")
+            saves = arduboy.fxcart.read_saves(filepath)
+            s_port = arduboy.serial.BootloaderSession(device.connect_serial())
+            repstatus("Restoring game saves...")
+            missing = arduboy.serial.restore_fx_saves(saves, s_port, True, repprog)
+            arduboy.serial.exit_normal(s_port) 
+
+        dialog = widget_progress.do_progress_work(do_work, "Restore Game Saves")
+        if not dialog.error_state:
+            if missing:
+                titles = "\n".join(f"  {save.title}" for save in missing)
+                QMessageBox.warning(self, "Some saves not restored", f"These games aren't on the cart (or have changed), their saves were not restored:\n\n{titles}", QMessageBox.StandardButton.Ok)
+            debug_actions.global_debug.add_action_str(f"Restored game saves from {filepath} ({len(missing)} not restored)")
+
     def do_checksize(self):
 
         flashsize = 0
@@ -107,7 +176,7 @@ class FxWidget(QWidget):
         def do_work(device, repprog, repstatus):
             nonlocal flashsize, slots
             repstatus("Reading FX metadata...")
-            s_port = device.connect_serial()
+            s_port = arduboy.serial.BootloaderSession(device.connect_serial())
             flashsize, slots = arduboy.serial.scan_fx(s_port, None, repprog)
 
         dialog = widget_progress.do_progress_work(do_work, "Check FX flashcart data")
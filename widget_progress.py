@@ -1,10 +1,13 @@
 import arduboy.device
+import arduboy.metrics
 
 import gui_utils
 import gui_common
 
 import logging
 
+from contextlib import nullcontext
+
 from PyQt6.QtWidgets import   QPushButton, QLabel,  QDialog, QVBoxLayout, QProgressBar, QMessageBox
 from PyQt6.QtCore import Qt, QThread, pyqtSignal
 
@@ -85,12 +88,19 @@ class ProgressWorkerThread(QThread):
     update_device = pyqtSignal(str)
     report_error = pyqtSignal(Exception)
 
-    def __init__(self, work, simple = False):
+    def __init__(self, work, simple = False, title = None):
         super().__init__()
         self.work = work
         self.simple = simple
+        self.title = title
 
     def run(self):
+        # Serial metrics are only recorded if the user turned them on
+        metrics = arduboy.metrics.global_metrics
+        with metrics.operation(self.title) if metrics and self.title else nullcontext():
+            self.run_work()
+
+    def run_work(self):
         try:
             if self.simple:
                 # Yes, when simple, the work actually doesn't take the extra data. Be careful! This is dumb design!
@@ -119,7 +129,7 @@ def do_progress_work(work, title, simple = False, unknown_progress = False):
     dialog = ProgressWindow(title, simple = simple)
     if unknown_progress:
         dialog.progress_bar.setRange(0,0)
-    worker_thread = ProgressWorkerThread(work, simple = simple)
+    worker_thread = ProgressWorkerThread(work, simple = simple, title = title)
     worker_thread.connect(dialog)
     worker_thread.start()
     dialog.exec()
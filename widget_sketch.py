@@ -3,6 +3,7 @@ import arduboy.fxcart
 import arduboy.patch
 import arduboy.serial
 import arduboy.common
+import arduboy.job
 
 import gui_common
 import constants
@@ -39,6 +40,7 @@ class SketchWidget(QWidget):
         contrast_container, self.contrast_cb = gui_utils.make_toggleable_element("Patch contrast", self.contrast_picker, nostretch=True)
         self.ssd1309_cb = QCheckBox("Patch for screen SSD1309")
         self.microled_cb = QCheckBox("Patch for Micro LED polarity")
+        self.changedonly_cb = QCheckBox("Only write pages that changed (faster)")
 
         upload_about = QLabel("NOTE: FX games should be uploaded through the cart builder! This is ONLY for development!") #you should not use this endpoint to upload production FX games, only development images!")
         upload_about.setStyleSheet(f"color: {gui_common.SUBDUEDCOLOR}")
@@ -48,6 +50,7 @@ class SketchWidget(QWidget):
         upload_layout.addWidget(contrast_container)
         upload_layout.addWidget(self.ssd1309_cb)
         upload_layout.addWidget(self.microled_cb)
+        upload_layout.addWidget(self.changedonly_cb)
 
 
         # Backup sketch
@@ -89,16 +92,16 @@ class SketchWidget(QWidget):
                 fx_filepath = self.upload_fx_picker.check_filepath(self)
                 fx_data = arduboy.fxcart.read_data(fx_filepath)
                 logging.info("Adding FX data to cart")
-            s_port = device.connect_serial()
-            bindata = arduboy.common.pad_data(bindata, FLASH_PAGESIZE)
-            repstatus("Flashing sketch...")
-            arduboy.serial.flash_arduhex(bindata, s_port, repprog) 
-            repstatus("Verifying sketch...")
-            arduboy.serial.verify_arduhex(bindata, s_port, repprog) 
+            if self.changedonly_cb.isChecked():
+                # Verifies the pages it writes, the rest were already checked against the device
+                steps = [ arduboy.job.flash_sketch_step(bindata, changed_only = True) ]
+            else:
+                steps = [ arduboy.job.flash_sketch_step(bindata), arduboy.job.verify_sketch_step(bindata) ]
             if fx_data:
-                repstatus("Flashing FX dev data...")
-                arduboy.serial.flash_fx(fx_data, -1, s_port, report_progress=repprog)
-            arduboy.serial.exit_bootloader(s_port) # NOTE! THIS MIGHT BE THE ONLY PLACE WE EXIT THE BOOTLOADER!
+                steps.append(arduboy.job.flash_fx_step(fx_data))
+            steps.append(arduboy.job.exit_step()) # NOTE! THIS MIGHT BE THE ONLY PLACE WE EXIT THE BOOTLOADER!
+            # All one job, so the progress bar covers the whole upload
+            arduboy.job.run_job(steps, device.connect_serial(), repprog, repstatus)
 
         dialog = widget_progress.do_progress_work(do_work, "Upload Sketch")
         if not dialog.error_state:
@@ -111,7 +114,7 @@ class SketchWidget(QWidget):
 
         def do_work(device, _, repstatus):
             repstatus("Reading sketch...")
-            s_port = device.connect_serial()
+            s_port = arduboy.serial.BootloaderSession(device.connect_serial())
             sketchdata = arduboy.serial.backup_sketch(s_port, self.includebootloader_cb.isChecked())
             analysis = arduboy.arduhex.analyze_sketch(sketchdata)
             hexdata = arduboy.common.bin_to_hex(analysis.trimmed_data)
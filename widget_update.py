@@ -207,8 +207,8 @@ class UpdateWindow(QDialog):
 
     def apply_update(self, cartbin_new, cartbin_updates):
         # Decompile the binaries
-        parsed_updates = arduboy.fxcart.parse(cartbin_updates)
-        parsed_new = arduboy.fxcart.parse(cartbin_new)
+        parsed_updates = arduboy.fxcart.parse(cartbin_updates, zerocopy=True)
+        parsed_new = arduboy.fxcart.parse(cartbin_new, zerocopy=True)
         # Simple: if your cart doesn't start with a category, add the bootloader category given by the cartbin
         if len(self.original_slots) == 0 or not self.original_slots[0].is_category():
             self.cartwindow._add_slot_signal.emit(parsed_new[0], False)